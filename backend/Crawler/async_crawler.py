@@ -0,0 +1,345 @@
+"""
+非同步學群爬蟲
+以共用連線池的 httpx.AsyncClient 並行抓取學群頁面，每個主機以令牌桶限速，
+失敗時以指數退避重試，並定期回報進度；以 extractor.py 單次走訪擷取已清理的欄位。
+指定頁面快取時送出條件式請求，未變更的頁面不重新解析，並輸出學群變更清單
+
+使用方式:
+    python async_crawler.py                                   # 抓取 ColleGo 正式網站
+    python async_crawler.py --base-url http://127.0.0.1:8765  # 抓取本機測試頁面
+    python async_crawler.py --save-fixtures fixtures          # 同時保存頁面供離線測試
+    python async_crawler.py --cache page_cache                # 增量抓取並輸出 changes.json
+    python async_crawler.py --kb-dir ../kb                    # 同時寫入新版本的欄式知識庫
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+import httpx
+import pandas as pd
+
+from college import failed_details
+from extractor import EXTRACTOR_VERSION, extract_college_details, extract_college_list
+from page_cache import PageCache
+
+DEFAULT_BASE_URL = "https://collego.edu.tw"
+LIST_PATH = "/Highschool/CollegeList"
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8",
+    "Accept-Language": "zh-TW,zh;q=0.9,en-US;q=0.8,en;q=0.7",
+}
+# 這些狀態碼視為暫時性錯誤，會重試
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """令牌桶限速器：平均每秒 rate 個請求，允許短時間內連續 burst 個"""
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        """取得一個令牌，不足時等待補充"""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity,
+                                  self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class AsyncCollegeCrawler:
+    """非同步學群爬蟲類別"""
+
+    def __init__(self, base_url: str = DEFAULT_BASE_URL,
+                 concurrency: int = 4,
+                 rate_per_host: float = 1.0,
+                 burst: int = 2,
+                 max_retries: int = 3,
+                 backoff: float = 1.0,
+                 timeout: float = 30.0,
+                 save_fixtures: Optional[str] = None,
+                 cache_dir: Optional[str] = None):
+        """
+        初始化爬蟲
+
+        參數:
+            base_url: 網站根網址
+            concurrency: 同時進行的請求數上限
+            rate_per_host: 每個主機每秒平均請求數
+            burst: 每個主機允許的連續請求數
+            max_retries: 暫時性錯誤的最多重試次數
+            backoff: 指數退避的基準秒數
+            timeout: 單次請求逾時秒數
+            save_fixtures: 保存抓取頁面的目錄（可選，供本機測試伺服器使用）
+            cache_dir: 頁面快取目錄（可選），提供時以條件式請求增量抓取
+        """
+        self.base_url = base_url.rstrip("/")
+        self.concurrency = concurrency
+        self.rate_per_host = rate_per_host
+        self.burst = burst
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.save_dir = Path(save_fixtures) if save_fixtures else None
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._manifest: Dict[str, str] = {}
+        self.cache = PageCache(cache_dir) if cache_dir else None
+        self.stats = {"requests": 0, "retries": 0, "failures": 0,
+                      "bytes_fetched": 0, "pages_parsed": 0,
+                      "not_modified": 0, "unchanged": 0}
+        self.changes: Dict = {}
+
+    def _bucket(self, url: str) -> TokenBucket:
+        host = urlsplit(url).netloc
+        if host not in self._buckets:
+            self._buckets[host] = TokenBucket(self.rate_per_host, self.burst)
+        return self._buckets[host]
+
+    def _retry_delay(self, attempt: int, response: Optional[httpx.Response]) -> float:
+        """計算重試等待秒數：優先採用 Retry-After，否則指數退避加隨機抖動"""
+        if response is not None:
+            retry_after = response.headers.get("Retry-After")
+            if retry_after and retry_after.isdigit():
+                return float(retry_after)
+        return self.backoff * (2 ** attempt) * (0.5 + random.random())
+
+    async def fetch(self, client: httpx.AsyncClient, url: str) -> Tuple[str, bool]:
+        """
+        抓取單一頁面（限速、限制並行數並重試暫時性錯誤）
+
+        參數:
+            client: 共用的 HTTP 用戶端
+            url: 頁面網址
+
+        返回:
+            (頁面 HTML, 內容是否與快取不同)；未使用快取時一律視為不同
+        """
+        headers = self.cache.conditional_headers(url) if self.cache else {}
+        for attempt in range(self.max_retries + 1):
+            response = None
+            await self._bucket(url).acquire()
+            async with self._semaphore:
+                try:
+                    self.stats["requests"] += 1
+                    response = await client.get(url, headers=headers)
+                    if response.status_code == 304 and headers:
+                        self.stats["not_modified"] += 1
+                        return self.cache.read_body(url).decode('utf-8'), False
+                    if response.status_code not in RETRY_STATUS:
+                        response.raise_for_status()
+                        response.encoding = 'utf-8'
+                        self.stats["bytes_fetched"] += len(response.content)
+                        self._save_fixture(url, response.content)
+                        changed = True
+                        if self.cache is not None:
+                            changed = self.cache.put(
+                                url, response.content,
+                                response.headers.get("ETag"),
+                                response.headers.get("Last-Modified"))
+                            if not changed:
+                                self.stats["unchanged"] += 1
+                        return response.text, changed
+                    error = f"HTTP {response.status_code}"
+                except httpx.RequestError as e:
+                    error = str(e) or type(e).__name__
+            if attempt == self.max_retries:
+                raise httpx.HTTPError(f"重試 {self.max_retries} 次後仍失敗: {error}")
+            delay = self._retry_delay(attempt, response)
+            self.stats["retries"] += 1
+            print(f"抓取 {url} 失敗（{error}），{delay:.1f} 秒後重試")
+            await asyncio.sleep(delay)
+
+    def _save_fixture(self, url: str, content: bytes):
+        if self.save_dir is None:
+            return
+        parts = urlsplit(url)
+        path = parts.path + (f"?{parts.query}" if parts.query else "")
+        name = path.strip("/").split("/")[-1].replace("?", "_").replace("=", "_") + ".html"
+        self.save_dir.mkdir(parents=True, exist_ok=True)
+        (self.save_dir / name).write_bytes(content)
+        self._manifest[path] = name
+        with open(self.save_dir / "manifest.json", 'w', encoding='utf-8') as f:
+            json.dump(self._manifest, f, ensure_ascii=False, indent=2)
+
+    async def crawl(self) -> List[Dict]:
+        """
+        抓取學群列表後並行抓取所有學群的詳細資訊
+
+        返回:
+            依列表順序排列的學群詳細資訊
+        """
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        limits = httpx.Limits(max_connections=self.concurrency,
+                              max_keepalive_connections=self.concurrency)
+        list_url = f"{self.base_url}{LIST_PATH}"
+        start = time.monotonic()
+        async with httpx.AsyncClient(headers=HEADERS, timeout=self.timeout,
+                                     limits=limits, follow_redirects=True) as client:
+            print(f"正在訪問 {list_url}")
+            try:
+                html, _ = await self.fetch(client, list_url)
+                college_groups = extract_college_list(html, list_url)
+            except httpx.HTTPError as e:
+                print(f"網路請求錯誤: {e}")
+                return []
+            if not college_groups:
+                print("未找到任何學群資料，請確認網站結構是否變更")
+                return []
+            print(f"成功提取 {len(college_groups)} 個學群資訊")
+
+            total = len(college_groups)
+            done = 0
+            page_status: Dict[str, str] = {}
+
+            async def crawl_one(group: Dict) -> Dict:
+                nonlocal done
+                link = group['link']
+                cached = self.cache.get(link) if self.cache else None
+                try:
+                    html, changed = await self.fetch(client, link)
+                    reusable = cached and cached.get("record") and \
+                        cached.get("record_version") == EXTRACTOR_VERSION
+                    if not changed and reusable:
+                        # 內容未變更，直接沿用上次擷取的紀錄
+                        details = dict(cached["record"])
+                        page_status[link] = "unchanged"
+                    else:
+                        details = extract_college_details(html, link).to_dict()
+                        self.stats["pages_parsed"] += 1
+                        if not changed and details == (cached or {}).get("record"):
+                            # 僅擷取邏輯更新，重新擷取的紀錄與先前相同
+                            page_status[link] = "unchanged"
+                        elif not changed:
+                            # 內容未變更但擷取邏輯更新使紀錄不同，須視為修改才會重寫 CSV 與知識庫
+                            page_status[link] = "modified"
+                        else:
+                            page_status[link] = "modified" if cached else "added"
+                        if self.cache is not None:
+                            self.cache.set_record(link, details, EXTRACTOR_VERSION)
+                except Exception as e:
+                    print(f"抓取 URL {link} 時發生錯誤: {e}")
+                    self.stats["failures"] += 1
+                    # 抓取失敗時沿用上次的紀錄，避免下游誤判為移除
+                    if cached and cached.get("record"):
+                        details = dict(cached["record"])
+                    else:
+                        details = failed_details()
+                    page_status[link] = "failed"
+                details['link'] = link
+                done += 1
+                elapsed = time.monotonic() - start
+                print(f"[{done}/{total}] {details['group_name']} 完成，"
+                      f"已耗時 {elapsed:.1f} 秒（{done / elapsed:.2f} 頁/秒，"
+                      f"重試 {self.stats['retries']} 次）")
+                return details
+
+            all_details = await asyncio.gather(*(crawl_one(g) for g in college_groups))
+
+        self.stats["elapsed"] = time.monotonic() - start
+        all_details = list(all_details)
+        if self.cache is not None:
+            self.changes = self._change_list(all_details, page_status)
+            self.cache.last_groups = {d['link']: d['group_name'] for d in all_details}
+            self.cache.save()
+        return all_details
+
+    def _change_list(self, all_details: List[Dict], page_status: Dict[str, str]) -> Dict:
+        """
+        比對上次抓取結果，整理新增、修改與移除的學群
+
+        上次抓取過但本次列表中已不存在的連結視為移除；頁面新出現於快取者視為新增
+        """
+        previous = self.cache.last_groups
+        current = {d['link'] for d in all_details}
+
+        def describe(status: str) -> List[Dict]:
+            return [{"group_name": d['group_name'], "link": d['link']}
+                    for d in all_details if page_status.get(d['link']) == status]
+
+        return {
+            "generated_at": datetime.now().isoformat(),
+            "added": describe("added"),
+            "modified": describe("modified"),
+            "removed": [{"group_name": name, "link": link}
+                        for link, name in previous.items() if link not in current],
+            "unchanged": len(describe("unchanged")),
+            "failed": describe("failed"),
+            "stats": {k: self.stats[k] for k in
+                      ("bytes_fetched", "pages_parsed", "not_modified", "unchanged",
+                       "requests", "retries", "failures")}
+        }
+
+
+def save_details(all_details: List[Dict], output: str = 'college_details_ALL.csv'):
+    """將學群詳細資訊保存為 CSV"""
+    df = pd.DataFrame(all_details)
+    df.to_csv(output, index=False, encoding='utf-8-sig')
+    print(f"資料已成功保存到 {output}")
+
+
+def save_knowledge_base(all_details: List[Dict], kb_dir: str, source: str) -> str:
+    """將學群詳細資訊寫入欄式知識庫（服務端使用的正式格式）"""
+    import sys
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+    from kb_store import DEFAULT_COLUMNS, write_knowledge_base
+
+    columns = {name: [str(d.get(name, "")) for d in all_details] for name in DEFAULT_COLUMNS}
+    version = write_knowledge_base(kb_dir, columns, source=source)
+    print(f"知識庫版本 {version} 已寫入 {kb_dir}")
+    return version
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="非同步抓取 ColleGo 學群資訊")
+    parser.add_argument("--base-url", default=DEFAULT_BASE_URL)
+    parser.add_argument("--output", default="college_details_ALL.csv")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--rate", type=float, default=1.0, help="每個主機每秒請求數")
+    parser.add_argument("--burst", type=int, default=2)
+    parser.add_argument("--retries", type=int, default=3)
+    parser.add_argument("--save-fixtures", default=None)
+    parser.add_argument("--cache", default=None, help="頁面快取目錄，提供時增量抓取")
+    parser.add_argument("--changes", default="changes.json", help="變更清單輸出路徑")
+    parser.add_argument("--kb-dir", default=None, help="欄式知識庫目錄，提供時寫入新版本")
+    args = parser.parse_args()
+
+    crawler = AsyncCollegeCrawler(
+        args.base_url, concurrency=args.concurrency, rate_per_host=args.rate,
+        burst=args.burst, max_retries=args.retries, save_fixtures=args.save_fixtures,
+        cache_dir=args.cache)
+    results = asyncio.run(crawler.crawl())
+    if results:
+        if crawler.cache is None or crawler.changes["added"] or \
+                crawler.changes["modified"] or crawler.changes["removed"]:
+            save_details(results, args.output)
+            if args.kb_dir:
+                save_knowledge_base(results, args.kb_dir, args.base_url)
+        else:
+            print("學群資料沒有變更，保留既有的 CSV")
+        if crawler.cache is not None:
+            with open(args.changes, 'w', encoding='utf-8') as f:
+                json.dump(crawler.changes, f, ensure_ascii=False, indent=2)
+            print(f"新增 {len(crawler.changes['added'])}、修改 {len(crawler.changes['modified'])}、"
+                  f"移除 {len(crawler.changes['removed'])} 個學群，變更清單已保存到 {args.changes}")
+        print(f"成功抓取 {len(results)} 個學群的詳細資訊，"
+              f"下載 {crawler.stats['bytes_fetched']} 位元組，解析 {crawler.stats['pages_parsed']} 頁，"
+              f"統計: {crawler.stats}")
+    else:
+        print("未抓取到任何學群詳細資訊")
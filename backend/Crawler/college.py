@@ -4,6 +4,38 @@ from bs4 import BeautifulSoup
 import pandas as pd
 import time
 from typing import List, Dict
+from urllib.parse import urljoin
+
+from extractor import extract_college_details
+
+
+def parse_college_list(html: str, base_url: str = "https://collego.edu.tw/Highschool/CollegeList") -> List[Dict]:
+    """
+    解析學群列表頁面。
+
+    參數:
+        html: 列表頁面 HTML
+        base_url: 列表頁面的 URL，用於組成詳細頁面的完整連結
+
+    回傳:
+        包含學群名稱和連結的列表
+    """
+    soup = BeautifulSoup(html, 'html.parser')
+    groups = soup.find_all(
+        'a', class_='section__content-item mx-md-6 mx-0')
+
+    college_groups = []
+    for group in groups:
+        group_info = {}
+
+        label = group.find('label', class_='section__content-label')
+        group_info['group_name'] = label.text.strip() if label else "未知學群"
+
+        group_info['link'] = urljoin(base_url, group['href']) if 'href' in group.attrs else "無連結"
+
+        college_groups.append(group_info)
+
+    return college_groups
 
 
 def scrape_college_list(url: str = "https://collego.edu.tw/Highschool/CollegeList") -> List[Dict]:
@@ -28,25 +60,11 @@ def scrape_college_list(url: str = "https://collego.edu.tw/Highschool/CollegeLis
             return []
 
         response.encoding = 'utf-8'
-        soup = BeautifulSoup(response.text, 'html.parser')
-        groups = soup.find_all(
-            'a', class_='section__content-item mx-md-6 mx-0')
-
-        if not groups:
+        college_groups = parse_college_list(response.text, url)
+        if not college_groups:
             print("未找到任何學群資料，請確認網站結構是否變更")
             return []
 
-        college_groups = []
-        for group in groups:
-            group_info = {}
-
-            label = group.find('label', class_='section__content-label')
-            group_info['group_name'] = label.text.strip() if label else "未知學群"
-
-            group_info['link'] = f"https://collego.edu.tw{group['href']}" if 'href' in group.attrs else "無連結"
-
-            college_groups.append(group_info)
-
         print(f"成功提取 {len(college_groups)} 個學群資訊")
         return college_groups
 
@@ -58,9 +76,121 @@ def scrape_college_list(url: str = "https://collego.edu.tw/Highschool/CollegeLis
         return []
 
 
+def failed_details() -> Dict:
+    """抓取失敗時的預設學群資訊"""
+    return {
+        "group_name": "抓取失敗",
+        "introduction": "抓取失敗",
+        "learning_content": "抓取失敗",
+        "related_groups": [],
+        "compare_subjects": "抓取失敗",
+        "important_subjects": "抓取失敗",
+        "chart_description": "抓取失敗"
+    }
+
+
+def parse_college_details(html: str, verbose: bool = True) -> Dict:
+    """
+    解析單個學群的詳細頁面。
+
+    參數:
+        html: 學群詳細頁面 HTML
+        verbose: 是否印出各欄位的抓取結果
+
+    回傳:
+        包含學群詳細資訊的字典
+    """
+    log = print if verbose else (lambda *args: None)
+    soup = BeautifulSoup(html, 'html.parser')
+
+    details = {}
+
+    # 學群名稱
+    group_name = soup.find(style="font-size:22pt")
+    details['group_name'] = group_name.text.strip(
+    ) if group_name else "無法抓取學群名稱"
+    log(f"1. 抓取學群名稱: {details['group_name']}")
+
+    # 簡介
+    intro = soup.find('dd', class_='col-md-10')
+    details['introduction'] = intro.text.strip() if intro else "無簡介"
+    log(f"2. 抓取簡介: {details['introduction']}")
+
+    # 學習內容
+    learning_section = soup.find_all('dl', class_='row')
+    if learning_section:
+        learning_content = []
+        for section in learning_section:
+            dd_items = section.find_all('dd')
+            learning_content += [dd.text.strip() for dd in dd_items]
+        details['learning_content'] = "\n".join(learning_content)
+    else:
+        details['learning_content'] = "無學習內容"
+    log(f"3. 抓取學習內容: {details['learning_content']}")
+
+    # 抓取所有相關學群
+    related_groups_sections = soup.find_all(
+        'a',
+        style=lambda value: 'font-size:1.3em' in value if value else False,
+        target='_blank'
+    )
+    if related_groups_sections:
+        related_groups = []
+        for section in related_groups_sections:
+            # 提取 <u> 標籤內文字
+            u_items = section.find_all('u')
+            related_groups.extend([u.text.strip() for u in u_items])
+
+        details['related_groups'] = "\n".join(
+            related_groups) if related_groups else "無相關學群"
+    else:
+        details['related_groups'] = "無相關學群"
+
+    log(f"4. 抓取相關學群: {details['related_groups']}")
+
+    # 比較科目
+    compare_subjects = []  # 初始化空陣列
+    count_title_items = soup.find_all(
+        'h4', class_='count-title')  # 抓取所有 h4 標籤
+    if count_title_items:
+        for item in count_title_items:
+            text = re.sub(r'<.*?>', '', str(item))  # 使用正規表達式去除標籤
+            compare_subjects.append(text.strip())  # 移除標籤後的純文字
+        details['compare_subjects'] = "\n".join(
+            compare_subjects)  # 將陣列轉為字串
+    else:
+        details['compare_subjects'] = "無比較科目"
+    log(f"5. 抓取比較科目: {details['compare_subjects']}")
+
+    # 重點科目
+    important_subjects = []  # 初始化空陣列
+    nobr_items = soup.find_all('nobr')  # 抓取所有 nobr 標籤
+    if nobr_items:
+        for item in nobr_items:
+            text = re.sub(r'<.*?>', '', str(item))  # 使用正規表達式去除標籤
+            important_subjects.append(text.strip())  # 移除標籤後的純文字
+        details['important_subjects'] = "\n".join(
+            important_subjects)  # 將陣列轉為字串
+    else:
+        details['important_subjects'] = "無重點科目"
+    log(f"6. 抓取重點科目: {details['important_subjects']}")
+
+    # 學群內關聯圖表描述
+    chart_section = soup.find('dd', class_='col-md-5')
+    chart_description = chart_section.text.strip() if chart_section else "無圖表描述"
+    log(f"7. 抓取圖表描述: {chart_description}")
+
+    # 整合更多資訊
+    details['compare_contents'] = count_title_items
+    details['important_contents'] = nobr_items
+    details['chart_description'] = chart_description
+
+    return details
+
+
 def scrape_college_details(url: str, headers: Dict) -> Dict:
     """
-    抓取單個學群的詳細資訊。
+    抓取單個學群的詳細資訊（以 extractor 擷取已清理的紀錄，不含 HTML 標籤）。
 
     參數:
         url: 學群詳細頁面的 URL
@@ -72,103 +202,12 @@ def scrape_college_details(url: str, headers: Dict) -> Dict:
     try:
         response = requests.get(url, headers=headers)
         response.raise_for_status()
-        soup = BeautifulSoup(response.text, 'html.parser')
-
-        details = {}
-
-        # 學群名稱
-        group_name = soup.find(style="font-size:22pt")
-        details['group_name'] = group_name.text.strip(
-        ) if group_name else "無法抓取學群名稱"
-        print(f"1. 抓取學群名稱: {details['group_name']}")
-
-        # 簡介
-        intro = soup.find('dd', class_='col-md-10')
-        details['introduction'] = intro.text.strip() if intro else "無簡介"
-        print(f"2. 抓取簡介: {details['introduction']}")
-
-        # 學習內容
-        learning_section = soup.find_all('dl', class_='row')
-        if learning_section:
-            learning_content = []
-            for section in learning_section:
-                dd_items = section.find_all('dd')
-                learning_content += [dd.text.strip() for dd in dd_items]
-            details['learning_content'] = "\n".join(learning_content)
-        else:
-            details['learning_content'] = "無學習內容"
-        print(f"3. 抓取學習內容: {details['learning_content']}")
-
-        # 抓取所有相關學群
-        related_groups_sections = soup.find_all(
-            'a',
-            style=lambda value: 'font-size:1.3em' in value if value else False,
-            target='_blank'
-        )
-        if related_groups_sections:
-            related_groups = []
-            for section in related_groups_sections:
-                # 提取 <u> 標籤內文字
-                u_items = section.find_all('u')
-                related_groups.extend([u.text.strip() for u in u_items])
-
-            details['related_groups'] = "\n".join(
-                related_groups) if related_groups else "無相關學群"
-        else:
-            details['related_groups'] = "無相關學群"
-
-        print(f"4. 抓取相關學群: {details['related_groups']}")
-
-        # 比較科目
-        compare_subjects = []  # 初始化空陣列
-        count_title_items = soup.find_all(
-            'h4', class_='count-title')  # 抓取所有 h4 標籤
-        if count_title_items:
-            for item in count_title_items:
-                text = re.sub(r'<.*?>', '', str(item))  # 使用正規表達式去除標籤
-                compare_subjects.append(text.strip())  # 移除標籤後的純文字
-            details['compare_subjects'] = "\n".join(
-                compare_subjects)  # 將陣列轉為字串
-        else:
-            details['compare_subjects'] = "無比較科目"
-        print(f"5. 抓取比較科目: {details['compare_subjects']}")
-
-        # 重點科目
-        important_subjects = []  # 初始化空陣列
-        nobr_items = soup.find_all('nobr')  # 抓取所有 nobr 標籤
-        if nobr_items:
-            for item in nobr_items:
-                text = re.sub(r'<.*?>', '', str(item))  # 使用正規表達式去除標籤
-                important_subjects.append(text.strip())  # 移除標籤後的純文字
-            details['important_subjects'] = "\n".join(
-                important_subjects)  # 將陣列轉為字串
-        else:
-            details['important_subjects'] = "無重點科目"
-        print(f"6. 抓取重點科目: {details['important_subjects']}")
-
-        # 學群內關聯圖表描述
-        chart_section = soup.find('dd', class_='col-md-5')
-        chart_description = chart_section.text.strip() if chart_section else "無圖表描述"
-        print(f"7. 抓取圖表描述: {chart_description}")
-
-        # 整合更多資訊
-        details['compare_contents'] = count_title_items
-        details['important_contents'] = nobr_items
-        details['chart_description'] = chart_description
-
-        return details
+        response.encoding = 'utf-8'
+        return extract_college_details(response.text, url).to_dict()
 
     except Exception as e:
         print(f"抓取 URL {url} 時發生錯誤: {e}")
-        return {
-            "group_name": "抓取失敗",
-            "introduction": "抓取失敗",
-            "learning_content": "抓取失敗",
-            "related_groups": [],
-            "compare_subjects": "抓取失敗",
-            "important_subjects": "抓取失敗",
-            "chart_description": "抓取失敗"
-        }
+        return failed_details()
 
 
 def scrape_all_college_details() -> List[Dict]:
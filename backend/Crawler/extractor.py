@@ -0,0 +1,192 @@
+"""
+學群頁面擷取
+以 lxml 解析頁面，於單次走訪中收集所有欄位，輸出已清理的型別化紀錄（不含任何 HTML 標籤）
+
+使用方式:
+    python extractor.py --benchmark            # 比較 html.parser 與 lxml 擷取的每頁解析時間
+    python extractor.py fixtures/CollegeIntro_1.html
+"""
+import argparse
+import json
+import re
+import time
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional
+from urllib.parse import urljoin
+
+from lxml import html as lxml_html
+
+# 擷取邏輯變更時遞增，讓頁面快取中的舊紀錄失效
+EXTRACTOR_VERSION = 2
+
+_WHITESPACE = re.compile(r'[ \t\r\f\v\u00a0\u3000]+')
+
+
+def clean_text(text: Optional[str]) -> str:
+    """清理文字：不換行空白轉為一般空白、合併連續空白、去除每行首尾空白與空行"""
+    if not text:
+        return ""
+    lines = (_WHITESPACE.sub(" ", line).strip() for line in text.splitlines())
+    return "\n".join(line for line in lines if line)
+
+
+@dataclass
+class CollegeRecord:
+    """單一學群的擷取結果"""
+    group_name: str = "無法抓取學群名稱"
+    introduction: str = "無簡介"
+    learning_content: List[str] = field(default_factory=list)
+    related_groups: List[str] = field(default_factory=list)
+    compare_subjects: List[str] = field(default_factory=list)
+    important_subjects: List[str] = field(default_factory=list)
+    chart_description: str = "無圖表描述"
+    link: str = ""
+
+    def to_dict(self) -> Dict[str, str]:
+        """轉為 CSV 列：列表欄位以換行串接，空列表使用與原爬蟲相同的預設文字"""
+        row = asdict(self)
+        row["learning_content"] = "\n".join(self.learning_content) or "無學習內容"
+        row["related_groups"] = "\n".join(self.related_groups) or "無相關學群"
+        row["compare_subjects"] = "\n".join(self.compare_subjects) or "無比較科目"
+        row["important_subjects"] = "\n".join(self.important_subjects) or "無重點科目"
+        return row
+
+
+def _classes(element) -> List[str]:
+    return (element.get("class") or "").split()
+
+
+def extract_college_list(page: str, base_url: str) -> List[Dict[str, str]]:
+    """
+    擷取學群列表頁面的學群名稱與連結
+
+    參數:
+        page: 列表頁面 HTML
+        base_url: 列表頁面的 URL
+
+    返回:
+        [{"group_name", "link"}, ...]
+    """
+    root = lxml_html.fromstring(page)
+    groups = []
+    for anchor in root.iter("a"):
+        if not {"section__content-item", "mx-md-6", "mx-0"} <= set(_classes(anchor)):
+            continue
+        label = next((e for e in anchor.iter("label")
+                      if "section__content-label" in _classes(e)), None)
+        href = anchor.get("href")
+        groups.append({
+            "group_name": clean_text(label.text_content()) if label is not None else "未知學群",
+            "link": urljoin(base_url, href) if href else "無連結"
+        })
+    return groups
+
+
+def extract_college_details(page: str, link: str = "") -> CollegeRecord:
+    """
+    以單次走訪擷取學群詳細頁面的所有欄位
+
+    參數:
+        page: 學群詳細頁面 HTML
+        link: 頁面網址
+
+    返回:
+        CollegeRecord
+    """
+    root = lxml_html.fromstring(page)
+    record = CollegeRecord(link=link)
+    title = intro = chart = None
+
+    for element in root.iter():
+        tag = element.tag
+        if not isinstance(tag, str):
+            continue  # 註解與處理指令
+        style = element.get("style") or ""
+
+        if title is None and style == "font-size:22pt":
+            title = element
+            record.group_name = clean_text(element.text_content())
+        elif tag == "dd":
+            classes = _classes(element)
+            if intro is None and "col-md-10" in classes:
+                intro = element
+                record.introduction = clean_text(element.text_content())
+            if chart is None and "col-md-5" in classes:
+                chart = element
+                record.chart_description = clean_text(element.text_content())
+            parent = element.getparent()
+            if parent is not None and parent.tag == "dl" and "row" in _classes(parent):
+                text = clean_text(element.text_content())
+                if text:
+                    record.learning_content.extend(text.split("\n"))
+        elif tag == "a":
+            if "font-size:1.3em" in style and element.get("target") == "_blank":
+                record.related_groups.extend(
+                    clean_text(u.text_content()) for u in element.iter("u"))
+        elif tag == "h4":
+            if "count-title" in _classes(element):
+                record.compare_subjects.append(clean_text(element.text_content()))
+        elif tag == "nobr":
+            # 略過標題與「加入比較清單」按鈕，只保留科目
+            # （走訪時 nobr 先於其中的標題元素，須檢查子孫而非等標題被找到）
+            if any((e.get("style") or "") == "font-size:22pt" for e in element.iter("b")):
+                continue
+            if any((a.get("href") or "").startswith("javascript:") for a in element.iter("a")):
+                continue
+            text = clean_text(element.text_content())
+            if text:
+                record.important_subjects.append(text)
+
+    record.related_groups = [g for g in record.related_groups if g]
+    return record
+
+
+def benchmark(fixture_dir: Path, repeat: int = 20) -> Dict[str, float]:
+    """
+    比較原本的 BeautifulSoup(html.parser) 擷取與 lxml 單次走訪擷取的每頁解析時間
+
+    參數:
+        fixture_dir: 含學群詳細頁面的目錄
+        repeat: 每頁重複解析次數
+
+    返回:
+        {"pages", "html_parser_ms_per_page", "lxml_ms_per_page", "speedup"}
+    """
+    from college import parse_college_details
+
+    pages = [p.read_text(encoding='utf-8') for p in sorted(fixture_dir.glob("CollegeIntro_*.html"))]
+    if not pages:
+        raise FileNotFoundError(f"{fixture_dir} 中沒有學群詳細頁面")
+
+    def per_page_ms(parse) -> float:
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for page in pages:
+                parse(page)
+        return (time.perf_counter() - start) * 1000 / (repeat * len(pages))
+
+    old_ms = per_page_ms(lambda page: parse_college_details(page, verbose=False))
+    new_ms = per_page_ms(extract_college_details)
+    return {
+        "pages": len(pages),
+        "html_parser_ms_per_page": round(old_ms, 3),
+        "lxml_ms_per_page": round(new_ms, 3),
+        "speedup": round(old_ms / new_ms, 2) if new_ms else 0.0
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="擷取學群頁面或測量解析時間")
+    parser.add_argument("pages", nargs="*", help="要擷取的頁面檔案")
+    parser.add_argument("--benchmark", action="store_true")
+    parser.add_argument("--fixtures", default=str(Path(__file__).parent / "fixtures"))
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    if args.benchmark:
+        print(json.dumps(benchmark(Path(args.fixtures), args.repeat),
+                         ensure_ascii=False, indent=2))
+    for path in args.pages:
+        record = extract_college_details(Path(path).read_text(encoding='utf-8'))
+        print(json.dumps(asdict(record), ensure_ascii=False, indent=2))
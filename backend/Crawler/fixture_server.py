@@ -0,0 +1,124 @@
+"""
+本機測試用的 ColleGo 頁面伺服器
+依 fixtures/manifest.json 將請求路徑（含查詢字串）對應到已儲存的頁面，
+可設定回應延遲與前幾次請求回傳 503，用於測試爬蟲的並行、限速與重試；
+回應附 ETag/Last-Modified 並支援條件式請求（304）
+
+使用方式:
+    python fixture_server.py --port 8765
+    python async_crawler.py --base-url http://127.0.0.1:8765
+"""
+import argparse
+import hashlib
+import json
+import threading
+import time
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, Optional
+
+FIXTURE_DIR = Path(__file__).parent / "fixtures"
+
+
+class FixtureServer:
+    """以執行緒執行的靜態頁面伺服器"""
+
+    def __init__(self, fixture_dir: Path = FIXTURE_DIR, port: int = 0,
+                 delay: float = 0.0, fail_first: int = 0):
+        """
+        初始化伺服器
+
+        參數:
+            fixture_dir: 含 manifest.json 與頁面檔案的目錄
+            port: 監聽埠號（0 表示自動分配）
+            delay: 每個回應的延遲秒數
+            fail_first: 每個路徑前幾次請求回傳 503
+        """
+        self.fixture_dir = Path(fixture_dir)
+        with open(self.fixture_dir / "manifest.json", 'r', encoding='utf-8') as f:
+            self.routes: Dict[str, str] = json.load(f)
+        self.delay = delay
+        self.fail_first = fail_first
+        self.requests: Dict[str, int] = {}
+        self.max_in_flight = 0
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                with server._lock:
+                    count = server.requests.get(self.path, 0) + 1
+                    server.requests[self.path] = count
+                    server._in_flight += 1
+                    server.max_in_flight = max(server.max_in_flight, server._in_flight)
+                try:
+                    if server.delay:
+                        time.sleep(server.delay)
+                    name = server.routes.get(self.path)
+                    if name is None:
+                        self.send_error(404)
+                        return
+                    if count <= server.fail_first:
+                        self.send_error(503)
+                        return
+                    path = server.fixture_dir / name
+                    body = path.read_bytes()
+                    etag = f'"{hashlib.md5(body).hexdigest()}"'
+                    last_modified = formatdate(int(path.stat().st_mtime), usegmt=True)
+                    if self.headers.get("If-None-Match") == etag:
+                        self.send_response(304)
+                        self.send_header("ETag", etag)
+                        self.end_headers()
+                        return
+                    self.send_response(200)
+                    self.send_header("ETag", etag)
+                    self.send_header("Last-Modified", last_modified)
+                    self.send_header("Content-Type", "text/html; charset=utf-8")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                finally:
+                    with server._lock:
+                        server._in_flight -= 1
+
+        return Handler
+
+    def start(self) -> "FixtureServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="本機 ColleGo 測試頁面伺服器")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--fixtures", default=str(FIXTURE_DIR))
+    parser.add_argument("--delay", type=float, default=0.0)
+    parser.add_argument("--fail-first", type=int, default=0)
+    args = parser.parse_args()
+
+    server = FixtureServer(Path(args.fixtures), args.port, args.delay, args.fail_first).start()
+    print(f"測試頁面伺服器啟動於 {server.url}")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.stop()
@@ -0,0 +1,109 @@
+"""
+爬蟲頁面快取
+以 URL 為鍵保存頁面內容、ETag/Last-Modified、內容指紋與解析後的紀錄，
+供下次抓取時送出條件式請求並略過未變更頁面的解析
+"""
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+from typing import Dict, Optional
+
+
+def fingerprint(content: bytes) -> str:
+    """頁面內容指紋"""
+    return hashlib.sha256(content).hexdigest()
+
+
+class PageCache:
+    """頁面快取類別"""
+
+    def __init__(self, cache_dir: str = "page_cache"):
+        """
+        初始化頁面快取
+
+        參數:
+            cache_dir: 快取目錄（index.json 與 pages/ 下的頁面內容）
+        """
+        self.cache_dir = Path(cache_dir)
+        self.pages_dir = self.cache_dir / "pages"
+        self.pages_dir.mkdir(parents=True, exist_ok=True)
+        self.index_path = self.cache_dir / "index.json"
+        self.entries: Dict[str, Dict] = {}
+        # 上次抓取的學群 {連結: 學群名稱}，用於找出被移除的學群
+        self.last_groups: Dict[str, str] = {}
+        if self.index_path.exists():
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self.entries = data.get("entries", {})
+            self.last_groups = data.get("last_groups", {})
+
+    @staticmethod
+    def _key(url: str) -> str:
+        return hashlib.sha1(url.encode('utf-8')).hexdigest()
+
+    def get(self, url: str) -> Optional[Dict]:
+        """取得快取項目（不含頁面內容）"""
+        return self.entries.get(url)
+
+    def conditional_headers(self, url: str) -> Dict[str, str]:
+        """依快取項目組成條件式請求標頭"""
+        entry = self.entries.get(url)
+        headers = {}
+        if entry and self.has_body(url):
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def has_body(self, url: str) -> bool:
+        return (self.pages_dir / f"{self._key(url)}.html").exists()
+
+    def read_body(self, url: str) -> bytes:
+        return (self.pages_dir / f"{self._key(url)}.html").read_bytes()
+
+    def put(self, url: str, content: bytes, etag: Optional[str] = None,
+            last_modified: Optional[str] = None) -> bool:
+        """
+        寫入頁面內容
+
+        返回:
+            內容指紋是否與快取不同（新頁面亦視為不同）
+        """
+        digest = fingerprint(content)
+        entry = self.entries.get(url, {})
+        changed = entry.get("fingerprint") != digest or not self.has_body(url)
+        if changed:
+            (self.pages_dir / f"{self._key(url)}.html").write_bytes(content)
+            entry["record"] = None
+        entry.update({
+            "fingerprint": digest,
+            "etag": etag,
+            "last_modified": last_modified,
+            "fetched_at": time.time()
+        })
+        self.entries[url] = entry
+        return changed
+
+    def set_record(self, url: str, record: Dict, version: Optional[int] = None):
+        """
+        保存頁面擷取後的紀錄
+
+        參數:
+            url: 頁面網址
+            record: 可序列化為 JSON 的紀錄
+            version: 擷取邏輯版本，版本不同的紀錄不會被沿用
+        """
+        entry = self.entries.setdefault(url, {})
+        entry["record"] = record
+        entry["record_version"] = version
+
+    def save(self):
+        """以原子方式寫入索引檔"""
+        tmp_path = self.index_path.with_name(f"index.json.{os.getpid()}.tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"entries": self.entries, "last_groups": self.last_groups},
+                      f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.index_path)
@@ -0,0 +1,337 @@
+"""
+學習歷程事件增量彙總
+逐塊讀取原始學習事件檔，以每位學生的累計和與次數增量更新彙總值，再輸出與 data.csv
+相同格式的特徵表（暫存檔加 os.replace 原子寫入）。記憶體用量只與學生數及讀取區塊大小有關，
+與事件總量無關；每個事件檔已處理的位元組位置與累計值一併保存，重新執行時只讀取新增的事件
+
+事件檔格式（CSV，每列一筆事件，欄位內不含換行；檔案只附加，輪替時改用新檔名）:
+    user_sn,event_type,organization_id,time_spent,finish_rate,ans_time,binary_res,score
+    event_type 為 review（複習）、practice（練習作答）、exam（測驗作答）、mission（任務完成）；
+    不適用的欄位留空
+
+特徵定義:
+    *_mean_*      對應事件類型該欄位非空值的平均
+    *_count       對應事件類型的事件數
+    correct_rate  練習與測驗作答 binary_res 的平均，question_count 為其作答數
+    total_score   score 的總和；pr 為同一組織內 total_score 的百分等級
+
+使用方式:
+    python activity_ingest.py --events ../activity_logs
+    python activity_ingest.py --seed ../data.csv          # 以既有彙總表作為起點
+    python activity_ingest.py --output ../data.csv        # 直接更新線上使用的彙總表
+    python activity_ingest.py --follow 60                 # 每 60 秒處理新事件
+"""
+import argparse
+import csv
+import io
+import json
+import logging
+import os
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+# 確保日誌目錄存在
+log_dir = Path("logs")
+log_dir.mkdir(exist_ok=True)
+
+# 配置事件彙總專用日誌
+logger = logging.getLogger(__name__)
+ingest_handler = logging.FileHandler(
+    log_dir / "activity_ingest.log", encoding='utf-8')
+ingest_handler.setFormatter(logging.Formatter(
+    '%(asctime)s - %(levelname)s - %(message)s'))
+logger.addHandler(ingest_handler)
+
+STATE_FORMAT_VERSION = 1
+ID_COLUMN = "user_sn"
+ANSWER_TYPES = ("practice", "exam")
+# 特徵：(輸出欄位, 事件類型, 事件欄位（None 表示計數）, 彙總方式, 由既有彙總表還原時的權重欄位)
+FEATURES = [
+    ("review_mean_time_spent", ("review",), "time_spent", "mean", "user_review_count"),
+    ("review_mean_finish_rate", ("review",), "finish_rate", "mean", "user_review_count"),
+    ("prac_mean_items_ans_time", ("practice",), "ans_time", "mean", "user_prac_count"),
+    ("prac_mean_binary_res_Q", ("practice",), "binary_res", "mean", "user_prac_count"),
+    ("exam_mean_ans_time_num", ("exam",), "ans_time", "mean", "user_exam_count"),
+    ("exam_mean_binary_res", ("exam",), "binary_res", "mean", "user_exam_count"),
+    ("user_exam_count", ("exam",), None, "count", None),
+    ("user_prac_count", ("practice",), None, "count", None),
+    ("user_review_count", ("review",), None, "count", None),
+    ("total_score", None, "score", "sum", None),
+    ("correct_rate", ANSWER_TYPES, "binary_res", "mean", "question_count"),
+    ("mission_count", ("mission",), None, "count", None),
+    ("question_count", ANSWER_TYPES, "binary_res", "count", None),
+]
+# 與 data.csv 相同的欄位順序
+OUTPUT_COLUMNS = [
+    ID_COLUMN, "review_mean_time_spent", "review_mean_finish_rate",
+    "prac_mean_items_ans_time", "prac_mean_binary_res_Q",
+    "exam_mean_ans_time_num", "exam_mean_binary_res",
+    "user_exam_count", "user_prac_count", "user_review_count", "organization_id",
+    "total_score", "pr", "correct_rate", "mission_count", "question_count"
+]
+
+
+def _accumulators() -> List[str]:
+    """累計欄位：平均需要和與次數，計數只需次數，總和只需和"""
+    columns = []
+    for name, _, _, how, _ in FEATURES:
+        if how in ("mean", "sum"):
+            columns.append(f"{name}__sum")
+        if how in ("mean", "count"):
+            columns.append(f"{name}__n")
+    return columns
+
+
+ACCUMULATORS = _accumulators()
+
+
+class ActivityAggregator:
+    """學習事件增量彙總類別"""
+
+    def __init__(self, events_dir: str, state_path: str, output_path: str,
+                 chunk_bytes: int = 8 * 1024 * 1024):
+        """
+        初始化彙總器
+
+        參數:
+            events_dir: 原始事件檔目錄（讀取其中的 *.csv）
+            state_path: 累計值與讀取位置的保存路徑（.npz）
+            output_path: 輸出的特徵表路徑
+            chunk_bytes: 每次讀取的位元組數上限
+        """
+        self.events_dir = Path(events_dir)
+        self.state_path = Path(state_path)
+        self.output_path = Path(output_path)
+        self.chunk_bytes = chunk_bytes
+        self.totals = pd.DataFrame(columns=ACCUMULATORS, dtype=np.float64)
+        self.organizations = pd.Series(dtype=np.float64)
+        self.offsets: Dict[str, int] = {}
+        self.stats = {"events": 0, "chunks": 0, "bytes": 0}
+        self._load_state()
+
+    def _load_state(self):
+        """載入上次保存的累計值與各事件檔的讀取位置"""
+        if not self.state_path.exists():
+            return
+        with np.load(self.state_path) as data:
+            meta = json.loads(str(data["meta"]))
+            if meta.get("format_version") != STATE_FORMAT_VERSION or \
+                    meta.get("accumulators") != ACCUMULATORS:
+                raise ValueError(f"彙總狀態 {self.state_path} 與目前的特徵定義不符，請改用新的狀態檔")
+            index = pd.Index(data["user_ids"].tolist(), name=ID_COLUMN)
+            self.totals = pd.DataFrame(data["totals"], index=index, columns=ACCUMULATORS)
+            self.organizations = pd.Series(data["organizations"], index=index)
+        self.offsets = meta["offsets"]
+        logger.info(f"載入彙總狀態：{len(self.totals)} 位學生、{len(self.offsets)} 個事件檔")
+
+    def _save_state(self):
+        """以原子方式保存累計值與讀取位置（兩者在同一檔案中，不會彼此不一致）"""
+        self.state_path.parent.mkdir(parents=True, exist_ok=True)
+        meta = {"format_version": STATE_FORMAT_VERSION, "accumulators": ACCUMULATORS,
+                "offsets": self.offsets, "updated_at": datetime.now().isoformat()}
+        tmp_path = self.state_path.with_name(f".{self.state_path.stem}.{os.getpid()}.npz")
+        np.savez(tmp_path, user_ids=np.array(self.totals.index.tolist(), dtype=str),
+                 totals=self.totals.to_numpy(dtype=np.float64),
+                 organizations=self.organizations.reindex(self.totals.index)
+                 .to_numpy(dtype=np.float64),
+                 meta=np.array(json.dumps(meta)))
+        os.replace(tmp_path, self.state_path)
+
+    def _merge(self, totals: pd.DataFrame, organizations: pd.Series):
+        """將一個區塊的彙總加入累計值（保持學生的出現順序）"""
+        new_users = totals.index.difference(self.totals.index, sort=False)
+        if len(new_users):
+            self.totals = pd.concat([self.totals, pd.DataFrame(
+                0.0, index=new_users, columns=ACCUMULATORS)])
+        self.totals.loc[totals.index] += totals[ACCUMULATORS].to_numpy()
+        organizations = organizations.dropna()
+        if len(organizations):
+            self.organizations = organizations.combine_first(self.organizations)
+
+    def _consume(self, events: pd.DataFrame):
+        """彙總一個區塊的事件"""
+        events = events.dropna(subset=[ID_COLUMN])
+        if events.empty:
+            return
+        users = events[ID_COLUMN].astype(str).str.strip()
+        event_types = events["event_type"].astype(str).str.strip()
+        columns = {}
+        for name, types, field, how, _ in FEATURES:
+            mask = event_types.isin(types) if types else pd.Series(True, index=events.index)
+            if field is None:
+                values = pd.Series(np.where(mask, 1.0, np.nan), index=events.index)
+            else:
+                values = pd.to_numeric(events[field], errors='coerce').where(mask)
+            if how in ("mean", "sum"):
+                columns[f"{name}__sum"] = values.fillna(0.0)
+            if how in ("mean", "count"):
+                columns[f"{name}__n"] = values.notna().astype(np.float64)
+        totals = pd.DataFrame(columns).groupby(users.to_numpy(), sort=False).sum()
+        organizations = pd.to_numeric(events["organization_id"], errors='coerce') \
+            .groupby(users.to_numpy(), sort=False).last()
+        self._merge(totals, organizations)
+        self.stats["events"] += len(events)
+        self.stats["chunks"] += 1
+
+    def _ingest_file(self, path: Path) -> int:
+        """
+        由上次的位置逐塊讀取事件檔；最後一列若尚未寫完則留待下次
+
+        返回:
+            本次處理的位元組數
+        """
+        key = path.name
+        offset = self.offsets.get(key, 0)
+        size = path.stat().st_size
+        if size < offset:
+            logger.warning(f"事件檔 {key} 比上次讀取位置短（{size} < {offset}），"
+                           f"事件檔應只附加，略過此檔")
+            return 0
+        if size == offset:
+            return 0
+        with open(path, 'rb') as f:
+            header = f.readline()
+            names = next(csv.reader([header.decode('utf-8-sig')]))
+            position = max(offset, len(header))
+            f.seek(position)
+            carry = b""
+            while True:
+                block = f.read(self.chunk_bytes)
+                if not block:
+                    break
+                block = carry + block
+                cut = block.rfind(b"\n")
+                if cut < 0:
+                    carry = block
+                    continue
+                complete, carry = block[:cut + 1], block[cut + 1:]
+                self._consume(pd.read_csv(io.BytesIO(complete), names=names, header=None,
+                                          dtype={ID_COLUMN: str}))
+                position += len(complete)
+        processed = position - offset
+        self.offsets[key] = position
+        self.stats["bytes"] += processed
+        return processed
+
+    def seed(self, table_path: str):
+        """
+        以既有的彙總表（data.csv 格式）作為累計起點：平均值乘以對應次數還原為和
+
+        參數:
+            table_path: 彙總表路徑
+        """
+        if len(self.totals):
+            raise ValueError("彙總狀態已有資料，只能對空的狀態匯入起點")
+        table = pd.read_csv(table_path, dtype={ID_COLUMN: str})
+        users = table[ID_COLUMN].astype(str).str.strip().to_numpy()
+        columns = {}
+        for name, _, _, how, weight in FEATURES:
+            value = pd.to_numeric(table[name], errors='coerce').fillna(0.0)
+            if how == "mean":
+                n = pd.to_numeric(table[weight], errors='coerce').fillna(0.0)
+                columns[f"{name}__sum"] = value * n
+                columns[f"{name}__n"] = n
+            elif how == "sum":
+                columns[f"{name}__sum"] = value
+            else:
+                columns[f"{name}__n"] = value
+        totals = pd.DataFrame(columns).groupby(users, sort=False).sum()
+        organizations = pd.to_numeric(table["organization_id"], errors='coerce') \
+            .groupby(users, sort=False).last()
+        self._merge(totals, organizations)
+        logger.info(f"由 {table_path} 匯入 {len(totals)} 位學生的彙總值作為起點")
+
+    def features(self) -> pd.DataFrame:
+        """由累計值計算特徵表（欄位順序與 data.csv 相同）"""
+        totals = self.totals
+        table = pd.DataFrame(index=totals.index)
+        for name, _, _, how, _ in FEATURES:
+            if how == "mean":
+                n = totals[f"{name}__n"]
+                table[name] = (totals[f"{name}__sum"] / n.where(n > 0)).fillna(0.0)
+            elif how == "sum":
+                table[name] = totals[f"{name}__sum"]
+            else:
+                # 匯入的彙總表中次數可能是小數（已正規化的資料），只有全為整數時才轉為整數欄位
+                n = totals[f"{name}__n"]
+                table[name] = n.astype(np.int64) if (n == n.round()).all() else n
+        table["organization_id"] = self.organizations.reindex(totals.index) \
+            .fillna(-1).astype(np.int64)
+        # 組織內的百分等級（不高於該分數的比例）
+        table["pr"] = table.groupby("organization_id")["total_score"] \
+            .rank(method="max", pct=True) * 100
+        table[ID_COLUMN] = totals.index
+        return table[OUTPUT_COLUMNS].reset_index(drop=True)
+
+    def write_features(self):
+        """以原子方式寫出特徵表"""
+        table = self.features()
+        table.index = pd.RangeIndex(1, len(table) + 1)
+        self.output_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.output_path.with_name(f".{self.output_path.name}.{os.getpid()}.tmp")
+        table.to_csv(tmp_path, index_label="", quoting=csv.QUOTE_NONNUMERIC)
+        os.replace(tmp_path, self.output_path)
+
+    def run(self, force_write: bool = False) -> Dict:
+        """
+        處理所有事件檔的新增部分並更新特徵表
+
+        先寫特徵表再保存狀態：兩者之間中斷時，下次會由舊狀態重新處理同一批事件，
+        產生相同的特徵表，不會重複計入
+
+        參數:
+            force_write: 沒有新事件時是否仍重寫特徵表
+
+        返回:
+            {"files", "bytes", "events", "students", "written"}
+        """
+        began = time.perf_counter()
+        self.stats = {"events": 0, "chunks": 0, "bytes": 0}
+        files = sorted(self.events_dir.glob("*.csv")) if self.events_dir.exists() else []
+        try:
+            for path in files:
+                self._ingest_file(path)
+            written = bool(self.stats["bytes"]) or force_write
+            if written:
+                self.write_features()
+                self._save_state()
+        except Exception as e:
+            logger.error(f"彙總學習事件時發生錯誤: {str(e)}")
+            raise
+        elapsed = time.perf_counter() - began
+        if written:
+            logger.info(f"處理 {self.stats['events']} 筆事件（{self.stats['bytes']} 位元組、"
+                        f"{self.stats['chunks']} 個區塊），特徵表共 {len(self.totals)} 位學生，"
+                        f"耗時 {elapsed:.2f} 秒")
+        return {"files": len(files), **self.stats, "students": len(self.totals),
+                "written": written, "elapsed_seconds": round(elapsed, 3)}
+
+
+if __name__ == "__main__":
+    import config
+
+    parser = argparse.ArgumentParser(description="增量彙總學習事件為特徵表")
+    parser.add_argument("--events", default=config.ACTIVITY_EVENTS_DIR)
+    parser.add_argument("--state", default=config.ACTIVITY_STATE_PATH)
+    # 預設不覆寫線上使用的 data.csv（其中包含非事件來源的資料）
+    parser.add_argument("--output", default=config.ACTIVITY_OUTPUT_PATH)
+    parser.add_argument("--chunk-bytes", type=int, default=config.ACTIVITY_CHUNK_BYTES)
+    parser.add_argument("--seed", default=None, help="以既有彙總表作為累計起點（僅限空狀態）")
+    parser.add_argument("--follow", type=float, default=0,
+                        help="持續執行，每隔指定秒數處理新事件")
+    args = parser.parse_args()
+
+    aggregator = ActivityAggregator(args.events, args.state, args.output, args.chunk_bytes)
+    if args.seed:
+        aggregator.seed(args.seed)
+    while True:
+        print(json.dumps(aggregator.run(force_write=bool(args.seed)), ensure_ascii=False))
+        if args.follow <= 0:
+            break
+        args.seed = None
+        time.sleep(args.follow)
@@ -0,0 +1,318 @@
+"""
+准入控制與用戶端限速
+在請求進入代理前先經過兩道關卡：以用戶端位址（有工作階段時再細分至工作階段）為鍵的令牌桶限速
+（昂貴與便宜接口分開計算），
+以及有上限的准入佇列（同時處理數與排隊數皆有上限）。超過限制時拋出 AdmissionRejected，
+由 API 層轉為 429 並附上 Retry-After
+"""
+import asyncio
+import logging
+import math
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Dict, Optional
+
+from cache_utils import LRUCache
+
+# 確保日誌目錄存在
+log_dir = Path("logs")
+log_dir.mkdir(exist_ok=True)
+
+# 配置准入控制專用日誌
+logger = logging.getLogger(__name__)
+admission_handler = logging.FileHandler(
+    log_dir / "admission.log", encoding='utf-8')
+admission_handler.setFormatter(logging.Formatter(
+    '%(asctime)s - %(levelname)s - %(message)s'))
+logger.addHandler(admission_handler)
+
+
+class AdmissionRejected(Exception):
+    """請求被限速或准入佇列拒絕"""
+
+    def __init__(self, reason: str, retry_after: float, status_code: int = 429):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+        self.status_code = status_code
+
+    @property
+    def retry_after_header(self) -> str:
+        """Retry-After 標頭值（整數秒，至少 1）"""
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+class RateBucket:
+    """非阻塞令牌桶：平均每秒 rate 個請求，允許連續 burst 個"""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.capacity = float(max(1, burst))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def wait_time(self, cost: float = 1.0) -> float:
+        """
+        補充令牌後檢查是否足夠（不扣除）
+
+        返回:
+            0 表示令牌足夠；否則為令牌足夠前需等待的秒數
+        """
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= cost:
+            return 0.0
+        return (cost - self.tokens) / self.rate
+
+    def consume(self, cost: float = 1.0):
+        self.tokens -= cost
+
+
+class ClientRateLimiter:
+    """以用戶端為鍵的令牌桶限速器（閒置的用戶端依 LRU 淘汰，記憶體有上限）"""
+
+    def __init__(self, name: str, rate: float, burst: int, max_clients: int = 10000):
+        """
+        初始化限速器
+
+        參數:
+            name: 限速類別名稱（用於指標與錯誤訊息）
+            rate: 每個用戶端每秒可發出的請求數（0 表示不限速）
+            burst: 每個用戶端可連續發出的請求數
+            max_clients: 同時追蹤的用戶端數上限
+        """
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.buckets = LRUCache(max_entries=max_clients)
+        self.allowed = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def _bucket(self, client_key: str) -> RateBucket:
+        bucket = self.buckets.get(client_key)
+        if bucket is None:
+            bucket = RateBucket(self.rate, self.burst)
+            self.buckets.put(client_key, bucket)
+        return bucket
+
+    def wait_time(self, client_key: str, cost: float = 1.0) -> float:
+        """
+        檢查用戶端令牌是否足夠（不扣除）；超過桶容量時拋出 AdmissionRejected（413）
+
+        參數:
+            client_key: 用戶端識別（位址，或位址加工作階段 ID）
+            cost: 本次請求消耗的令牌數
+
+        返回:
+            0 表示足夠；否則為需等待的秒數
+        """
+        if self.rate <= 0:
+            return 0.0
+        if cost > max(1, self.burst):
+            # 超過桶容量的請求永遠無法取得足夠令牌，重試也無效，直接以 413 拒絕
+            self.rejected += 1
+            raise AdmissionRejected(
+                f"單次請求數量 {cost:g} 超過限速上限 {max(1, self.burst)}（{self.name}），請分批送出",
+                0, status_code=413)
+        with self._lock:
+            return self._bucket(client_key).wait_time(cost)
+
+    def charge(self, client_key: str, cost: float = 1.0):
+        """扣除用戶端令牌（呼叫前應以 wait_time 確認足夠）"""
+        if self.rate <= 0:
+            return
+        with self._lock:
+            self._bucket(client_key).consume(cost)
+            self.allowed += 1
+
+    def reject(self, client_key: str, wait: float):
+        """記錄拒絕並拋出 AdmissionRejected"""
+        with self._lock:
+            self.rejected += 1
+        logger.info(f"用戶端 {client_key} 超過 {self.name} 限速，{wait:.1f} 秒後可重試")
+        raise AdmissionRejected(f"請求過於頻繁（{self.name}）", wait)
+
+    def check(self, client_key: str, cost: float = 1.0):
+        """扣除用戶端令牌，不足時拋出 AdmissionRejected"""
+        wait = self.wait_time(client_key, cost)
+        if wait > 0:
+            self.reject(client_key, wait)
+        self.charge(client_key, cost)
+
+    def snapshot(self) -> Dict:
+        return {
+            "rate": self.rate,
+            "burst": self.burst,
+            "tracked_clients": len(self.buckets),
+            "allowed": self.allowed,
+            "rejected": self.rejected
+        }
+
+
+class AdmissionQueue:
+    """有上限的准入佇列：最多 max_in_flight 個請求同時處理，最多 max_queue 個排隊"""
+
+    def __init__(self, max_in_flight: int = 32, max_queue: int = 64,
+                 queue_timeout: float = 10.0, history_size: int = 200):
+        """
+        初始化准入佇列
+
+        參數:
+            max_in_flight: 同時處理的請求數上限
+            max_queue: 排隊等待的請求數上限，超過時立即拒絕
+            queue_timeout: 排隊等待秒數上限，逾時時拒絕
+            history_size: 估計 Retry-After 時參考的最近處理時間筆數
+        """
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self._waiters: deque = deque()
+        self._service_times: deque = deque(maxlen=history_size)
+        self.stats = {"admitted": 0, "rejected_queue_full": 0,
+                      "rejected_queue_timeout": 0, "max_queue_depth": 0}
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(1 for f in self._waiters if not f.done())
+
+    def _retry_after(self) -> float:
+        """依平均處理時間與排隊數估計可重試的秒數"""
+        avg = sum(self._service_times) / len(self._service_times) \
+            if self._service_times else 1.0
+        return avg * (self.queue_depth + 1) / max(1, self.max_in_flight)
+
+    def _release(self):
+        while self._waiters:
+            future = self._waiters.popleft()
+            if not future.done():
+                future.set_result(None)
+                return
+        self.in_flight -= 1
+
+    @asynccontextmanager
+    async def admit(self):
+        """取得處理名額，佇列已滿或等待逾時時拋出 AdmissionRejected"""
+        if self.in_flight < self.max_in_flight and not self.queue_depth:
+            self.in_flight += 1
+        else:
+            if self.queue_depth >= self.max_queue:
+                self.stats["rejected_queue_full"] += 1
+                raise AdmissionRejected("伺服器忙碌中，等待佇列已滿", self._retry_after())
+            future = asyncio.get_running_loop().create_future()
+            self._waiters.append(future)
+            self.stats["max_queue_depth"] = max(self.stats["max_queue_depth"], self.queue_depth)
+            try:
+                await asyncio.wait_for(asyncio.shield(future), self.queue_timeout)
+            except BaseException as e:
+                if future.done() and not future.cancelled():
+                    # 已被喚醒但呼叫端放棄，轉交名額
+                    self._release()
+                else:
+                    future.cancel()
+                if isinstance(e, asyncio.TimeoutError):
+                    self.stats["rejected_queue_timeout"] += 1
+                    raise AdmissionRejected("伺服器忙碌中，排隊逾時", self._retry_after()) from None
+                raise
+        self.stats["admitted"] += 1
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self._service_times.append(time.monotonic() - started)
+            self._release()
+
+    def snapshot(self) -> Dict:
+        return {
+            "max_in_flight": self.max_in_flight,
+            "max_queue": self.max_queue,
+            "in_flight": self.in_flight,
+            "queue_depth": self.queue_depth,
+            **self.stats
+        }
+
+
+class AdmissionController:
+    """准入控制：昂貴接口（需呼叫語言模型）與便宜接口（純檢索、工作階段）分開限速"""
+
+    def __init__(self, expensive_rate: float, expensive_burst: int,
+                 cheap_rate: float, cheap_burst: int,
+                 max_in_flight: int, max_queue: int, queue_timeout: float,
+                 max_clients: int = 10000, sessions_per_address: int = 10,
+                 expensive_items_rate: float = 0.0, expensive_items_burst: int = 1,
+                 cheap_items_rate: float = 0.0, cheap_items_burst: int = 1):
+        """
+        初始化准入控制
+
+        參數:
+            *_items_rate / *_items_burst: 批次與多查詢請求的逐項額度（每秒項數與桶容量，0 表示不限速），
+                與每請求的令牌分開計算，讓單一請求可包含多於請求桶容量的題數
+            sessions_per_address: 同一位址的所有工作階段合計可用的額度（以單一工作階段的倍數計），
+                避免以每次更換工作階段 ID 繞過限速
+        """
+        self.limiters = {
+            "expensive": ClientRateLimiter("expensive", expensive_rate, expensive_burst,
+                                           max_clients),
+            "cheap": ClientRateLimiter("cheap", cheap_rate, cheap_burst, max_clients),
+            "expensive_items": ClientRateLimiter("expensive_items", expensive_items_rate,
+                                                 expensive_items_burst, max_clients),
+            "cheap_items": ClientRateLimiter("cheap_items", cheap_items_rate,
+                                             cheap_items_burst, max_clients)
+        }
+        factor = max(1, sessions_per_address)
+        self.address_limiters = {
+            name: ClientRateLimiter(f"{name}_per_address", limiter.rate * factor,
+                                    limiter.burst * factor, max_clients)
+            for name, limiter in self.limiters.items()
+        }
+        self.queue = AdmissionQueue(max_in_flight, max_queue, queue_timeout)
+
+    @staticmethod
+    def client_key(session_id: Optional[str], address: Optional[str]) -> str:
+        """
+        限速鍵：一律包含用戶端位址；有工作階段時再以工作階段細分
+        （同一教室共用出口位址的學生互不影響，另受位址合計額度限制）
+        """
+        key = f"addr:{address or 'unknown'}"
+        if session_id:
+            return f"{key}|session:{session_id}"
+        return key
+
+    def check(self, cost_class: str, client_key: str, cost: float = 1.0, items: int = 0):
+        """
+        依接口類別扣除用戶端令牌；工作階段鍵另扣除所屬位址的合計令牌
+
+        所有相關的桶都足夠時才一併扣除，任一不足時皆不扣除（被拒絕的請求不消耗其他桶的額度）
+
+        參數:
+            cost_class: expensive 或 cheap
+            client_key: 限速鍵（見 client_key）
+            cost: 請求令牌數
+            items: 批次題數或查詢數（大於 0 時另扣除該類別的逐項額度）
+        """
+        address_key, _, session = client_key.partition("|")
+        charges = []
+        for name, amount in [(cost_class, cost)] + ([(f"{cost_class}_items", items)] if items else []):
+            charges.append((self.limiters[name], client_key, amount))
+            if session:
+                charges.append((self.address_limiters[name], address_key, amount))
+        for limiter, key, amount in charges:
+            wait = limiter.wait_time(key, amount)
+            if wait > 0:
+                limiter.reject(key, wait)
+        for limiter, key, amount in charges:
+            limiter.charge(key, amount)
+
+    def snapshot(self) -> Dict:
+        return {
+            "queue": self.queue.snapshot(),
+            "rate_limits": {limiter.name: limiter.snapshot() for limiter in
+                            [*self.limiters.values(), *self.address_limiters.values()]}
+        }
@@ -0,0 +1,325 @@
+"""
+預先產生的標準問答
+離線以正常的 RAG+Ollama 流程為每個（學群, 模板類型）產生回答，存成與語料內容雜湊綁定的版本化檔案；
+查詢能明確對應到單一組合時直接返回儲存的回答
+
+使用方式:
+    python answer_store.py            # 為目前語料產生（或補齊）所有標準回答
+    python answer_store.py --force    # 全部重新產生
+"""
+import argparse
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from prompt_template import PromptTemplate
+
+# 確保日誌目錄存在
+log_dir = Path("logs")
+log_dir.mkdir(exist_ok=True)
+
+# 配置問答儲存專用日誌
+logger = logging.getLogger(__name__)
+answer_handler = logging.FileHandler(
+    log_dir / "answer_store.log", encoding='utf-8')
+answer_handler.setFormatter(logging.Formatter(
+    '%(asctime)s - %(levelname)s - %(message)s'))
+logger.addHandler(answer_handler)
+
+STORE_FORMAT_VERSION = 1
+
+# 各模板類型的標準問題（{group} 代入學群簡稱）
+CANONICAL_QUESTIONS = {
+    "學群介紹": "請介紹{group}學群，適合什麼特質的人？",
+    "學習內容": "{group}學群主要學習哪些課程內容？",
+    "職涯發展": "{group}學群畢業後有哪些職涯發展與出路？",
+    "跨領域發展": "{group}學群有哪些跨領域發展的機會？",
+    "升學規劃": "想進入{group}學群，升學要如何規劃與準備？",
+    "實習就業": "{group}學群有哪些實習與求職的建議？"
+}
+
+
+def short_group_name(group_name: str) -> str:
+    """將「資訊 學群」轉為「資訊」"""
+    return group_name.replace("學群", "").replace(" ", "").strip()
+
+
+class AnswerStore:
+    """標準問答儲存類別"""
+
+    def __init__(self, store_dir: str = "answers", refresh_interval: float = 30.0):
+        """
+        初始化標準問答儲存
+
+        參數:
+            store_dir: 儲存目錄
+            refresh_interval: 檢查檔案是否被其他程序更新的間隔秒數
+        """
+        self.store_dir = Path(store_dir)
+        self.store_dir.mkdir(parents=True, exist_ok=True)
+        self.refresh_interval = refresh_interval
+        self.corpus_hash: Optional[str] = None
+        self.data: Dict = {}
+        self._mtime = 0.0
+        self._last_check = 0.0
+        self.stats = {"hits": 0, "misses": 0, "rejected_similarity": 0}
+        # 標準問題的正規化向量（只與問題文字有關，不隨語料版本失效）
+        self._canonical_embeddings: Dict[str, np.ndarray] = {}
+
+    def _path(self, corpus_hash: str) -> Path:
+        return self.store_dir / f"answers_{corpus_hash}.json"
+
+    def load(self, corpus_hash: str) -> bool:
+        """
+        載入指定語料版本的回答
+
+        參數:
+            corpus_hash: 語料內容雜湊
+
+        返回:
+            是否找到對應版本的檔案
+        """
+        self.corpus_hash = corpus_hash
+        path = self._path(corpus_hash)
+        self._last_check = time.monotonic()
+        if not path.exists():
+            self.data = {}
+            return False
+        try:
+            mtime = path.stat().st_mtime
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get("format_version") != STORE_FORMAT_VERSION or \
+                    data.get("corpus_hash") != corpus_hash:
+                logger.warning(f"回答檔案 {path} 版本不符，忽略")
+                self.data = {}
+                return False
+            self.data = data
+            self._mtime = mtime
+            logger.info(f"載入 {self.count()} 筆預先產生的回答（語料版本 {corpus_hash}）")
+            return True
+        except Exception as e:
+            logger.error(f"載入回答檔案 {path} 時發生錯誤: {str(e)}")
+            self.data = {}
+            return False
+
+    def maybe_refresh(self):
+        """定期檢查檔案是否由離線工作或其他工作程序更新（包含啟動時尚不存在、之後才寫入的檔案）"""
+        now = time.monotonic()
+        if self.corpus_hash is None or now - self._last_check < self.refresh_interval:
+            return
+        self._last_check = now
+        path = self._path(self.corpus_hash)
+        try:
+            if path.stat().st_mtime != self._mtime:
+                self.load(self.corpus_hash)
+        except FileNotFoundError:
+            pass
+
+    def count(self) -> int:
+        return sum(len(t) for t in self.data.get("answers", {}).values())
+
+    def missing_pairs(self, group_names: List[str]) -> List[Tuple[str, str]]:
+        """尚未產生回答的（學群, 模板類型）組合"""
+        answers = self.data.get("answers", {})
+        return [(g, t) for g in group_names for t in CANONICAL_QUESTIONS
+                if t not in answers.get(g, {})]
+
+    def save(self, corpus_hash: str, answers: Dict[str, Dict[str, Dict]], model: str):
+        """
+        以原子方式寫入回答檔案（先寫暫存檔再改名）
+
+        參數:
+            corpus_hash: 語料內容雜湊
+            answers: {學群: {模板類型: {"response", "generated_at"}}}
+            model: 產生回答所用的模型
+        """
+        data = {
+            "format_version": STORE_FORMAT_VERSION,
+            "corpus_hash": corpus_hash,
+            "model": model,
+            "generated_at": datetime.now().isoformat(),
+            "answers": answers
+        }
+        path = self._path(corpus_hash)
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        if corpus_hash == self.corpus_hash:
+            self.data = data
+            self._mtime = path.stat().st_mtime
+        logger.info(f"已寫入 {sum(len(t) for t in answers.values())} 筆回答至 {path}")
+
+    def acquire_generation_lock(self, corpus_hash: str):
+        """
+        取得產生回答的檔案鎖（非阻塞），避免多個工作程序重複產生
+
+        返回:
+            已上鎖的檔案物件（關閉即釋放），鎖已被占用時返回 None
+        """
+        lock_file = open(self.store_dir / f"answers_{corpus_hash}.lock", 'w')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return None
+        return lock_file
+
+    def match(self, query: str, group_names: List[str], min_confidence: float = 1.0,
+              encode: Optional[Callable] = None,
+              min_similarity: float = 0.0) -> Optional[Tuple[str, str]]:
+        """
+        判斷查詢是否明確對應到單一（學群, 模板類型）
+
+        需同時滿足：查詢中只出現一個「X學群」、模板關鍵字有命中且信心分數達門檻；
+        提供 encode 時，查詢與該組合標準問題的向量相似度也須達門檻
+        （避免只因提到學群與一個關鍵字，就以標準回答回覆不同的問題）
+
+        參數:
+            query: 使用者問題
+            group_names: 所有學群名稱
+            min_confidence: 模板判斷的最低信心分數
+            encode: 文本編碼函式（texts -> 向量陣列），None 表示不檢查相似度
+            min_similarity: 與標準問題的最低餘弦相似度
+
+        返回:
+            (學群名稱, 模板類型)，無法明確對應時返回 None
+        """
+        compact = query.replace(" ", "")
+        groups = [g for g in group_names if f"{short_group_name(g)}學群" in compact]
+        if len(groups) != 1:
+            return None
+        prompt_type, confidence = PromptTemplate.detect_prompt_type(compact)
+        if confidence < min_confidence:
+            return None
+        if encode is not None and \
+                self.similarity(query, groups[0], prompt_type, encode) < min_similarity:
+            self.stats["rejected_similarity"] += 1
+            return None
+        return groups[0], prompt_type
+
+    def similarity(self, query: str, group_name: str, prompt_type: str,
+                   encode: Callable) -> float:
+        """查詢與（學群, 模板類型）標準問題的餘弦相似度（標準問題的向量快取重用）"""
+        canonical = CANONICAL_QUESTIONS[prompt_type].format(group=short_group_name(group_name))
+        cached = self._canonical_embeddings.get(canonical)
+        texts = [query] if cached is not None else [query, canonical]
+        embeddings = np.asarray(encode(texts), dtype=np.float32).reshape(len(texts), -1)
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        embeddings = embeddings / norms
+        if cached is None:
+            cached = self._canonical_embeddings[canonical] = embeddings[1]
+        return float(embeddings[0] @ cached)
+
+    def lookup(self, group_name: str, prompt_type: str) -> Optional[Dict]:
+        """取得儲存的回答"""
+        self.maybe_refresh()
+        answer = self.data.get("answers", {}).get(group_name, {}).get(prompt_type)
+        if answer is None:
+            self.stats["misses"] += 1
+        else:
+            self.stats["hits"] += 1
+        return answer
+
+    def snapshot(self) -> Dict:
+        return {
+            "corpus_hash": self.corpus_hash,
+            "answers": self.count(),
+            "generated_at": self.data.get("generated_at"),
+            **self.stats
+        }
+
+
+async def generate_answers(agent, store: AnswerStore, force: bool = False,
+                           concurrency: int = 2) -> int:
+    """
+    以正常 RAG+Ollama 流程為所有（學群, 模板類型）產生回答並寫入儲存
+
+    參數:
+        agent: EnhancedOllamaAgent 實例
+        store: 回答儲存
+        force: 是否忽略既有回答全部重新產生
+        concurrency: 同時產生的數量
+
+    返回:
+        本次新產生的回答數
+    """
+    from models import ChatRequest
+    from ollama_scheduler import Priority
+
+    corpus_hash = agent.retriever.corpus_version
+    group_names = agent.retriever.group_names()
+    if store.corpus_hash != corpus_hash:
+        store.load(corpus_hash)
+    answers = {} if force else json.loads(json.dumps(store.data.get("answers", {})))
+    pairs = [(g, t) for g in group_names for t in CANONICAL_QUESTIONS] if force \
+        else store.missing_pairs(group_names)
+    if not pairs:
+        return 0
+
+    logger.info(f"開始產生 {len(pairs)} 筆標準回答（語料版本 {corpus_hash}）")
+    semaphore = asyncio.Semaphore(concurrency)
+    generated = 0
+
+    async def generate(group_name: str, prompt_type: str):
+        nonlocal generated
+        question = CANONICAL_QUESTIONS[prompt_type].format(
+            group=short_group_name(group_name))
+        async with semaphore:
+            try:
+                rag_results = await asyncio.to_thread(agent.retriever.retrieve, question)
+                # 確保目標學群位於上下文第一順位
+                target = [r for r in rag_results if r["group_name"] == group_name] or \
+                    agent.retriever.retrieve_group(group_name)
+                rag_results = target + [r for r in rag_results if r["group_name"] != group_name]
+                response = await agent._answer(
+                    ChatRequest(message=question), rag_results, datetime.now(),
+                    Priority.BATCH)
+            except Exception as e:
+                logger.error(f"產生 {group_name}/{prompt_type} 回答失敗: {str(e)}")
+                return
+        answers.setdefault(group_name, {})[prompt_type] = {
+            "question": question,
+            "response": response.response,
+            "generated_at": datetime.now().isoformat()
+        }
+        generated += 1
+        # 每完成一筆即寫入，中斷後可接續
+        store.save(corpus_hash, answers, agent.model_name)
+
+    await asyncio.gather(*(generate(g, t) for g, t in pairs))
+    logger.info(f"標準回答產生完成，新增 {generated} 筆")
+    return generated
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="產生標準（學群 x 模板類型）回答")
+    parser.add_argument("--force", action="store_true", help="全部重新產生")
+    parser.add_argument("--concurrency", type=int, default=2)
+    args = parser.parse_args()
+
+    import config
+    from enhanced_agent import EnhancedOllamaAgent
+
+    async def main():
+        agent = EnhancedOllamaAgent(config.CSV_PATH, index_dir=config.INDEX_DIR)
+        store = AnswerStore(config.ANSWER_STORE_DIR)
+        try:
+            count = await generate_answers(agent, store, args.force, args.concurrency)
+            print(f"新增 {count} 筆回答，共 {store.count()} 筆（語料版本 {store.corpus_hash}）")
+        finally:
+            await agent.close()
+
+    asyncio.run(main())
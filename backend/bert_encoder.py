@@ -6,7 +6,7 @@ BERT模型編碼器
 import torch
 from transformers import AutoTokenizer, AutoModel
 import numpy as np
-from typing import List
+from typing import List, Optional
 import logging
 
 # 配置編碼器專用日誌
@@ -21,53 +21,74 @@ logger.addHandler(encoder_handler)
 class BERTEncoder:
     """BERT編碼器類別"""
 
-    def __init__(self, model_name: str = "bert-base-chinese"):
+    def __init__(self, model_name: str = "bert-base-chinese", batch_size: int = 32):
         """
         初始化BERT編碼器
         載入預訓練模型和tokenizer
+
+        參數:
+            model_name: 預訓練模型名稱
+            batch_size: 批次推論的文本數
         """
         logger.info(f"正在初始化BERT編碼器，使用模型: {model_name}")
+        self.model_name = model_name
+        self.batch_size = batch_size
         try:
             self.tokenizer = AutoTokenizer.from_pretrained(model_name)
             self.model = AutoModel.from_pretrained(model_name)
             self.device = torch.device(
                 "cuda" if torch.cuda.is_available() else "cpu")
             self.model.to(self.device)
+            self.model.eval()
+            self.dimension = self.model.config.hidden_size
             logger.info(f"BERT編碼器初始化完成，使用設備: {self.device}")
         except Exception as e:
             logger.error(f"BERT編碼器初始化失敗: {str(e)}")
             raise
 
-    def encode(self, texts: List[str]) -> np.ndarray:
+    def encode(self, texts: List[str], batch_size: Optional[int] = None) -> np.ndarray:
         """
         將文本列表轉換為向量表示
 
+        以批次方式推論，並依 attention mask 對有效 token 取平均，
+        結果與逐筆編碼相同，但可減少模型呼叫次數
+
         參數:
             texts: 要編碼的文本列表
+            batch_size: 每批次文本數（預設使用初始化時的設定）
         返回:
             文本的向量表示數組
         """
+        batch_size = batch_size or self.batch_size
         logger.info(f"開始編碼 {len(texts)} 個文本")
-        encoded_texts = []
-        for i, text in enumerate(texts):
+        encoded_batches = []
+        for start in range(0, len(texts), batch_size):
+            batch = texts[start:start + batch_size]
             try:
                 # 將文本轉換為模型輸入格式
-                inputs = self.tokenizer(text, return_tensors="pt",
+                inputs = self.tokenizer(batch, return_tensors="pt",
                                         max_length=512, truncation=True, padding=True)
                 inputs = {k: v.to(self.device) for k, v in inputs.items()}
 
-                # 生成文本向量表示
+                # 生成文本向量表示（僅對非填充 token 取平均）
                 with torch.no_grad():
                     outputs = self.model(**inputs)
-                    embeddings = outputs.last_hidden_state.mean(dim=1)
-                    encoded_texts.append(embeddings.cpu().numpy().squeeze())
+                    hidden = outputs.last_hidden_state
+                    mask = inputs["attention_mask"].unsqueeze(-1).to(hidden.dtype)
+                    embeddings = (hidden * mask).sum(dim=1) / \
+                        mask.sum(dim=1).clamp(min=1.0)
+                    encoded_batches.append(embeddings.cpu().numpy())
 
-                if (i + 1) % 100 == 0:
-                    logger.info(f"已完成 {i + 1}/{len(texts)} 個文本的編碼")
+                done = start + len(batch)
+                if done // 100 > start // 100:
+                    logger.info(f"已完成 {done}/{len(texts)} 個文本的編碼")
 
             except Exception as e:
-                logger.error(f"編碼第 {i + 1} 個文本時發生錯誤: {str(e)}")
+                logger.error(
+                    f"編碼第 {start + 1}-{start + len(batch)} 個文本時發生錯誤: {str(e)}")
                 raise
 
         logger.info("文本編碼完成")
-        return np.array(encoded_texts)
+        if not encoded_batches:
+            return np.empty((0, self.dimension), dtype=np.float32)
+        return np.concatenate(encoded_batches, axis=0)
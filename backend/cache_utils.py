@@ -0,0 +1,160 @@
+"""
+快取工具
+提供具 LRU 淘汰、TTL 到期與容量上限（筆數與位元組）的執行緒安全快取
+"""
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+
+def approx_size(value: Any) -> int:
+    """粗估物件佔用的位元組數（涵蓋字串、數值陣列與巢狀容器）"""
+    nbytes = getattr(value, "nbytes", None)
+    if isinstance(nbytes, int):
+        return nbytes
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(
+            approx_size(k) + approx_size(v) for k, v in value.items())
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return sys.getsizeof(value) + sum(approx_size(v) for v in value)
+    return sys.getsizeof(value)
+
+
+class LRUCache:
+    """LRU 快取類別"""
+
+    def __init__(self, max_entries: int = 1024,
+                 max_bytes: Optional[int] = None,
+                 ttl: Optional[float] = None,
+                 size_fn: Callable[[Any], int] = approx_size,
+                 on_evict: Optional[Callable[[Hashable, Any], None]] = None):
+        """
+        初始化快取
+
+        參數:
+            max_entries: 最多保留的項目數
+            max_bytes: 估計佔用位元組上限（None 表示不限）
+            ttl: 項目存活秒數（None 表示不過期）
+            size_fn: 估計項目大小的函式
+            on_evict: 項目被淘汰或過期時的回呼
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.size_fn = size_fn
+        self.on_evict = on_evict
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _remove(self, key: Hashable, evicted: bool):
+        value, size, _ = self._data.pop(key)
+        self._bytes -= size
+        if evicted:
+            self.evictions += 1
+            if self.on_evict is not None:
+                self.on_evict(key, value)
+
+    def _enforce_limits(self):
+        """淘汰最久未使用的項目直到符合容量上限（至少保留最新的一筆）"""
+        while len(self._data) > 1 and (
+                len(self._data) > self.max_entries or
+                (self.max_bytes is not None and self._bytes > self.max_bytes)):
+            self._remove(next(iter(self._data)), evicted=True)
+
+    def _expired(self, stored_at: float, now: float) -> bool:
+        return self.ttl is not None and now - stored_at > self.ttl
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """取得項目並標記為最近使用；不存在或已過期時返回 default"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            if self._expired(entry[2], time.monotonic()):
+                self._remove(key, evicted=True)
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: Hashable, value: Any):
+        """寫入項目，必要時淘汰最久未使用的項目"""
+        size = self.size_fn(value)
+        with self._lock:
+            if key in self._data:
+                self._remove(key, evicted=False)
+            self._data[key] = (value, size, time.monotonic())
+            self._bytes += size
+            self._enforce_limits()
+
+    def touch(self, key: Hashable):
+        """重新計算項目大小與存活時間（項目內容就地修改後呼叫）"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return
+            value, size, _ = entry
+            new_size = self.size_fn(value)
+            self._data[key] = (value, new_size, time.monotonic())
+            self._data.move_to_end(key)
+            self._bytes += new_size - size
+            self._enforce_limits()
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        """移除並返回項目"""
+        with self._lock:
+            if key not in self._data:
+                return default
+            value = self._data[key][0]
+            self._remove(key, evicted=False)
+            return value
+
+    def purge_expired(self) -> int:
+        """清除所有已過期項目，返回清除數量"""
+        if self.ttl is None:
+            return 0
+        now = time.monotonic()
+        with self._lock:
+            expired = [k for k, (_, _, t) in self._data.items() if self._expired(t, now)]
+            for key in expired:
+                self._remove(key, evicted=True)
+        return len(expired)
+
+    def clear(self):
+        """清空快取"""
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._data
+
+    @property
+    def nbytes(self) -> int:
+        """目前估計佔用的位元組數"""
+        return self._bytes
+
+    def snapshot(self) -> Dict:
+        """快取統計資訊"""
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._data),
+            "bytes": self._bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions
+        }
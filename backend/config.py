@@ -0,0 +1,169 @@
+"""
+服務設定
+集中管理可透過環境變數覆寫的執行參數
+"""
+import os
+
+
+def _env_str(name: str, default: str) -> str:
+    """讀取字串型環境變數"""
+    return os.environ.get(name, default)
+
+
+def _env_int(name: str, default: int) -> int:
+    """讀取整數型環境變數，格式錯誤時使用預設值"""
+    try:
+        return int(os.environ.get(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def _env_float(name: str, default: float) -> float:
+    """讀取浮點數型環境變數，格式錯誤時使用預設值"""
+    try:
+        return float(os.environ.get(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    """讀取布林型環境變數（1/true/yes/on 視為真）"""
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+# 服務位址
+HOST = _env_str("EDURAIL_HOST", "0.0.0.0")
+PORT = _env_int("EDURAIL_PORT", 8000)
+
+# 學群資料與向量索引（CSV 僅在知識庫尚未建立時作為匯入來源）
+CSV_PATH = _env_str("EDURAIL_CSV_PATH", "college_details_ALL.csv")
+KB_DIR = _env_str("EDURAIL_KB_DIR", "kb")
+INDEX_DIR = _env_str("EDURAIL_INDEX_DIR", "index")
+# 知識庫熱更新：檢查 CURRENT 的間隔秒數（0 表示停用）與保留的舊版本數
+KB_WATCH_INTERVAL = _env_float("EDURAIL_KB_WATCH_INTERVAL", 10.0)
+KB_KEEP_VERSIONS = _env_int("EDURAIL_KB_KEEP_VERSIONS", 2)
+
+# 多工作程序設定（WORKERS > 1 時使用預先載入的 fork 模式）
+WORKERS = _env_int("EDURAIL_WORKERS", 1)
+WORKER_TORCH_THREADS = _env_int("EDURAIL_WORKER_TORCH_THREADS", 0)
+# 工作程序執行未滿 WORKER_MIN_UPTIME 秒即結束視為啟動失敗，以指數退避重新啟動，
+# 連續 WORKER_MAX_RAPID_FAILURES 次時停止服務
+WORKER_MIN_UPTIME = _env_float("EDURAIL_WORKER_MIN_UPTIME", 10.0)
+WORKER_MAX_RAPID_FAILURES = _env_int("EDURAIL_WORKER_MAX_RAPID_FAILURES", 5)
+
+# 獨立編碼服務（以逗號分隔的 Unix socket 路徑，留空表示於工作程序內直接編碼）
+ENCODER_SOCKETS = [p for p in _env_str("EDURAIL_ENCODER_SOCKETS", "").split(",") if p]
+ENCODER_MODEL = _env_str("EDURAIL_ENCODER_MODEL", "bert-base-chinese")
+ENCODER_RETRY_TIMEOUT = _env_float("EDURAIL_ENCODER_RETRY_TIMEOUT", 30.0)
+
+# 交叉編碼器重排序（前 top_k+1 名相鄰分數差距小於 RERANK_MARGIN 時才呼叫）
+RERANK_ENABLED = _env_bool("EDURAIL_RERANK_ENABLED", False)
+RERANK_MODEL = _env_str("EDURAIL_RERANK_MODEL", "BAAI/bge-reranker-base")
+RERANK_CANDIDATES = _env_int("EDURAIL_RERANK_CANDIDATES", 8)
+RERANK_MARGIN = _env_float("EDURAIL_RERANK_MARGIN", 0.05)
+RERANK_CACHE_SIZE = _env_int("EDURAIL_RERANK_CACHE_SIZE", 4096)
+
+# Ollama 排程（准入控制與 AIMD 並行上限）
+OLLAMA_REQUEST_TIMEOUT = _env_float("EDURAIL_OLLAMA_TIMEOUT", 120.0)
+OLLAMA_INITIAL_CONCURRENCY = _env_int("EDURAIL_OLLAMA_INITIAL_CONCURRENCY", 4)
+OLLAMA_MAX_CONCURRENCY = _env_int("EDURAIL_OLLAMA_MAX_CONCURRENCY", 16)
+OLLAMA_TARGET_LATENCY = _env_float("EDURAIL_OLLAMA_TARGET_LATENCY", 20.0)
+
+# 對話請求的端對端時間預算（0 表示不限）；剩餘時間不足以生成時改以檢索結果回答，
+# 生成逾時時已串流的文字達下限則返回部分文字
+REQUEST_BUDGET = _env_float("EDURAIL_REQUEST_BUDGET", 30.0)
+DEGRADE_MIN_GENERATION_BUDGET = _env_float("EDURAIL_DEGRADE_MIN_GENERATION_BUDGET", 1.0)
+DEGRADE_MIN_PARTIAL_CHARS = _env_int("EDURAIL_DEGRADE_MIN_PARTIAL_CHARS", 40)
+
+# Ollama 端點（以分號分隔，可用 | 宣告端點提供的模型，例如 http://h1:11434|llama3;http://h2:11434）
+OLLAMA_ENDPOINTS = _env_str("EDURAIL_OLLAMA_ENDPOINTS", "http://127.0.0.1:11434")
+OLLAMA_MODEL = _env_str("EDURAIL_OLLAMA_MODEL", "llama3")
+OLLAMA_PROBE_INTERVAL = _env_float("EDURAIL_OLLAMA_PROBE_INTERVAL", 10.0)
+OLLAMA_WARMUP_INTERVAL = _env_float("EDURAIL_OLLAMA_WARMUP_INTERVAL", 300.0)
+
+# 准入控制：/api/chat 同時處理數與等待佇列上限（超過時回應 429 與 Retry-After）
+ADMISSION_MAX_IN_FLIGHT = _env_int("EDURAIL_ADMISSION_MAX_IN_FLIGHT", 32)
+ADMISSION_MAX_QUEUE = _env_int("EDURAIL_ADMISSION_MAX_QUEUE", 64)
+ADMISSION_QUEUE_TIMEOUT = _env_float("EDURAIL_ADMISSION_QUEUE_TIMEOUT", 10.0)
+# 每個用戶端位址（有工作階段時為位址下的每個工作階段）的令牌桶限速（每秒請求數，0 表示不限速）
+# expensive：需呼叫語言模型的接口；cheap：純檢索與工作階段查詢
+RATE_LIMIT_EXPENSIVE_RATE = _env_float("EDURAIL_RATE_LIMIT_EXPENSIVE_RATE", 0.5)
+RATE_LIMIT_EXPENSIVE_BURST = _env_int("EDURAIL_RATE_LIMIT_EXPENSIVE_BURST", 5)
+RATE_LIMIT_CHEAP_RATE = _env_float("EDURAIL_RATE_LIMIT_CHEAP_RATE", 5.0)
+RATE_LIMIT_CHEAP_BURST = _env_int("EDURAIL_RATE_LIMIT_CHEAP_BURST", 20)
+RATE_LIMIT_MAX_CLIENTS = _env_int("EDURAIL_RATE_LIMIT_MAX_CLIENTS", 10000)
+# 同一位址所有工作階段合計的額度（單一工作階段額度的倍數）
+RATE_LIMIT_SESSIONS_PER_ADDRESS = _env_int("EDURAIL_RATE_LIMIT_SESSIONS_PER_ADDRESS", 10)
+# 允許跨來源請求的網域（以逗號分隔，* 表示全部）
+CORS_ORIGINS = [o.strip() for o in _env_str("EDURAIL_CORS_ORIGINS", "*").split(",") if o.strip()]
+
+# 多輪對話工作階段
+SESSION_MAX_SESSIONS = _env_int("EDURAIL_SESSION_MAX_SESSIONS", 10000)
+SESSION_MAX_BYTES = _env_int("EDURAIL_SESSION_MAX_BYTES", 64 * 1024 * 1024)
+SESSION_TTL = _env_float("EDURAIL_SESSION_TTL", 3600.0)
+SESSION_MAX_TURNS = _env_int("EDURAIL_SESSION_MAX_TURNS", 6)
+SESSION_KEEP_TURNS = _env_int("EDURAIL_SESSION_KEEP_TURNS", 3)
+SESSION_LLM_SUMMARY = _env_bool("EDURAIL_SESSION_LLM_SUMMARY", False)
+
+# 批次問題（/api/chat/batch）
+BATCH_MAX_MESSAGES = _env_int("EDURAIL_BATCH_MAX_MESSAGES", 100)
+BATCH_CONCURRENCY = _env_int("EDURAIL_BATCH_CONCURRENCY", 4)
+# 批次與多查詢請求的逐項限速：每個請求照常扣除 expensive/cheap 一個令牌，另依題數（查詢數）
+# 扣除逐項額度（每秒項數，0 表示不限速）。桶容量至少為 BATCH_MAX_MESSAGES，驗證允許的最大批次不會被拒絕
+RATE_LIMIT_EXPENSIVE_ITEMS_RATE = _env_float("EDURAIL_RATE_LIMIT_EXPENSIVE_ITEMS_RATE", 1.0)
+RATE_LIMIT_EXPENSIVE_ITEMS_BURST = max(
+    BATCH_MAX_MESSAGES, _env_int("EDURAIL_RATE_LIMIT_EXPENSIVE_ITEMS_BURST", BATCH_MAX_MESSAGES))
+RATE_LIMIT_CHEAP_ITEMS_RATE = _env_float("EDURAIL_RATE_LIMIT_CHEAP_ITEMS_RATE", 20.0)
+RATE_LIMIT_CHEAP_ITEMS_BURST = max(
+    BATCH_MAX_MESSAGES, _env_int("EDURAIL_RATE_LIMIT_CHEAP_ITEMS_BURST", 2 * BATCH_MAX_MESSAGES))
+
+# 預先產生的標準回答（學群 x 模板類型）
+ANSWER_STORE_DIR = _env_str("EDURAIL_ANSWER_STORE_DIR", "answers")
+ANSWER_MIN_CONFIDENCE = _env_float("EDURAIL_ANSWER_MIN_CONFIDENCE", 1.0)
+ANSWER_MIN_SIMILARITY = _env_float("EDURAIL_ANSWER_MIN_SIMILARITY", 0.9)
+ANSWER_AUTO_REGENERATE = _env_bool("EDURAIL_ANSWER_AUTO_REGENERATE", True)
+
+# 學生學習成效分析（學習歷程資料表、分群結果快取、k-means 群數、最近同儕數）
+ANALYTICS_CSV_PATH = _env_str("EDURAIL_ANALYTICS_CSV_PATH", "../data.csv")
+ANALYTICS_CACHE_DIR = _env_str("EDURAIL_ANALYTICS_CACHE_DIR", "analytics")
+ANALYTICS_CLUSTERS = _env_int("EDURAIL_ANALYTICS_CLUSTERS", 4)
+ANALYTICS_PEERS = _env_int("EDURAIL_ANALYTICS_PEERS", 5)
+ANALYTICS_REFRESH_INTERVAL = _env_float("EDURAIL_ANALYTICS_REFRESH_INTERVAL", 30.0)
+
+# 學習事件增量彙總（原始事件檔目錄、累計狀態檔、輸出的特徵表、每次讀取的位元組數）
+# 輸出與 ANALYTICS_CSV_PATH 分開，確認後再將 EDURAIL_ANALYTICS_CSV_PATH 指向輸出檔
+ACTIVITY_EVENTS_DIR = _env_str("EDURAIL_ACTIVITY_EVENTS_DIR", "../activity_logs")
+ACTIVITY_STATE_PATH = _env_str("EDURAIL_ACTIVITY_STATE_PATH", "analytics/ingest_state.npz")
+ACTIVITY_OUTPUT_PATH = _env_str("EDURAIL_ACTIVITY_OUTPUT_PATH", "analytics/activity_features.csv")
+ACTIVITY_CHUNK_BYTES = _env_int("EDURAIL_ACTIVITY_CHUNK_BYTES", 8 * 1024 * 1024)
+
+# 學群推薦矩陣（每位學生保存的推薦數、檢查資料表更新的間隔秒數（0 表示停用）、
+# 全體平均偏移超過幾個標準差時完整重建）
+RECOMMEND_DIR = _env_str("EDURAIL_RECOMMEND_DIR", "recommendations")
+RECOMMEND_TOP_K = _env_int("EDURAIL_RECOMMEND_TOP_K", 5)
+RECOMMEND_REFRESH_INTERVAL = _env_float("EDURAIL_RECOMMEND_REFRESH_INTERVAL", 60.0)
+RECOMMEND_DRIFT_TOLERANCE = _env_float("EDURAIL_RECOMMEND_DRIFT_TOLERANCE", 0.25)
+RECOMMEND_CONTEXT_LIMIT = _env_int("EDURAIL_RECOMMEND_CONTEXT_LIMIT", 3)
+
+# 管理接口權杖（請求標頭 X-Admin-Token；留空表示停用管理接口）
+ADMIN_TOKEN = _env_str("EDURAIL_ADMIN_TOKEN", "")
+
+# 請求剖析：管理者以 X-Profile: 1 標頭（或 ?profile=1）指定剖析單一 /api/chat 請求；
+# SAMPLE_RATE 為未指定時的抽樣比例（0 表示不抽樣），KEEP 為保留的剖析結果數
+PROFILE_DIR = _env_str("EDURAIL_PROFILE_DIR", "profiles")
+PROFILE_SAMPLE_RATE = _env_float("EDURAIL_PROFILE_SAMPLE_RATE", 0.0)
+PROFILE_KEEP = _env_int("EDURAIL_PROFILE_KEEP", 50)
+
+# 查詢紀錄：將通過准入的 /api/chat、/api/chat/batch、/api/retrieve 查詢寫入 logs/query_log.jsonl，
+# 供 replay.py 以實際流量重播。內容含使用者原始訊息、工作階段 ID 與學生編號，預設關閉；
+# 檔案超過 QUERY_LOG_MAX_BYTES 時輪替，保留 QUERY_LOG_BACKUPS 個舊檔
+QUERY_LOG_ENABLED = _env_bool("EDURAIL_QUERY_LOG_ENABLED", False)
+QUERY_LOG_MAX_BYTES = _env_int("EDURAIL_QUERY_LOG_MAX_BYTES", 50 * 1024 * 1024)
+QUERY_LOG_BACKUPS = _env_int("EDURAIL_QUERY_LOG_BACKUPS", 5)
+
+# 記憶體統計：啟動時即開始 tracemalloc 追蹤的堆疊層數（0 表示不追蹤，可由管理接口啟動）與保留的快照數
+MEMORY_TRACEMALLOC_FRAMES = _env_int("EDURAIL_MEMORY_TRACEMALLOC_FRAMES", 0)
+MEMORY_MAX_SNAPSHOTS = _env_int("EDURAIL_MEMORY_MAX_SNAPSHOTS", 8)
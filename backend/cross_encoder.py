@@ -0,0 +1,166 @@
+"""
+交叉編碼器重排序
+雙編碼器前幾名的分數差距過小時，以交叉編碼器對 (查詢, 文件) 成對評分並重新排序；
+結果以（知識庫版本, 正規化查詢, 候選集合）為鍵快取
+"""
+import logging
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+import torch
+from transformers import AutoModelForSequenceClassification, AutoTokenizer
+
+import deadline
+from cache_utils import LRUCache
+
+# 確保日誌目錄存在
+log_dir = Path("logs")
+log_dir.mkdir(exist_ok=True)
+
+# 配置重排序專用日誌
+logger = logging.getLogger(__name__)
+rerank_handler = logging.FileHandler(
+    log_dir / "cross_encoder.log", encoding='utf-8')
+rerank_handler.setFormatter(logging.Formatter(
+    '%(asctime)s - %(levelname)s - %(message)s'))
+logger.addHandler(rerank_handler)
+
+
+class CrossEncoderReranker:
+    """交叉編碼器重排序類別"""
+
+    def __init__(self, model_name: str = "BAAI/bge-reranker-base",
+                 candidates: int = 8,
+                 margin: float = 0.05,
+                 cache_size: int = 4096,
+                 max_length: int = 512,
+                 batch_size: int = 16):
+        """
+        初始化重排序器
+
+        參數:
+            model_name: 交叉編碼器模型名稱
+            candidates: 由雙編碼器取出的候選數
+            margin: 相鄰名次的相似度差距小於此值時視為難以判斷，進行重排序
+            cache_size: 重排序結果快取筆數
+            max_length: 成對輸入的最大 token 數
+            batch_size: 每批次評分的配對數
+        """
+        logger.info(f"正在初始化交叉編碼器，使用模型: {model_name}")
+        self.model_name = model_name
+        self.candidates = candidates
+        self.margin = margin
+        self.max_length = max_length
+        self.batch_size = batch_size
+        self.cache = LRUCache(max_entries=cache_size)
+        self.stats = {"queries": 0, "invocations": 0, "cache_hits": 0,
+                      "reordered": 0, "deadline_skips": 0,
+                      "added_latency_ms": 0.0}
+        self._lock = threading.Lock()
+        try:
+            self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+            self.model = AutoModelForSequenceClassification.from_pretrained(model_name)
+            self.device = torch.device(
+                "cuda" if torch.cuda.is_available() else "cpu")
+            self.model.to(self.device)
+            self.model.eval()
+        except Exception as e:
+            logger.error(f"交叉編碼器初始化失敗: {str(e)}")
+            raise
+
+    def is_ambiguous(self, hits: Sequence[Tuple[int, float]], top_k: int) -> bool:
+        """
+        判斷雙編碼器的排名是否難以判斷：前 top_k+1 名中任兩個相鄰名次的分數差距小於 margin
+        （包含第 top_k 與第 top_k+1 名，即可能被排除在上下文之外的邊界）
+        """
+        scores = [score for _, score in hits[:top_k + 1]]
+        return any(a - b < self.margin for a, b in zip(scores, scores[1:]))
+
+    def score(self, query: str, documents: Sequence[str]) -> np.ndarray:
+        """
+        計算查詢與每個文件的相關分數
+
+        參數:
+            query: 查詢文本
+            documents: 文件文本列表
+
+        返回:
+            與 documents 對應的分數陣列
+        """
+        scores = []
+        for start in range(0, len(documents), self.batch_size):
+            batch = list(documents[start:start + self.batch_size])
+            inputs = self.tokenizer([query] * len(batch), batch, return_tensors="pt",
+                                    max_length=self.max_length, truncation=True, padding=True)
+            inputs = {k: v.to(self.device) for k, v in inputs.items()}
+            with torch.no_grad():
+                logits = self.model(**inputs).logits
+            logits = logits.float().cpu().numpy()
+            # 單一輸出為相關分數；二分類模型取「相關」類別的 logit
+            scores.append(logits[:, 0] if logits.shape[-1] == 1 else logits[:, -1])
+        return np.concatenate(scores) if scores else np.zeros(0, dtype=np.float32)
+
+    def rerank(self, cache_scope: str, query: str, hits: List[Tuple[int, float]],
+               documents: Sequence[str], top_k: int) -> Tuple[List[Tuple[int, float]], bool]:
+        """
+        必要時以交叉編碼器重新排序候選
+
+        參數:
+            cache_scope: 快取範圍（知識庫版本），文件 id 僅在同一版本內有意義
+            query: 正規化後的查詢
+            hits: 雙編碼器的 [(文件 id, 相似度), ...]，依相似度排序
+            documents: 與 hits 對應的文件文本
+            top_k: 需要的結果數
+
+        返回:
+            (前 top_k 個 [(文件 id, 雙編碼器相似度), ...], 是否為最終排名)；
+            因請求預算用盡而略過重排序時為 False，呼叫端不應快取該結果
+        """
+        with self._lock:
+            self.stats["queries"] += 1
+        if len(hits) <= 1 or not self.is_ambiguous(hits, top_k):
+            return hits[:top_k], True
+
+        key = (cache_scope, query, tuple(sorted(doc_id for doc_id, _ in hits)))
+        order = self.cache.get(key)
+        if order is not None:
+            with self._lock:
+                self.stats["cache_hits"] += 1
+        elif deadline.expired():
+            # 請求已無剩餘預算，保留雙編碼器的排名
+            with self._lock:
+                self.stats["deadline_skips"] += 1
+            return hits[:top_k], False
+        else:
+            start = time.perf_counter()
+            ce_scores = self.score(query, documents)
+            order = [hits[i][0] for i in np.argsort(-ce_scores, kind="stable")]
+            self.cache.put(key, order)
+            elapsed = (time.perf_counter() - start) * 1000
+            with self._lock:
+                self.stats["invocations"] += 1
+                self.stats["added_latency_ms"] += elapsed
+                if order[:top_k] != [doc_id for doc_id, _ in hits[:top_k]]:
+                    self.stats["reordered"] += 1
+
+        bi_scores = dict(hits)
+        return [(doc_id, bi_scores[doc_id]) for doc_id in order[:top_k]], True
+
+    def snapshot(self) -> Dict:
+        """重排序統計：呼叫比例、平均增加的延遲與結果改變比例"""
+        queries = self.stats["queries"]
+        invocations = self.stats["invocations"]
+        return {
+            "model": self.model_name,
+            "candidates": self.candidates,
+            "margin": self.margin,
+            **self.stats,
+            "invocation_rate": invocations / queries if queries else 0.0,
+            "cache_hit_rate": self.stats["cache_hits"] / queries if queries else 0.0,
+            "avg_added_latency_ms": self.stats["added_latency_ms"] / invocations
+            if invocations else 0.0,
+            "cache": self.cache.snapshot()
+        }
@@ -0,0 +1,49 @@
+"""
+請求截止時間
+以 contextvar 保存目前請求的截止時間（monotonic 秒），請求處理的每個階段
+（包含 asyncio.to_thread 中的檢索與重排序）都能查詢剩餘預算並決定是否降級
+"""
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+_deadline: ContextVar[Optional[float]] = ContextVar("edurail_deadline", default=None)
+
+
+@contextmanager
+def request_deadline(budget: Optional[float]):
+    """
+    於區塊內設定請求截止時間
+
+    參數:
+        budget: 預算秒數，None 或不大於 0 表示不限
+    """
+    token = _deadline.set(
+        time.monotonic() + budget if budget and budget > 0 else None)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining() -> Optional[float]:
+    """距離截止時間的剩餘秒數（未設定截止時間時為 None）"""
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return max(0.0, deadline - time.monotonic())
+
+
+def expired() -> bool:
+    """截止時間是否已過"""
+    left = remaining()
+    return left is not None and left <= 0
+
+
+def bounded(timeout: Optional[float]) -> Optional[float]:
+    """以剩餘預算限制逾時秒數"""
+    left = remaining()
+    if left is None:
+        return timeout
+    return left if timeout is None else min(timeout, left)
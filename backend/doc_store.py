@@ -0,0 +1,157 @@
+"""
+精簡文件儲存
+只保留檢索與組裝提示詞需要的欄位，以整數 id 存取 __slots__ 紀錄，並預先組好提示詞片段，
+查詢時不需逐列存取 DataFrame 或複製文字欄位
+
+使用方式:
+    python doc_store.py --benchmark   # 比較 DataFrame 與文件儲存的每次查詢開銷與常駐記憶體
+"""
+import argparse
+import json
+import random
+import time
+import tracemalloc
+from typing import Dict, List, Optional, Sequence, Tuple
+
+
+class Document:
+    """單一學群文件"""
+
+    __slots__ = ("doc_id", "group_name", "introduction", "learning_content", "snippet")
+
+    def __init__(self, doc_id: int, group_name: str, introduction: str,
+                 learning_content: str):
+        self.doc_id = doc_id
+        self.group_name = group_name
+        self.introduction = introduction
+        self.learning_content = learning_content
+        # 組裝 RAG 上下文時使用的片段
+        self.snippet = f"【{group_name}】\n{introduction}\n{learning_content}"
+
+    def hit(self, score: float) -> Dict:
+        """檢索結果（字串直接引用文件內容，不複製）"""
+        return {
+            "doc_id": self.doc_id,
+            "group_name": self.group_name,
+            "introduction": self.introduction,
+            "learning_content": self.learning_content,
+            "snippet": self.snippet,
+            "similarity_score": score
+        }
+
+
+class DocumentStore:
+    """文件儲存類別"""
+
+    def __init__(self, documents: List[Document]):
+        self.documents = documents
+        self._by_name = {doc.group_name: doc.doc_id for doc in documents}
+
+    @classmethod
+    def from_columns(cls, columns: Dict[str, Sequence[str]]) -> "DocumentStore":
+        """
+        由欄位資料建立文件儲存
+
+        參數:
+            columns: 至少包含 group_name、introduction、learning_content 的欄位
+        """
+        return cls([Document(i, name, intro, learning) for i, (name, intro, learning) in
+                    enumerate(zip(columns["group_name"], columns["introduction"],
+                                  columns["learning_content"]))])
+
+    def __len__(self) -> int:
+        return len(self.documents)
+
+    def __getitem__(self, doc_id: int) -> Document:
+        return self.documents[doc_id]
+
+    def names(self) -> List[str]:
+        return [doc.group_name for doc in self.documents]
+
+    def find(self, group_name: str) -> Optional[Document]:
+        """依學群名稱取得文件"""
+        doc_id = self._by_name.get(group_name)
+        return None if doc_id is None else self.documents[doc_id]
+
+    def hits(self, ranked: List[Tuple[int, float]]) -> List[Dict]:
+        """將 (文件 id, 相似度) 轉為檢索結果"""
+        return [self.documents[doc_id].hit(score) for doc_id, score in ranked]
+
+
+def benchmark(csv_path: str, queries: int = 20000, top_k: int = 3) -> Dict:
+    """
+    比較 DataFrame 逐列存取與文件儲存的每次查詢開銷及常駐記憶體
+
+    參數:
+        csv_path: 學群資料 CSV
+        queries: 模擬查詢次數
+        top_k: 每次查詢的結果數
+
+    返回:
+        測量結果
+    """
+    import pandas as pd
+    from kb_store import read_csv_columns
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    df = pd.read_csv(csv_path)
+    df_bytes = tracemalloc.get_traced_memory()[0] - before
+    before = tracemalloc.get_traced_memory()[0]
+    store = DocumentStore.from_columns(read_csv_columns(csv_path))
+    store_bytes = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    rng = random.Random(0)
+    ranked = [[(rng.randrange(len(store)), rng.random()) for _ in range(top_k)]
+              for _ in range(queries)]
+
+    def df_path(hits):
+        results = []
+        for idx, score in hits:
+            row = df.iloc[idx]
+            results.append({
+                "group_name": row["group_name"],
+                "introduction": row["introduction"],
+                "learning_content": row["learning_content"],
+                "similarity_score": score
+            })
+        # 舊流程於組裝上下文時再串接一次
+        "\n\n".join(f"【{r['group_name']}】\n{r['introduction']}\n{r['learning_content']}"
+                    for r in results)
+        return results
+
+    def store_path(hits):
+        results = store.hits(hits)
+        "\n\n".join(r["snippet"] for r in results)
+        return results
+
+    def per_query_us(fn) -> float:
+        start = time.perf_counter()
+        for hits in ranked:
+            fn(hits)
+        return (time.perf_counter() - start) * 1e6 / len(ranked)
+
+    df_us = per_query_us(df_path)
+    store_us = per_query_us(store_path)
+    return {
+        "documents": len(store),
+        "dataframe_resident_bytes": df_bytes,
+        "document_store_resident_bytes": store_bytes,
+        "dataframe_us_per_query": round(df_us, 2),
+        "document_store_us_per_query": round(store_us, 2),
+        "speedup": round(df_us / store_us, 1) if store_us else 0.0
+    }
+
+
+if __name__ == "__main__":
+    import config
+
+    parser = argparse.ArgumentParser(description="文件儲存效能測量")
+    parser.add_argument("--benchmark", action="store_true")
+    parser.add_argument("--csv", default=config.CSV_PATH)
+    parser.add_argument("--queries", type=int, default=20000)
+    args = parser.parse_args()
+
+    if args.benchmark:
+        print(json.dumps(benchmark(args.csv, args.queries), ensure_ascii=False, indent=2))
@@ -0,0 +1,238 @@
+"""
+多程序語料向量建置
+將文件切成固定大小的分片，由程序池中的工作程序各自載入編碼器並批次編碼，
+結果直接寫入預先配置的記憶體映射矩陣（.npy）；每個分片完成後留下標記檔，
+中斷後重新執行會略過已完成的分片。全部完成後寫入 manifest 並發佈至向量索引目錄，
+檢索器啟動時即可直接以 mmap 載入（與 EmbeddingIndexStore 使用相同的檔名與版本鍵）
+
+目錄結構:
+    index/
+      embeddings_<key>.npy          # 發佈後的向量矩陣
+      embeddings_<key>.json         # manifest
+      .build_<key>/                 # 建置中的工作目錄（完成後刪除）
+        build.json                  # 建置參數（恢復時比對）
+        embeddings.npy              # 預先配置的輸出矩陣
+        shards/<id>.done            # 已完成的分片
+
+使用方式:
+    python embed_build.py --workers 4
+    python embed_build.py --csv college_details_ALL.csv --workers 8 --shard-size 2048
+    python embed_build.py --workers 4 --attach-kb    # 另寫入附帶向量的知識庫新版本
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from index_store import EmbeddingIndexStore
+
+# 確保日誌目錄存在
+log_dir = Path("logs")
+log_dir.mkdir(exist_ok=True)
+
+# 配置向量建置專用日誌
+logger = logging.getLogger(__name__)
+build_handler = logging.FileHandler(
+    log_dir / "embed_build.log", encoding='utf-8')
+build_handler.setFormatter(logging.Formatter(
+    '%(asctime)s - %(levelname)s - %(message)s'))
+logger.addHandler(build_handler)
+
+BUILD_FORMAT_VERSION = 1
+
+# 工作程序內的編碼器（由 _init_worker 載入一次）
+_worker_encoder = None
+
+
+def _init_worker(model_name: str, batch_size: int, torch_threads: int):
+    """工作程序初始化：限制 PyTorch 執行緒數並載入編碼器"""
+    global _worker_encoder
+    import torch
+    from bert_encoder import BERTEncoder
+    if torch_threads > 0:
+        torch.set_num_threads(torch_threads)
+    _worker_encoder = BERTEncoder(model_name, batch_size=batch_size)
+
+
+def _worker_dimension() -> int:
+    return _worker_encoder.dimension
+
+
+def _encode_shard(shard_id: int, start: int, texts: List[str],
+                  output_path: str, done_path: str) -> Tuple[int, int, float]:
+    """
+    編碼一個分片並寫入輸出矩陣的對應列
+
+    參數:
+        shard_id: 分片編號
+        start: 分片第一筆文件的列號
+        texts: 分片的文件文本
+        output_path: 預先配置的 .npy 輸出矩陣
+        done_path: 完成標記檔路徑
+
+    返回:
+        (分片編號, 文件數, 耗時秒數)
+    """
+    from rag_retriever import RAGRetriever
+
+    began = time.perf_counter()
+    embeddings = RAGRetriever._normalize(_worker_encoder.encode(texts))
+    output = np.load(output_path, mmap_mode='r+')
+    output[start:start + len(texts)] = embeddings
+    output.flush()
+    del output
+    # 資料寫入後才留下標記，中斷時未標記的分片會重新編碼
+    tmp_path = f"{done_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(str(len(texts)))
+    os.replace(tmp_path, done_path)
+    return shard_id, len(texts), time.perf_counter() - began
+
+
+def _shards(num_docs: int, shard_size: int) -> List[Tuple[int, int, int]]:
+    """[(分片編號, 起始列, 結束列), ...]"""
+    return [(i, start, min(start + shard_size, num_docs))
+            for i, start in enumerate(range(0, num_docs, shard_size))]
+
+
+def build_embeddings(texts: Sequence[str], model_name: str, index_dir: str,
+                     workers: int = 2, shard_size: int = 1024,
+                     batch_size: int = 32, torch_threads: int = 0) -> Dict:
+    """
+    以多程序建置語料向量並發佈至向量索引目錄
+
+    參數:
+        texts: 文件文本（與 RAGRetriever.document_texts 相同）
+        model_name: 編碼模型名稱
+        index_dir: 向量索引目錄
+        workers: 工作程序數
+        shard_size: 每個分片的文件數
+        batch_size: 工作程序內每批次推論的文本數
+        torch_threads: 每個工作程序的 PyTorch 執行緒數（0 表示依 CPU 核心數平分）
+
+    返回:
+        manifest
+    """
+    texts = list(texts)
+    store = EmbeddingIndexStore(index_dir)
+    key = EmbeddingIndexStore.corpus_hash(texts, model_name)
+    final_path = store._path_for(key)
+    manifest_path = final_path.with_suffix(".json")
+    if final_path.exists() and manifest_path.exists():
+        logger.info(f"向量索引 {final_path} 已存在，略過建置")
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    work_dir = Path(index_dir) / f".build_{key[:16]}"
+    shard_dir = work_dir / "shards"
+    output_path = work_dir / "embeddings.npy"
+    state_path = work_dir / "build.json"
+    shards = _shards(len(texts), shard_size)
+    if torch_threads <= 0:
+        torch_threads = max(1, (os.cpu_count() or 1) // workers)
+
+    began = time.perf_counter()
+    # 工作程序以 spawn 啟動，避免 fork 已初始化的 PyTorch 執行緒池
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                             initializer=_init_worker,
+                             initargs=(model_name, batch_size, torch_threads)) as pool:
+        dim = pool.submit(_worker_dimension).result()
+        state = {"format_version": BUILD_FORMAT_VERSION, "key": key, "model": model_name,
+                 "num_docs": len(texts), "dim": dim, "shard_size": shard_size}
+
+        resumed = False
+        if state_path.exists() and output_path.exists():
+            with open(state_path, 'r', encoding='utf-8') as f:
+                resumed = json.load(f) == state
+        if not resumed:
+            shutil.rmtree(work_dir, ignore_errors=True)
+            shard_dir.mkdir(parents=True)
+            # 預先配置完整的輸出矩陣，各工作程序直接寫入自己的列範圍
+            np.lib.format.open_memmap(output_path, mode='w+', dtype=np.float32,
+                                      shape=(len(texts), dim)).flush()
+            with open(state_path, 'w', encoding='utf-8') as f:
+                json.dump(state, f, indent=2)
+
+        pending = [s for s in shards if not (shard_dir / f"{s[0]}.done").exists()]
+        skipped = len(shards) - len(pending)
+        logger.info(f"開始建置向量：{len(texts)} 筆文件、{len(shards)} 個分片"
+                    f"（略過已完成 {skipped} 個）、{workers} 個工作程序")
+        futures = [pool.submit(_encode_shard, shard_id, start, texts[start:end],
+                               str(output_path), str(shard_dir / f"{shard_id}.done"))
+                   for shard_id, start, end in pending]
+        encoded_docs = sum(end - start for _, start, end in pending)
+        done_docs = len(texts) - encoded_docs
+        for future in as_completed(futures):
+            shard_id, count, seconds = future.result()
+            done_docs += count
+            logger.info(f"分片 {shard_id} 完成（{count} 筆，{seconds:.1f} 秒），"
+                        f"進度 {done_docs}/{len(texts)}")
+
+    elapsed = time.perf_counter() - began
+    manifest = {
+        **state,
+        "dtype": "float32",
+        "normalized": True,
+        "shards": len(shards),
+        "resumed_shards": skipped,
+        "workers": workers,
+        "torch_threads": torch_threads,
+        "elapsed_seconds": round(elapsed, 2),
+        "docs_per_second": round(encoded_docs / elapsed, 2) if elapsed else 0.0,
+        "created_at": datetime.now().isoformat()
+    }
+    # 先發佈矩陣再寫 manifest；manifest 存在即表示建置完成
+    os.replace(output_path, final_path)
+    tmp_manifest = manifest_path.with_name(f"{manifest_path.name}.{os.getpid()}.tmp")
+    with open(tmp_manifest, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_manifest, manifest_path)
+    shutil.rmtree(work_dir, ignore_errors=True)
+    logger.info(f"向量索引已發佈: {final_path}（{elapsed:.1f} 秒）")
+    return manifest
+
+
+if __name__ == "__main__":
+    import config
+    from kb_store import KnowledgeBase, current_version, read_csv_columns, write_knowledge_base
+    from rag_retriever import RAGRetriever
+
+    parser = argparse.ArgumentParser(description="多程序建置語料向量")
+    parser.add_argument("--csv", default=None, help="由 CSV 讀取文件（預設使用知識庫目前版本）")
+    parser.add_argument("--kb-dir", default=config.KB_DIR)
+    parser.add_argument("--index-dir", default=config.INDEX_DIR)
+    parser.add_argument("--model", default=config.ENCODER_MODEL)
+    parser.add_argument("--workers", type=int, default=max(1, os.cpu_count() or 1))
+    parser.add_argument("--shard-size", type=int, default=1024)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--torch-threads", type=int, default=0)
+    parser.add_argument("--attach-kb", action="store_true",
+                        help="完成後寫入附帶向量的知識庫新版本")
+    args = parser.parse_args()
+
+    if args.csv or current_version(args.kb_dir) is None:
+        columns = read_csv_columns(args.csv or config.CSV_PATH)
+    else:
+        columns = KnowledgeBase.open(args.kb_dir).columns
+    texts = RAGRetriever.document_texts(columns)
+    manifest = build_embeddings(texts, args.model, args.index_dir, args.workers,
+                                args.shard_size, args.batch_size, args.torch_threads)
+    print(json.dumps(manifest, ensure_ascii=False, indent=2))
+
+    if args.attach_kb:
+        key = EmbeddingIndexStore.corpus_hash(texts, args.model)
+        embeddings = EmbeddingIndexStore(args.index_dir).load(key)
+        version = write_knowledge_base(
+            args.kb_dir, {name: list(values) for name, values in columns.items()},
+            embeddings, args.model, source=args.csv or f"kb:{current_version(args.kb_dir)}")
+        print(f"知識庫版本 {version} 已附上向量")
@@ -0,0 +1,361 @@
+"""
+獨立的 BERT 編碼服務
+由一個（或一組）專用程序負責文本編碼，FastAPI 工作程序透過本機 Unix socket 呼叫，
+讓 CPU 密集的編碼能力與 API 工作程序數量脫鉤
+
+二進位協定（網路位元組序）:
+    請求: magic(H) 文本數(I)，接著每筆文本為 長度(I) + UTF-8 位元組
+    回應: magic(H) 狀態(B) 筆數(I) 維度(I)，接著為 筆數*維度 個 little-endian float32；
+          狀態非 0 時改為 長度(I) + UTF-8 錯誤訊息
+
+使用方式:
+    python encoder_service.py --socket /tmp/edurail-encoder.sock --threads 4
+    python encoder_service.py --socket /tmp/edurail-encoder.sock --processes 2
+    （--processes N 會建立 /tmp/edurail-encoder-0.sock ... 等 N 個 socket）
+"""
+import argparse
+import asyncio
+import itertools
+import logging
+import multiprocessing
+import os
+import socket
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# 確保日誌目錄存在
+log_dir = Path("logs")
+log_dir.mkdir(exist_ok=True)
+
+# 配置編碼服務專用日誌
+logger = logging.getLogger(__name__)
+service_handler = logging.FileHandler(
+    log_dir / "encoder_service.log", encoding='utf-8')
+service_handler.setFormatter(logging.Formatter(
+    '%(asctime)s - %(levelname)s - %(message)s'))
+logger.addHandler(service_handler)
+
+MAGIC = 0xED01
+REQUEST_HEADER = struct.Struct("!HI")
+RESPONSE_HEADER = struct.Struct("!HBII")
+LENGTH = struct.Struct("!I")
+STATUS_OK = 0
+STATUS_ERROR = 1
+VECTOR_DTYPE = np.dtype("<f4")
+
+
+def encode_request(texts: Sequence[str]) -> bytes:
+    """將文本列表打包為請求訊框"""
+    parts = [REQUEST_HEADER.pack(MAGIC, len(texts))]
+    for text in texts:
+        data = text.encode('utf-8')
+        parts.append(LENGTH.pack(len(data)))
+        parts.append(data)
+    return b"".join(parts)
+
+
+def encode_response(vectors: np.ndarray) -> bytes:
+    """將向量矩陣打包為回應訊框"""
+    vectors = np.ascontiguousarray(vectors, dtype=VECTOR_DTYPE)
+    if vectors.ndim == 1:
+        vectors = vectors.reshape(1, -1)
+    count, dim = vectors.shape if vectors.size else (0, 0)
+    return RESPONSE_HEADER.pack(MAGIC, STATUS_OK, count, dim) + vectors.tobytes()
+
+
+def encode_error(message: str) -> bytes:
+    """將錯誤訊息打包為回應訊框"""
+    data = message.encode('utf-8')
+    return RESPONSE_HEADER.pack(MAGIC, STATUS_ERROR, 0, 0) + LENGTH.pack(len(data)) + data
+
+
+class EncoderService:
+    """編碼服務伺服器類別，合併多個呼叫端的請求後批次推論"""
+
+    def __init__(self, encoder, max_batch_size: int = 64,
+                 max_wait_ms: float = 5.0, concurrency: int = 1):
+        """
+        初始化編碼服務
+
+        參數:
+            encoder: 具備 encode(texts) 方法的編碼器
+            max_batch_size: 單次推論最多合併的文本數
+            max_wait_ms: 等待更多請求加入批次的最長毫秒數
+            concurrency: 同時進行的批次推論數
+        """
+        self.encoder = encoder
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.concurrency = max(1, concurrency)
+        self.executor = ThreadPoolExecutor(max_workers=self.concurrency)
+        self.queue: Optional[asyncio.Queue] = None
+        self.stats = {"requests": 0, "texts": 0, "batches": 0}
+
+    async def _batch_worker(self):
+        """從佇列收集請求、合併為批次並交由執行緒池推論"""
+        loop = asyncio.get_running_loop()
+        while True:
+            items: List[Tuple[List[str], asyncio.Future]] = [await self.queue.get()]
+            total = len(items[0][0])
+            deadline = loop.time() + self.max_wait
+            while total < self.max_batch_size:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), remaining)
+                except asyncio.TimeoutError:
+                    break
+                items.append(item)
+                total += len(item[0])
+
+            texts = [text for batch, _ in items for text in batch]
+            try:
+                vectors = await loop.run_in_executor(
+                    self.executor, self.encoder.encode, texts)
+                self.stats["batches"] += 1
+                offset = 0
+                for batch, future in items:
+                    if not future.done():
+                        future.set_result(vectors[offset:offset + len(batch)])
+                    offset += len(batch)
+            except Exception as e:
+                logger.error(f"批次編碼 {len(texts)} 個文本時發生錯誤: {str(e)}")
+                for _, future in items:
+                    if not future.done():
+                        future.set_exception(e)
+
+    async def _handle_connection(self, reader: asyncio.StreamReader,
+                                 writer: asyncio.StreamWriter):
+        """處理單一連線，連線可重複送出多個請求"""
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                try:
+                    header = await reader.readexactly(REQUEST_HEADER.size)
+                except asyncio.IncompleteReadError:
+                    break
+                magic, count = REQUEST_HEADER.unpack(header)
+                if magic != MAGIC:
+                    writer.write(encode_error("無效的協定標頭"))
+                    await writer.drain()
+                    break
+
+                texts = []
+                for _ in range(count):
+                    (length,) = LENGTH.unpack(await reader.readexactly(LENGTH.size))
+                    texts.append((await reader.readexactly(length)).decode('utf-8'))
+
+                self.stats["requests"] += 1
+                self.stats["texts"] += len(texts)
+                if not texts:
+                    writer.write(encode_response(np.empty((0, 0))))
+                    await writer.drain()
+                    continue
+
+                future = loop.create_future()
+                await self.queue.put((texts, future))
+                try:
+                    writer.write(encode_response(await future))
+                except Exception as e:
+                    writer.write(encode_error(str(e)))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, socket_path: str):
+        """
+        於 Unix socket 上提供編碼服務
+
+        參數:
+            socket_path: Unix socket 路徑
+        """
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        self.queue = asyncio.Queue()
+        workers = [asyncio.create_task(self._batch_worker())
+                   for _ in range(self.concurrency)]
+        server = await asyncio.start_unix_server(self._handle_connection, path=socket_path)
+        logger.info(
+            f"編碼服務已啟動: {socket_path}（批次上限 {self.max_batch_size}，"
+            f"等待 {self.max_wait * 1000:.1f} ms，並行 {self.concurrency}）")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            if os.path.exists(socket_path):
+                os.unlink(socket_path)
+
+
+class RemoteEncoder:
+    """
+    編碼服務用戶端
+    提供與 BERTEncoder 相同的 encode 介面，可直接交給 RAGRetriever 使用
+    """
+
+    def __init__(self, socket_paths: Sequence[str],
+                 model_name: str = "bert-base-chinese",
+                 timeout: float = 30.0, retry_timeout: float = 30.0):
+        """
+        初始化編碼服務用戶端
+
+        參數:
+            socket_paths: 一個或多個編碼服務的 Unix socket 路徑
+            model_name: 服務端使用的模型名稱（用於索引版本鍵）
+            timeout: 單次請求逾時秒數
+            retry_timeout: 服務重啟或暫時無法連線時持續重試的秒數
+        """
+        if not socket_paths:
+            raise ValueError("至少需要一個編碼服務 socket 路徑")
+        self.socket_paths = list(socket_paths)
+        self.model_name = model_name
+        self.timeout = timeout
+        self.retry_timeout = retry_timeout
+        self._local = threading.local()
+        self._cursor = itertools.count()
+
+    def _connection(self, path: str) -> socket.socket:
+        """取得目前執行緒對指定服務的連線（每個執行緒各自持有，避免互相干擾）"""
+        connections = getattr(self._local, "connections", None)
+        if connections is None:
+            connections = self._local.connections = {}
+        conn = connections.get(path)
+        if conn is None:
+            conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            conn.settimeout(self.timeout)
+            try:
+                conn.connect(path)
+            except OSError:
+                conn.close()
+                raise
+            connections[path] = conn
+        return conn
+
+    def _drop_connection(self, path: str):
+        connections = getattr(self._local, "connections", {})
+        conn = connections.pop(path, None)
+        if conn is not None:
+            conn.close()
+
+    @staticmethod
+    def _recv_exact(conn: socket.socket, size: int) -> bytes:
+        buffer = bytearray()
+        while len(buffer) < size:
+            chunk = conn.recv(size - len(buffer))
+            if not chunk:
+                raise ConnectionError("編碼服務連線已關閉")
+            buffer.extend(chunk)
+        return bytes(buffer)
+
+    def _request(self, path: str, texts: List[str]) -> np.ndarray:
+        conn = self._connection(path)
+        conn.sendall(encode_request(texts))
+        magic, status, count, dim = RESPONSE_HEADER.unpack(
+            self._recv_exact(conn, RESPONSE_HEADER.size))
+        if magic != MAGIC:
+            raise ConnectionError("編碼服務回應的協定標頭無效")
+        if status != STATUS_OK:
+            (length,) = LENGTH.unpack(self._recv_exact(conn, LENGTH.size))
+            raise RuntimeError(self._recv_exact(conn, length).decode('utf-8'))
+        payload = self._recv_exact(conn, count * dim * VECTOR_DTYPE.itemsize)
+        return np.frombuffer(payload, dtype=VECTOR_DTYPE).reshape(count, dim)
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        """
+        透過編碼服務將文本列表轉換為向量表示
+
+        多個服務時以輪詢方式分散請求；連線失敗（例如服務重啟中）會改用其他服務並持續重試，
+        直到超過 retry_timeout
+
+        參數:
+            texts: 要編碼的文本列表
+        返回:
+            文本的向量表示數組
+        """
+        deadline = time.monotonic() + self.retry_timeout
+        backoff = 0.05
+        last_error: Optional[Exception] = None
+        while True:
+            path = self.socket_paths[next(self._cursor) % len(self.socket_paths)]
+            try:
+                return self._request(path, list(texts))
+            except (OSError, ConnectionError) as e:
+                last_error = e
+                self._drop_connection(path)
+                logger.warning(f"編碼服務 {path} 連線失敗，準備重試: {str(e)}")
+            if time.monotonic() >= deadline:
+                raise ConnectionError(f"編碼服務無法使用: {last_error}")
+            time.sleep(backoff)
+            backoff = min(backoff * 2, 1.0)
+
+
+def _run_service(socket_path: str, model_name: str, threads: int,
+                 max_batch_size: int, max_wait_ms: float, concurrency: int):
+    """載入模型並啟動單一編碼服務程序"""
+    import torch
+    from bert_encoder import BERTEncoder
+
+    if threads > 0:
+        torch.set_num_threads(threads)
+    encoder = BERTEncoder(model_name, batch_size=max_batch_size)
+    service = EncoderService(encoder, max_batch_size, max_wait_ms, concurrency)
+    asyncio.run(service.serve(socket_path))
+
+
+def pool_socket_paths(socket_path: str, processes: int) -> List[str]:
+    """依服務程序數推導各程序的 socket 路徑"""
+    if processes <= 1:
+        return [socket_path]
+    stem, ext = os.path.splitext(socket_path)
+    return [f"{stem}-{i}{ext}" for i in range(processes)]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="EduRail AI BERT 編碼服務")
+    parser.add_argument("--socket", default="/tmp/edurail-encoder.sock")
+    parser.add_argument("--model", default="bert-base-chinese")
+    parser.add_argument("--processes", type=int, default=1,
+                        help="編碼服務程序數")
+    parser.add_argument("--threads", type=int, default=0,
+                        help="每個程序的 PyTorch 執行緒數（0 表示不調整）")
+    parser.add_argument("--max-batch-size", type=int, default=64)
+    parser.add_argument("--max-wait-ms", type=float, default=5.0)
+    parser.add_argument("--concurrency", type=int, default=1,
+                        help="每個程序同時進行的批次推論數")
+    args = parser.parse_args()
+
+    paths = pool_socket_paths(args.socket, args.processes)
+    service_args = (args.model, args.threads, args.max_batch_size,
+                    args.max_wait_ms, args.concurrency)
+    if len(paths) == 1:
+        _run_service(paths[0], *service_args)
+    else:
+        ctx = multiprocessing.get_context("spawn")
+        procs = {}
+        for path in paths:
+            procs[path] = ctx.Process(target=_run_service, args=(path, *service_args))
+            procs[path].start()
+        print(f"已啟動 {len(procs)} 個編碼服務: {', '.join(paths)}")
+        # 監督服務程序，異常結束時重新啟動（用戶端會在重啟期間自動改用其他服務）
+        try:
+            while True:
+                time.sleep(1.0)
+                for path, proc in list(procs.items()):
+                    if not proc.is_alive():
+                        logger.warning(f"編碼服務 {path} 已結束（{proc.exitcode}），重新啟動")
+                        procs[path] = ctx.Process(
+                            target=_run_service, args=(path, *service_args))
+                        procs[path].start()
+        except KeyboardInterrupt:
+            for proc in procs.values():
+                proc.terminate()
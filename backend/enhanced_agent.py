@@ -1,8 +1,9 @@
 # enhanced_agent.py
 import httpx
 import asyncio
+import weakref
 from datetime import datetime
-from typing import Dict, Optional
+from typing import AsyncIterator, Dict, List, Optional
 from fastapi import HTTPException
 import logging
 from pathlib import Path
@@ -10,20 +11,101 @@ from pathlib import Path
 from models import ChatRequest, ChatResponse
 from bert_encoder import BERTEncoder
 from rag_retriever import RAGRetriever
+from cross_encoder import CrossEncoderReranker
 from prompt_template import PromptTemplate
 from metrics_logger import MetricsLogger
+from ollama_scheduler import OllamaScheduler, Priority
+from ollama_pool import OllamaEndpointPool, NoHealthyEndpoint
+from generation_profiles import get_profile, estimate_tokens, DEFAULT_PROFILE
+from session_store import SessionStore, ConversationSession
+from answer_store import AnswerStore, generate_answers
+from group_recommender import GroupRecommender
+from kb_store import TextColumn, current_version, prune_versions
+import memory_report
+import deadline
+import request_profiler
+import config
 
 logger = logging.getLogger(__name__)
 
 
 class EnhancedOllamaAgent:
-    def __init__(self, csv_path: str):
+    def __init__(self, csv_path: str, index_dir: Optional[str] = None,
+                 encoder=None):
 
-        self.encoder = BERTEncoder()
-        self.retriever = RAGRetriever(csv_path, self.encoder)
+        # 未指定時於本程序載入 BERT；亦可傳入 RemoteEncoder 改用獨立編碼服務
+        self.encoder = encoder if encoder is not None else BERTEncoder()
+        self.csv_path = csv_path
+        self.index_dir = index_dir
+        self.kb_dir = config.KB_DIR
+        # 重排序器與其快取跨知識庫版本共用（快取鍵含版本）
+        self.reranker = CrossEncoderReranker(
+            config.RERANK_MODEL,
+            candidates=config.RERANK_CANDIDATES,
+            margin=config.RERANK_MARGIN,
+            cache_size=config.RERANK_CACHE_SIZE) if config.RERANK_ENABLED else None
+        self.retriever = RAGRetriever(csv_path, self.encoder, index_dir,
+                                      kb_dir=self.kb_dir, reranker=self.reranker)
+        # 知識庫熱更新：背景建立新檢索器後整個替換，進行中的請求沿用舊檢索器直到完成
+        self.kb_watch_interval = config.KB_WATCH_INTERVAL
+        self.kb_keep_versions = config.KB_KEEP_VERSIONS
+        self.kb_stats = {"loaded_at": datetime.now().isoformat(),
+                         "reloads": 0, "reload_failures": 0, "last_error": None}
+        self._retired_retrievers: List[weakref.ref] = []
+        self._reload_lock = asyncio.Lock()
+        self._kb_watch_task: Optional[asyncio.Task] = None
         self.metrics_logger = MetricsLogger()
-        self.ollama_url = "http://127.0.0.1:11434/api/chat"
+        # 可設定多個 Ollama 端點（EDURAIL_OLLAMA_ENDPOINTS），依最少進行中請求分配
+        self.ollama_pool = OllamaEndpointPool.from_spec(
+            config.OLLAMA_ENDPOINTS,
+            probe_interval=config.OLLAMA_PROBE_INTERVAL)
+        self.model_name = config.OLLAMA_MODEL
+        self.warmup_interval = config.OLLAMA_WARMUP_INTERVAL
+        self.warmup_stats = {"runs": 0, "failures": 0,
+                             "last_run": None, "endpoints": {}}
+        self._warmup_task: Optional[asyncio.Task] = None
         self.similarity_threshold = 0.5
+        self.request_timeout = config.OLLAMA_REQUEST_TIMEOUT
+        # 單一對話請求的端對端時間預算，生成來不及完成時降級回答
+        self.request_budget = config.REQUEST_BUDGET
+        self.min_generation_budget = config.DEGRADE_MIN_GENERATION_BUDGET
+        self.min_partial_chars = config.DEGRADE_MIN_PARTIAL_CHARS
+        self.degradation_stats = {"budgeted_requests": 0, "retrieval_only": 0,
+                                  "partial_text": 0, "unrecoverable": 0,
+                                  "budget_exhausted": 0, "generation_timeout": 0}
+        self.scheduler = OllamaScheduler(
+            initial_limit=config.OLLAMA_INITIAL_CONCURRENCY,
+            max_limit=config.OLLAMA_MAX_CONCURRENCY,
+            target_latency=config.OLLAMA_TARGET_LATENCY)
+        self.sessions = SessionStore(
+            max_sessions=config.SESSION_MAX_SESSIONS,
+            max_bytes=config.SESSION_MAX_BYTES,
+            ttl=config.SESSION_TTL,
+            max_turns=config.SESSION_MAX_TURNS,
+            keep_turns=config.SESSION_KEEP_TURNS)
+        self.llm_summary = config.SESSION_LLM_SUMMARY
+        self.batch_concurrency = config.BATCH_CONCURRENCY
+        # 預先產生的（學群 x 模板類型）回答，與目前語料版本綁定
+        self.answer_store = AnswerStore(config.ANSWER_STORE_DIR)
+        self.answer_store.load(self.retriever.corpus_version)
+        self.answer_min_confidence = config.ANSWER_MIN_CONFIDENCE
+        self.answer_min_similarity = config.ANSWER_MIN_SIMILARITY
+        self.answer_auto_regenerate = config.ANSWER_AUTO_REGENERATE
+        self._answer_task: Optional[asyncio.Task] = None
+        # 依學習歷程預先計算的學群推薦矩陣，對話時以 user_sn 查表放入上下文
+        self.recommender = GroupRecommender(
+            config.ANALYTICS_CSV_PATH, config.RECOMMEND_DIR,
+            top_k=config.RECOMMEND_TOP_K,
+            drift_tolerance=config.RECOMMEND_DRIFT_TOLERANCE)
+        self.recommend_refresh_interval = config.RECOMMEND_REFRESH_INTERVAL
+        self.recommend_context_limit = config.RECOMMEND_CONTEXT_LIMIT
+        self._recommend_task: Optional[asyncio.Task] = None
+        try:
+            self.recommender.refresh(self.retriever)
+        except Exception as e:
+            logger.warning(f"學群推薦矩陣無法建立，對話將不附推薦: {str(e)}")
+        # 共用連線池的 HTTP 用戶端；延遲建立，確保 fork 後於各工作程序內建立
+        self._http_client: Optional[httpx.AsyncClient] = None
 
         self.system_prompt = """
         您是一個回覆繁體中文的學習與職涯輔導平台"EduRail"的專業輔導師助理 EduRailAI。
@@ -33,80 +115,623 @@ class EnhancedOllamaAgent:
         3. 回覆簡潔明確，避免冗長。
         """
 
-    async def _query_ollama(self, request: ChatRequest, context: Optional[str] = None) -> Dict:
+    def _client(self) -> httpx.AsyncClient:
+        if self._http_client is None:
+            self._http_client = httpx.AsyncClient(timeout=self.request_timeout)
+        return self._http_client
+
+    async def start(self):
+        """啟動背景工作（端點健康探測、模型預熱）"""
+        self.ollama_pool.start(self._client())
+        if self.warmup_interval > 0:
+            self._warmup_task = asyncio.create_task(self._warmup_loop())
+        self._schedule_answer_regeneration()
+        if self.kb_watch_interval > 0:
+            self._kb_watch_task = asyncio.create_task(self._kb_watch_loop())
+        if self.recommend_refresh_interval > 0:
+            self._recommend_task = asyncio.create_task(self._recommend_refresh_loop())
+
+    async def close(self):
+        """停止背景工作並關閉共用的 HTTP 用戶端"""
+        if self._warmup_task is not None:
+            self._warmup_task.cancel()
+            self._warmup_task = None
+        for task in (self._answer_task, self._kb_watch_task, self._recommend_task):
+            if task is not None:
+                task.cancel()
+        self._answer_task = self._kb_watch_task = self._recommend_task = None
+        await self.ollama_pool.stop()
+        if self._http_client is not None:
+            await self._http_client.aclose()
+            self._http_client = None
+
+    async def _post_ollama(self, payload: Dict, path: str = "/api/chat") -> Dict:
+        return await self.ollama_pool.post(self._client(), path, payload)
+
+    async def warmup(self):
+        """
+        預熱模型：對每個端點送出空提示詞的生成請求，讓模型載入並依 keep_alive 常駐記憶體
+        """
+        payload = {
+            "model": self.model_name,
+            "prompt": "",
+            "keep_alive": get_profile(DEFAULT_PROFILE).keep_alive
+        }
+        try:
+            async with self.scheduler.acquire(Priority.PREWARM, self.request_timeout):
+                results = await self.ollama_pool.post_all(
+                    self._client(), "/api/generate", payload, self.request_timeout)
+        except asyncio.TimeoutError:
+            self.warmup_stats["failures"] += 1
+            logger.warning("模型預熱等待逾時")
+            return
+        self.warmup_stats["runs"] += 1
+        self.warmup_stats["last_run"] = datetime.now().isoformat()
+        for url, result in results.items():
+            if "error" in result:
+                self.warmup_stats["failures"] += 1
+                logger.warning(f"端點 {url} 模型預熱失敗: {result['error']}")
+            self.warmup_stats["endpoints"][url] = {
+                "ok": "error" not in result,
+                "load_duration_ms": result.get("load_duration", 0) / 1e6
+            }
+
+    async def _warmup_loop(self):
+        while True:
+            try:
+                await self.warmup()
+            except Exception as e:
+                logger.error(f"模型預熱時發生錯誤: {str(e)}")
+            await asyncio.sleep(self.warmup_interval)
+
+    def _schedule_answer_regeneration(self):
+        """預先產生的回答不齊全時於背景補產生（取代進行中的舊工作）"""
+        if not self.answer_auto_regenerate or \
+                not self.answer_store.missing_pairs(self.retriever.group_names()):
+            return
+        if self._answer_task is not None:
+            self._answer_task.cancel()
+        self._answer_task = asyncio.create_task(self._regenerate_answers())
+
+    async def reload_knowledge_base(self, force: bool = False) -> Dict:
+        """
+        載入知識庫的最新版本並以原子方式替換檢索器
+
+        新檢索器於執行緒中建立（含向量準備），完成後才替換參照；已取得舊檢索器的請求
+        會以舊版本完成，舊檢索器與其記憶體映射在沒有任何參照後釋放
+
+        參數:
+            force: 版本相同時是否仍重新載入
+
+        返回:
+            {"reloaded", "kb_version", "previous_version"}
+        """
+        async with self._reload_lock:
+            old = self.retriever
+            latest = current_version(self.kb_dir)
+            if not force and latest == old.kb_version:
+                return {"reloaded": False, "kb_version": old.kb_version,
+                        "previous_version": old.kb_version}
+            try:
+                new = await asyncio.to_thread(
+                    RAGRetriever, self.csv_path, self.encoder, self.index_dir,
+                    kb_dir=self.kb_dir, reranker=self.reranker)
+            except Exception as e:
+                self.kb_stats["reload_failures"] += 1
+                self.kb_stats["last_error"] = str(e)
+                logger.error(f"重新載入知識庫時發生錯誤: {str(e)}")
+                raise
+
+            previous_version = old.kb_version
+            self.retriever = new
+            self._retired_retrievers = [
+                ref for ref in self._retired_retrievers if ref() is not None]
+            self._retired_retrievers.append(weakref.ref(old))
+            del old
+            self.kb_stats["reloads"] += 1
+            self.kb_stats["loaded_at"] = datetime.now().isoformat()
+            self.kb_stats["last_error"] = None
+            logger.info(f"知識庫已切換至版本 {new.kb_version}")
+
+            if self.answer_store.corpus_hash != new.corpus_version:
+                self.answer_store.load(new.corpus_version)
+                self._schedule_answer_regeneration()
+            prune_versions(self.kb_dir, self.kb_keep_versions)
+            return {"reloaded": True, "kb_version": new.kb_version,
+                    "previous_version": previous_version}
+
+    async def _kb_watch_loop(self):
+        """定期檢查 CURRENT 是否指向新版本"""
+        while True:
+            await asyncio.sleep(self.kb_watch_interval)
+            try:
+                if current_version(self.kb_dir) not in (None, self.retriever.kb_version):
+                    await self.reload_knowledge_base()
+            except Exception as e:
+                logger.error(f"檢查知識庫版本時發生錯誤: {str(e)}")
+
+    async def _recommend_refresh_loop(self):
+        """定期檢查學習歷程資料表或語料版本是否改變，於執行緒中增量更新推薦矩陣"""
+        while True:
+            await asyncio.sleep(self.recommend_refresh_interval)
+            retriever = self.retriever
+            try:
+                if self.recommender.is_stale(retriever.corpus_version):
+                    await asyncio.to_thread(self.recommender.refresh, retriever)
+            except Exception as e:
+                logger.error(f"更新學群推薦矩陣時發生錯誤: {str(e)}")
+
+    def _recommendation_context(self, request: ChatRequest) -> Optional[List[Dict]]:
+        """查詢請求學生的推薦學群（僅查表，矩陣尚未建立或找不到學生時返回 None）"""
+        if not request.user_sn:
+            return None
+        return self.recommender.recommend(request.user_sn, self.recommend_context_limit)
+
+    def memory_usage(self) -> Dict:
+        """
+        代理內各元件的估計記憶體用量（位元組）
+
+        共用 seen 集合計算 deep_size，文件儲存與工作階段等共享的字串只計入一次
+        """
+        retriever = self.retriever
+        seen: set = set()
+        columns = retriever.kb.columns.values()
+        usage = {
+            "encoder": {
+                "type": type(self.encoder).__name__,
+                "model": memory_report.module_usage(getattr(self.encoder, "model", None)),
+                "tokenizer": memory_report.tokenizer_usage(
+                    getattr(self.encoder, "tokenizer", None))
+            },
+            "embeddings": memory_report.array_usage(retriever.encoded_texts),
+            "knowledge_base": {
+                "bytes": sum(memory_report.deep_size(c, seen) for c in columns
+                             if not isinstance(c, TextColumn)),
+                "mapped_bytes": sum(c.nbytes for c in columns if isinstance(c, TextColumn)),
+                "documents": len(retriever.kb)
+            },
+            "document_store": {"bytes": memory_report.deep_size(retriever.docs, seen),
+                               "documents": len(retriever.docs)},
+            "caches": {
+                "retrieval": memory_report.cache_usage(retriever.result_cache),
+                "search": memory_report.cache_usage(retriever.search_cache),
+                "rerank": memory_report.cache_usage(
+                    self.reranker.cache if self.reranker else None)
+            },
+            "sessions": memory_report.cache_usage(self.sessions.sessions),
+            "metrics_history": {
+                "bytes": memory_report.deep_size(self.metrics_logger.metrics_history, seen),
+                "entries": len(self.metrics_logger.metrics_history)
+            },
+            "precomputed_answers": {
+                "bytes": memory_report.deep_size(self.answer_store.data, seen),
+                "entries": self.answer_store.count()
+            },
+            "recommendations": {
+                "bytes": memory_report.deep_size(self.recommender.matrix, seen),
+                "students": len(self.recommender.matrix.user_ids)
+                if self.recommender.matrix else 0
+            },
+            # 已替換但仍被進行中請求參照的舊檢索器（其向量與文件未計入上方）
+            "retired_retrievers": {
+                "alive": sum(1 for ref in self._retired_retrievers if ref() is not None)
+            }
+        }
+        if self.reranker is not None:
+            usage["reranker"] = {
+                "model": memory_report.module_usage(self.reranker.model),
+                "tokenizer": memory_report.tokenizer_usage(self.reranker.tokenizer)
+            }
+        return usage
+
+    def kb_snapshot(self) -> Dict:
+        """知識庫版本與熱更新統計"""
+        return {
+            "kb_version": self.retriever.kb_version,
+            "corpus_version": self.retriever.corpus_version,
+            "documents": len(self.retriever.docs),
+            # 已替換但仍被進行中請求參照的舊檢索器數量
+            "retired_alive": sum(1 for ref in self._retired_retrievers if ref() is not None),
+            **self.kb_stats
+        }
+
+    async def _regenerate_answers(self):
+        """語料變更或回答不齊全時於背景補產生；多個工作程序間只由取得檔案鎖者執行"""
+        lock = self.answer_store.acquire_generation_lock(self.retriever.corpus_version)
+        if lock is None:
+            logger.info("其他程序正在產生標準回答，略過")
+            return
+        try:
+            await generate_answers(self, self.answer_store)
+        except Exception as e:
+            logger.error(f"產生標準回答時發生錯誤: {str(e)}")
+        finally:
+            lock.close()
+
+    async def _precomputed_answer(self, request: ChatRequest, start_time: datetime,
+                                  retriever: RAGRetriever) -> Optional[ChatResponse]:
+        """
+        查詢明確對應到單一（學群, 模板類型）且與該組合的標準問題夠相似時，直接返回預先產生的回答
+
+        多輪對話的回答依賴前文；帶有學生編號的請求需附上該生的推薦學群，皆不使用預先產生的回答
+        """
+        if request.session_id or request.user_sn:
+            return None
+        # 未取得產生鎖的工作程序與離線產生的檔案都要靠重新讀取才能取得回答，須在判斷是否為空之前檢查
+        self.answer_store.maybe_refresh()
+        if not self.answer_store.count() or \
+                self.answer_store.corpus_hash != retriever.corpus_version:
+            return None
+        # 相似度檢查需編碼查詢，與檢索相同移至執行緒
+        matched = await asyncio.to_thread(
+            request_profiler.threaded(self.answer_store.match), request.message,
+            retriever.group_names(), self.answer_min_confidence,
+            retriever.encoder.encode, self.answer_min_similarity)
+        if matched is None:
+            return None
+        group_name, prompt_type = matched
+        answer = self.answer_store.lookup(group_name, prompt_type)
+        if answer is None:
+            return None
+
+        response = ChatResponse(
+            response=answer["response"],
+            source="Precomputed",
+            matched_groups=[group_name],
+            kb_version=retriever.kb_version
+        )
+        response.metrics = self.metrics_logger.log_metrics(
+            start_time, datetime.now(),
+            len(request.message),
+            len(response.response),
+            {"precomputed": {
+                "group_name": group_name,
+                "prompt_type": prompt_type,
+                "corpus_hash": self.answer_store.corpus_hash,
+                "generated_at": answer.get("generated_at")
+            }}
+        )
+        return response
+
+    @staticmethod
+    def _generation_metrics(profile_name: str, payload: Dict, result: Dict) -> Dict:
+        """整理生成設定與 Ollama 回報的 token/耗時統計"""
+        load_ms = result.get("load_duration", 0) / 1e6
+        return {
+            "profile": profile_name,
+            "num_ctx": payload["options"]["num_ctx"],
+            "num_predict": payload["options"]["num_predict"],
+            "prompt_tokens": result.get("prompt_eval_count"),
+            "generated_tokens": result.get("eval_count"),
+            "load_duration_ms": load_ms,
+            "prompt_eval_ms": result.get("prompt_eval_duration", 0) / 1e6,
+            "eval_ms": result.get("eval_duration", 0) / 1e6,
+            "total_duration_ms": result.get("total_duration", 0) / 1e6,
+            "estimated_prompt_tokens": estimate_tokens(
+                "".join(m.get("content", "") for m in payload.get("messages", []))),
+            # 載入耗時超過一秒視為冷啟動
+            "cold_start": load_ms > 1000,
+            "endpoint": result.get("endpoint")
+        }
+
+    async def _query_ollama(self, request: ChatRequest, context: Optional[str] = None,
+                            priority: Priority = Priority.INTERACTIVE,
+                            timeout: Optional[float] = None,
+                            profile_name: str = DEFAULT_PROFILE,
+                            history: Optional[List[Dict[str, str]]] = None,
+                            chunks: Optional[List[str]] = None) -> Dict:
+        """
+        經排程器送出生成請求
+
+        逾時秒數另受請求截止時間限制；提供 chunks 時以串流模式接收，
+        逾時後 chunks 保留已生成的部分文字
+        """
         try:
             prompt = request.message
             if context:
                 prompt = f"{context}\n\n使用者問題：{request.message}"
 
             payload = {
-                "model": "llama3",
+                "model": self.model_name,
                 "messages": [
                     {"role": "system", "content": self.system_prompt},
+                    *(history or []),
                     {"role": "user", "content": prompt}
                 ],
                 "stream": False
             }
+            # 套用生成設定檔（num_predict、num_ctx、停止序列、keep_alive）
+            get_profile(profile_name).apply(payload)
 
-            async with httpx.AsyncClient(timeout=120.0) as client:
-                response = await client.post(
-                    self.ollama_url,
-                    json=payload,
-                    headers={'Content-Type': 'application/json'}
-                )
-                response.raise_for_status()
-                return response.json()
+            # 經排程器取得名額後才送出，依優先等級排隊並套用截止時間
+            if timeout is None:
+                timeout = self.request_timeout
+            timeout = deadline.bounded(timeout)
+            async with self.scheduler.acquire(priority, timeout) as ticket:
+                post = self._post_ollama(payload) if chunks is None else \
+                    self.ollama_pool.post_stream(self._client(), "/api/chat", payload, chunks)
+                result = await asyncio.wait_for(post, ticket.remaining())
+            result["queue_wait"] = ticket.wait_time
+            result["generation"] = self._generation_metrics(
+                profile_name, payload, result)
+            return result
 
-        except httpx.RequestError as e:
+        except asyncio.TimeoutError as e:
+            logger.warning(f"Ollama請求逾時: {str(e)}")
+            raise HTTPException(status_code=504, detail="AI服務忙碌中，請稍後再試")
+        except (httpx.RequestError, NoHealthyEndpoint) as e:
             logger.error(f"Ollama服務連線錯誤: {str(e)}")
             raise HTTPException(status_code=503, detail="AI服務暫時無法連線")
         except Exception as e:
             logger.error(f"查詢Ollama時發生錯誤: {str(e)}")
             raise HTTPException(status_code=500, detail=str(e))
 
-    async def process_query(self, request: ChatRequest) -> ChatResponse:
-        start_time = datetime.now()
+    def _session_metrics(self, session: ConversationSession, history_sent: int,
+                         prompt: str, generation: Dict) -> Dict:
+        """
+        計算本回合節省的預填 token 數
+
+        完整重送歷史需預填「系統提示＋所有歷史回合＋本回合提示」；完整量與實際送出量皆以相同的字元估計
+        計算，避免與 Ollama 回報的 prompt_eval_count（真實分詞且受前綴快取影響）相減而失真，
+        回報值另列於 prefill_tokens_reported 供參考
+        """
+        full_tokens = estimate_tokens(self.system_prompt) + \
+            session.history_tokens + estimate_tokens(prompt)
+        evaluated = generation.get("estimated_prompt_tokens", full_tokens)
+        saved = max(0, full_tokens - evaluated)
+        self.sessions.stats["prefill_tokens_saved"] += saved
+        return {
+            "session_id": session.session_id,
+            "turn": session.total_turns + 1,
+            "history_messages_sent": history_sent,
+            "prefill_tokens_full": full_tokens,
+            "prefill_tokens_evaluated": evaluated,
+            "prefill_tokens_reported": generation.get("prompt_tokens"),
+            "prefill_tokens_saved": saved
+        }
+
+    async def _summarize_session(self, session: ConversationSession,
+                                 previous_summary: str,
+                                 old_turns: List[Dict[str, str]]):
+        """以低優先等級請模型將舊回合濃縮為摘要，取代擷取式摘要"""
+        if session.summarizing:
+            return
+        session.summarizing = True
+        expected_summary = session.summary
         try:
-            # 1. 先嘗試RAG檢索
-            rag_results = self.retriever.retrieve(request.message)
+            transcript = "\n".join(
+                f"使用者：{t['user']}\n助理：{t['assistant']}" for t in old_turns)
+            payload = get_profile(DEFAULT_PROFILE).apply({
+                "model": self.model_name,
+                "messages": [
+                    {"role": "system", "content": "請以繁體中文將對話濃縮為150字以內的重點摘要。"},
+                    {"role": "user", "content": f"{previous_summary}\n{transcript}"}
+                ],
+                "stream": False
+            })
+            async with self.scheduler.acquire(Priority.PREWARM, self.request_timeout) as ticket:
+                result = await asyncio.wait_for(
+                    self._post_ollama(payload), ticket.remaining())
+            # 摘要期間若又發生壓縮，保留較新的擷取式摘要
+            if session.summary == expected_summary:
+                session.summary = result["message"]["content"][:self.sessions.max_summary_chars]
+                self.sessions.sessions.touch(session.session_id)
+        except Exception as e:
+            logger.warning(f"產生對話摘要失敗，保留擷取式摘要: {str(e)}")
+        finally:
+            session.summarizing = False
+
+    def _finish_session_turn(self, session: ConversationSession,
+                             user_message: str, assistant_message: str):
+        """記錄回合；發生壓縮且啟用模型摘要時於背景產生摘要"""
+        previous_summary = session.summary
+        old_turns = self.sessions.record_turn(session, user_message, assistant_message)
+        if old_turns and self.llm_summary:
+            asyncio.create_task(
+                self._summarize_session(session, previous_summary, old_turns))
+
+    def _degraded_response(self, request: ChatRequest, rag_results: List[Dict],
+                           start_time: datetime, source: str, partial: str,
+                           reason: str, kb_version: Optional[str],
+                           extra_metrics: Optional[Dict] = None) -> ChatResponse:
+        """
+        生成無法在預算內完成時的降級回答
+
+        已串流的文字足夠長時返回部分文字，否則以檢索到的學群整理成結構化回答；
+        兩者皆不可行時維持 504。降級回答不寫入對話工作階段
+        """
+        if len(partial) >= self.min_partial_chars:
+            path = "partial_text"
+            response = ChatResponse(
+                response=f"{partial}\n\n（回答因等待時間過長而中斷）",
+                source=f"{source}-Partial",
+                matched_groups=[r["group_name"] for r in rag_results] if source != "Ollama" else None)
+        elif rag_results:
+            path = "retrieval_only"
+            lines = ["AI服務目前回應較慢，先提供與您問題最相關的學群資料："]
+            lines.extend(f"- {r['group_name']}：{r['introduction'][:120]}" for r in rag_results)
+            response = ChatResponse(
+                response="\n".join(lines),
+                source="RAG-Degraded",
+                matched_groups=[r["group_name"] for r in rag_results])
+        else:
+            self.degradation_stats["unrecoverable"] += 1
+            raise HTTPException(status_code=504, detail="AI服務忙碌中，請稍後再試")
+
+        self.degradation_stats[path] += 1
+        self.degradation_stats[reason] += 1
+        logger.warning(f"請求超過時間預算，降級回答（{path}，原因: {reason}）")
+        response.kb_version = kb_version
+        response.session_id = request.session_id
+        response.metrics = self.metrics_logger.log_metrics(
+            start_time, datetime.now(),
+            len(request.message),
+            len(response.response),
+            {"degraded": {"path": path, "reason": reason,
+                          "budget": self.request_budget,
+                          "partial_chars": len(partial)},
+             **(extra_metrics or {})}
+        )
+        return response
+
+    async def _answer(self, request: ChatRequest, rag_results: List[Dict],
+                      start_time: datetime,
+                      priority: Priority = Priority.INTERACTIVE,
+                      extra_metrics: Optional[Dict] = None,
+                      kb_version: Optional[str] = None) -> ChatResponse:
+        """依檢索結果產生回答並記錄指標；設有請求截止時間時於預算不足或逾時時降級"""
+        session = self.sessions.get(request.session_id) \
+            if request.session_id else None
+        history = session.messages() if session else None
 
-            # 2. 檢查RAG結果是否足夠相關
+        with request_profiler.stage("prompt_build"):
+            # 檢查RAG結果是否足夠相關
             if rag_results and rag_results[0]["similarity_score"] > self.similarity_threshold:
-                # 使用RAG結果生成上下文
+                # 依問題判斷模板類型，並使用RAG結果生成上下文
+                prompt_type, _ = PromptTemplate.detect_prompt_type(request.message)
                 context = PromptTemplate.generate_prompt(
                     request.message,
-                    "\n\n".join([f"【{r['group_name']}】\n{r['introduction']}\n{r['learning_content']}"
-                                for r in rag_results])
+                    "\n\n".join(r["snippet"] for r in rag_results),
+                    prompt_type
                 )
+                source = "RAG+Ollama"
+                matched_groups = [r["group_name"] for r in rag_results]
+            else:
+                # 如果RAG結果不夠相關，直接使用Ollama
+                context = None
+                prompt_type = DEFAULT_PROFILE
+                source = "Ollama"
+                matched_groups = None
+            recommendations = self._recommendation_context(request)
+            if recommendations:
+                profile = GroupRecommender.context_line(recommendations)
+                context = f"{profile}\n\n{context}" if context else profile
 
-                # 使用增強上下文查詢Ollama
-                ollama_response = await self._query_ollama(request, context)
+        # 設有截止時間時改用串流，逾時仍可取得已生成的部分文字
+        left = deadline.remaining()
+        chunks: Optional[List[str]] = None
+        if left is not None:
+            self.degradation_stats["budgeted_requests"] += 1
+            if left < self.min_generation_budget:
+                return self._degraded_response(
+                    request, rag_results, start_time, source, "",
+                    "budget_exhausted", kb_version, extra_metrics)
+            chunks = []
+        try:
+            with request_profiler.stage("generation"):
+                ollama_response = await self._query_ollama(
+                    request, context, priority=priority,
+                    profile_name=prompt_type, history=history, chunks=chunks)
+        except HTTPException as e:
+            if chunks is None or e.status_code != 504:
+                raise
+            return self._degraded_response(
+                request, rag_results, start_time, source, "".join(chunks),
+                "generation_timeout", kb_version, extra_metrics)
 
-                response = ChatResponse(
-                    response=ollama_response['message']['content'],
-                    source="RAG+Ollama",
-                    matched_groups=[r["group_name"] for r in rag_results]
-                )
-            else:
-                # 3. 如果RAG結果不夠相關，直接使用Ollama
-                ollama_response = await self._query_ollama(request)
-                response = ChatResponse(
-                    response=ollama_response['message']['content'],
-                    source="Ollama",
-                    matched_groups=None
-                )
+        response = ChatResponse(
+            response=ollama_response['message']['content'],
+            source=source,
+            matched_groups=matched_groups
+        )
+        response.kb_version = kb_version
+
+        # 更新對話工作階段
+        additional_metrics = {
+            "queue_wait": ollama_response.get("queue_wait"),
+            "generation": ollama_response.get("generation"),
+            **(extra_metrics or {})
+        }
+        if recommendations:
+            additional_metrics["recommended_groups"] = [
+                r["group_name"] for r in recommendations]
+        if session is not None:
+            additional_metrics["session"] = self._session_metrics(
+                session, len(history), context or request.message,
+                ollama_response["generation"])
+            self._finish_session_turn(session, request.message, response.response)
+            response.session_id = session.session_id
+
+        # 記錄指標
+        end_time = datetime.now()
+        response.metrics = self.metrics_logger.log_metrics(
+            start_time, end_time,
+            len(request.message),
+            len(response.response),
+            additional_metrics
+        )
+        return response
+
+    async def process_query(self, request: ChatRequest) -> ChatResponse:
+        start_time = datetime.now()
+        # 固定本次請求使用的檢索器，知識庫熱更新不影響進行中的請求
+        retriever = self.retriever
+        try:
+            # 整個請求共用一個時間預算，各階段（含執行緒中的檢索）皆可查詢剩餘時間
+            with deadline.request_deadline(self.request_budget):
+                # 0. 明確對應到標準問題時直接返回預先產生的回答（不需編碼與生成）
+                with request_profiler.stage("precomputed_lookup"):
+                    precomputed = await self._precomputed_answer(request, start_time, retriever)
+                if precomputed is not None:
+                    return precomputed
 
-            # 4. 記錄指標
-            end_time = datetime.now()
-            metrics = self.metrics_logger.log_metrics(
-                start_time, end_time,
-                len(request.message),
-                len(response.response)
-            )
-            response.metrics = metrics
+                # 1. 先嘗試RAG檢索
+                # 編碼為 CPU 密集或阻塞式 IPC，移至執行緒避免阻塞事件迴圈
+                with request_profiler.stage("retrieval"):
+                    rag_results = await asyncio.to_thread(
+                        request_profiler.threaded(retriever.retrieve), request.message)
 
-            return response
+                # 2. 依檢索結果產生回答（RAG+Ollama 或直接 Ollama）並記錄指標
+                return await self._answer(request, rag_results, start_time,
+                                          kb_version=retriever.kb_version)
 
+        except HTTPException:
+            raise
         except Exception as e:
             logger.error(f"處理查詢時發生錯誤: {str(e)}")
             raise HTTPException(status_code=500, detail=str(e))
+
+    async def process_batch(self, requests: List[ChatRequest]) -> AsyncIterator[Dict]:
+        """
+        批次處理多個問題：一次批次檢索，再以有限並行度產生回答，每完成一題即產出結果
+
+        參數:
+            requests: 聊天請求列表
+
+        返回:
+            非同步產生器，依完成順序產出 {"index", "message", "result" 或 "error"}
+        """
+        start_time = datetime.now()
+        retriever = self.retriever
+        rag_batches = await asyncio.to_thread(
+            retriever.retrieve_batch, [r.message for r in requests])
+        retrieval_time = (datetime.now() - start_time).total_seconds()
+        semaphore = asyncio.Semaphore(self.batch_concurrency)
+
+        async def run(index: int, request: ChatRequest, rag_results: List[Dict]) -> Dict:
+            batch_metrics = {"batch": {"index": index, "size": len(requests),
+                                       "retrieval_time": retrieval_time}}
+            async with semaphore:
+                try:
+                    response = await self._answer(
+                        request, rag_results, start_time, Priority.BATCH, batch_metrics,
+                        retriever.kb_version)
+                    return {"index": index, "message": request.message,
+                            "result": response.dict()}
+                except HTTPException as e:
+                    return {"index": index, "message": request.message,
+                            "error": e.detail, "status_code": e.status_code}
+                except Exception as e:
+                    logger.error(f"批次第 {index} 題處理失敗: {str(e)}")
+                    return {"index": index, "message": request.message,
+                            "error": str(e), "status_code": 500}
+
+        tasks = [asyncio.create_task(run(i, r, rag))
+                 for i, (r, rag) in enumerate(zip(requests, rag_batches))]
+        try:
+            for finished in asyncio.as_completed(tasks):
+                yield await finished
+        finally:
+            # 用戶端中途斷線時取消尚未完成的題目
+            for task in tasks:
+                task.cancel()
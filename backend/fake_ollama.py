@@ -0,0 +1,154 @@
+"""
+本機假 Ollama 伺服器
+提供 /api/tags、/api/chat、/api/generate 的最小實作，可設定延遲與失敗模式，
+用於在沒有 GPU 與模型的環境下驗證多端點負載平衡、排程與重試行為
+
+使用方式:
+    python fake_ollama.py --port 11501 --models llama3 --delay 0.5
+    EDURAIL_OLLAMA_ENDPOINTS="http://127.0.0.1:11501;http://127.0.0.1:11502" python main.py
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional, Sequence
+
+
+class FakeOllamaServer:
+    """假 Ollama 伺服器類別"""
+
+    def __init__(self, port: int = 0, models: Sequence[str] = ("llama3",),
+                 delay: float = 0.0, fail: bool = False, host: str = "127.0.0.1"):
+        """
+        初始化假伺服器
+
+        參數:
+            port: 監聽埠號（0 表示自動分配）
+            models: 回報的已安裝模型
+            delay: 每次生成的模擬延遲秒數
+            fail: 是否對生成請求回應 500
+            host: 監聽位址
+        """
+        self.models = list(models)
+        self.delay = delay
+        self.fail = fail
+        self.requests = 0
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, status: int, body: dict):
+                data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                if self.path == "/api/tags":
+                    self._send(200, {"models": [{"name": f"{m}:latest"} for m in server.models]})
+                else:
+                    self._send(404, {"error": "not found"})
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                payload = json.loads(self.rfile.read(length) or b"{}")
+                server.requests += 1
+                if server.fail:
+                    self._send(500, {"error": "fake failure"})
+                    return
+                if self.path == "/api/chat" and payload.get("stream"):
+                    self._stream_chat(payload)
+                    return
+                time.sleep(server.delay)
+                prompt = ""
+                if self.path == "/api/chat":
+                    messages = payload.get("messages", [])
+                    prompt = messages[-1]["content"] if messages else ""
+                    body = {"message": {"role": "assistant",
+                                        "content": f"[{server.url}] {prompt[:50]}"}}
+                elif self.path == "/api/generate":
+                    prompt = payload.get("prompt", "")
+                    body = {"response": f"[{server.url}] {prompt[:50]}"}
+                else:
+                    self._send(404, {"error": "not found"})
+                    return
+                body.update({
+                    "model": payload.get("model"),
+                    "done": True,
+                    "prompt_eval_count": len(prompt),
+                    "eval_count": 16,
+                    "total_duration": int(server.delay * 1e9),
+                    "load_duration": 0
+                })
+                self._send(200, body)
+
+            def _stream_chat(self, payload: dict):
+                """以 NDJSON 逐段回應，延遲平均分配在各片段之間"""
+                messages = payload.get("messages", [])
+                prompt = messages[-1]["content"] if messages else ""
+                content = f"[{server.url}] {prompt[:50]}"
+                pieces = [content[i:i + 8] for i in range(0, len(content), 8)] or [""]
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.end_headers()
+                try:
+                    for piece in pieces:
+                        time.sleep(server.delay / len(pieces))
+                        self.wfile.write(json.dumps(
+                            {"message": {"role": "assistant", "content": piece}, "done": False},
+                            ensure_ascii=False).encode('utf-8') + b"\n")
+                        self.wfile.flush()
+                    self.wfile.write(json.dumps({
+                        "model": payload.get("model"),
+                        "message": {"role": "assistant", "content": ""},
+                        "done": True,
+                        "prompt_eval_count": len(prompt),
+                        "eval_count": len(pieces),
+                        "total_duration": int(server.delay * 1e9),
+                        "load_duration": 0
+                    }).encode('utf-8') + b"\n")
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # 用戶端已放棄（例如截止時間已到）
+
+        return Handler
+
+    def start(self) -> "FakeOllamaServer":
+        """於背景執行緒啟動伺服器"""
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """停止伺服器"""
+        self._server.shutdown()
+        self._server.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="本機假 Ollama 伺服器")
+    parser.add_argument("--port", type=int, default=11501)
+    parser.add_argument("--models", default="llama3")
+    parser.add_argument("--delay", type=float, default=0.0)
+    parser.add_argument("--fail", action="store_true")
+    args = parser.parse_args()
+
+    fake = FakeOllamaServer(args.port, args.models.split(","), args.delay, args.fail)
+    print(f"假 Ollama 伺服器啟動於 {fake.url}")
+    try:
+        fake._server.serve_forever()
+    except KeyboardInterrupt:
+        fake.stop()
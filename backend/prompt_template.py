@@ -3,7 +3,7 @@
 處理不同類型問題的提示詞生成與管理
 """
 import logging
-from typing import Dict, Optional, List
+from typing import Dict, Optional, List, Tuple
 from pathlib import Path
 import json
 
@@ -145,6 +145,37 @@ class PromptTemplate:
         """
     }
 
+    # 各模板類型的判斷關鍵字
+    KEYWORDS = {
+        "學群介紹": ["介紹", "是什麼", "什麼是", "特色", "簡介", "適合", "特質"],
+        "學習內容": ["學什麼", "學習內容", "課程", "科目", "必修", "選修", "能力"],
+        "職涯發展": ["職涯", "工作", "出路", "職業", "薪水", "薪資", "就業前景"],
+        "跨領域發展": ["跨領域", "跨域", "雙主修", "輔系", "整合"],
+        "升學規劃": ["升學", "申請", "推甄", "學測", "分科", "考試", "科系", "備審"],
+        "實習就業": ["實習", "求職", "面試", "履歷", "找工作"]
+    }
+
+    @staticmethod
+    def detect_prompt_type(query: str) -> Tuple[str, float]:
+        """
+        依關鍵字判斷問題所屬的模板類型
+
+        參數:
+            query: 使用者問題
+
+        返回:
+            (模板類型, 信心分數 0~1)；無關鍵字命中時返回預設類型與 0
+        """
+        scores = {
+            prompt_type: sum(1 for keyword in keywords if keyword in query)
+            for prompt_type, keywords in PromptTemplate.KEYWORDS.items()
+        }
+        total = sum(scores.values())
+        if total == 0:
+            return "學群介紹", 0.0
+        best = max(scores, key=scores.get)
+        return best, scores[best] / total
+
     @staticmethod
     def generate_prompt(
         query: str,
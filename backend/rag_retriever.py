@@ -3,12 +3,15 @@
 RAG檢索器
 負責從文檔集合中檢索相關內容
 """
-from sklearn.metrics.pairwise import cosine_similarity
-import pandas as pd
 import numpy as np
-from typing import List, Dict
+from typing import List, Dict, Optional, Sequence, Tuple
 import logging
+import re
 import bert_encoder
+from index_store import EmbeddingIndexStore
+from doc_store import Document, DocumentStore
+from kb_store import KnowledgeBase, current_version, read_csv_columns, write_knowledge_base
+from cache_utils import LRUCache
 
 # 配置RAG檢索器專用日誌
 logger = logging.getLogger(__name__)
@@ -22,41 +25,204 @@ logger.addHandler(retriever_handler)
 class RAGRetriever:
     """RAG檢索系統類別"""
 
-    def __init__(self, csv_path: str, encoder: bert_encoder):
+    def __init__(self, csv_path: str, encoder: bert_encoder,
+                 index_dir: Optional[str] = None,
+                 cache_size: int = 2048,
+                 search_cache_size: int = 2048,
+                 kb_dir: Optional[str] = None,
+                 reranker=None):
         """
         初始化RAG檢索器
 
         參數:
-            csv_path: 學群資料CSV檔案路徑
+            csv_path: 學群資料CSV檔案路徑（知識庫尚未建立時作為匯入來源）
             encoder: BERT編碼器實例
+            index_dir: 向量索引目錄（可選），提供時會重用已建立的 mmap 索引
+            cache_size: 檢索結果快取的最大筆數
+            search_cache_size: 純檢索接口結果快取的最大筆數
+            kb_dir: 欄式知識庫目錄（可選），提供時以記憶體映射載入
+            reranker: 交叉編碼器重排序器（可選），雙編碼器排名難以判斷時重新排序
         """
         logger.info(f"初始化RAG檢索器，使用資料檔案: {csv_path}")
         try:
-            self.df = pd.read_csv(csv_path)
-            logger.info(f"成功載入 {len(self.df)} 筆學群資料")
+            self.kb = self._load_knowledge_base(csv_path, kb_dir)
+            self.kb_version = self.kb.version
+            logger.info(f"成功載入 {len(self.kb)} 筆學群資料（知識庫版本 {self.kb_version}）")
+            # 查詢時只存取精簡的文件紀錄；其餘欄位僅 /api/retrieve 需要時才由知識庫讀取
+            self.docs = DocumentStore.from_columns(self.kb.columns)
             self.encoder = encoder
+            self.reranker = reranker
             self.encoded_texts = None
+            # 以正規化查詢與 top_k 為鍵快取排名結果，重複查詢不需重新編碼
+            self.result_cache = LRUCache(max_entries=cache_size)
+            # 純檢索接口另用一份快取，大量 /api/retrieve 查詢不會逐出對話路徑的熱門結果
+            self.search_cache = LRUCache(max_entries=search_cache_size)
+            self.index_store = EmbeddingIndexStore(
+                index_dir) if index_dir else None
             self._prepare_embeddings()
         except Exception as e:
             logger.error(f"初始化RAG檢索器時發生錯誤: {str(e)}")
             raise
 
+    @staticmethod
+    def _load_knowledge_base(csv_path: str, kb_dir: Optional[str]) -> KnowledgeBase:
+        """載入知識庫；目錄中尚無版本時由 CSV 匯入"""
+        if kb_dir is None:
+            return KnowledgeBase.from_csv(csv_path)
+        if current_version(kb_dir) is None:
+            logger.info(f"知識庫 {kb_dir} 尚未建立，由 {csv_path} 匯入")
+            write_knowledge_base(kb_dir, read_csv_columns(csv_path), source=str(csv_path))
+        return KnowledgeBase.open(kb_dir)
+
+    @staticmethod
+    def document_texts(columns: Dict[str, Sequence[str]]) -> List[str]:
+        """合併相關欄位作為文檔內容（編碼用）"""
+        return [f"{name} {intro} {learning}" for name, intro, learning in zip(
+            columns["group_name"], columns["introduction"], columns["learning_content"])]
+
     def _prepare_embeddings(self):
         """準備文檔的向量表示"""
         logger.info("開始準備文檔向量")
         try:
-            # 合併相關欄位作為文檔內容
-            texts = [f"{row['group_name']} {row['introduction']} {row['learning_content']}"
-                     for _, row in self.df.iterrows()]
+            texts = self.document_texts(self.kb.columns)
+            # 語料內容版本（與編碼模型無關），供預先產生的回答等衍生資料比對是否過期
+            self.corpus_version = EmbeddingIndexStore.corpus_hash(texts, "corpus")[:16]
+            model_name = getattr(
+                self.encoder, "model_name", type(self.encoder).__name__)
+
+            # 知識庫已附上同一模型的向量時直接使用（記憶體映射）
+            stored = self.kb.embeddings_for(model_name)
+            if stored is not None and stored.shape[0] == len(texts):
+                self.encoded_texts = stored
+                logger.info("使用知識庫內的文件向量，略過文檔編碼")
+                return
+
+            index_key = None
+            if self.index_store is not None:
+                index_key = EmbeddingIndexStore.corpus_hash(texts, model_name)
+                cached = self.index_store.load(index_key)
+                if cached is not None and cached.shape[0] == len(texts):
+                    self.encoded_texts = cached
+                    logger.info("使用既有的向量索引，略過文檔編碼")
+                    return
 
             logger.info(f"開始編碼 {len(texts)} 個文檔")
-            self.encoded_texts = self.encoder.encode(texts)
+            self.encoded_texts = self._normalize(self.encoder.encode(texts))
+
+            if self.index_store is not None:
+                path = self.index_store.save(index_key, self.encoded_texts)
+                # 改以 mmap 載入，讓多個工作程序共用同一份頁面快取
+                self.encoded_texts = np.load(path, mmap_mode='r')
             logger.info("文檔向量準備完成")
 
         except Exception as e:
             logger.error(f"準備文檔向量時發生錯誤: {str(e)}")
             raise
 
+    @staticmethod
+    def _normalize(embeddings: np.ndarray) -> np.ndarray:
+        """將向量正規化為單位長度，使內積即為餘弦相似度"""
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        if embeddings.ndim == 1:
+            embeddings = embeddings.reshape(1, -1)
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return embeddings / norms
+
+    @staticmethod
+    def normalize_query(query: str) -> str:
+        """正規化查詢文字作為快取鍵（去除首尾空白、合併連續空白、英文轉小寫）"""
+        return " ".join(query.split()).lower()
+
+    @staticmethod
+    def _top_indices(similarities: np.ndarray, top_k: int) -> np.ndarray:
+        """依相似度由高到低返回前 top_k 個文檔索引"""
+        top_k = min(top_k, similarities.shape[-1])
+        return np.argsort(similarities)[-top_k:][::-1]
+
+    def rank(self, queries: List[str], top_k: int = 3,
+             cache: Optional[LRUCache] = None) -> List[List[Tuple[int, float]]]:
+        """
+        計算每個查詢最相關的文檔索引與相似度
+
+        命中結果快取的查詢不需重新編碼；其餘查詢一次批次編碼，並以單次矩陣乘法計算相似度。
+        設定重排序器時先取出較多候選，前幾名分數差距過小才以交叉編碼器重新排序
+
+        參數:
+            queries: 查詢文本列表
+            top_k: 每個查詢返回的文檔數量
+            cache: 使用的結果快取（預設為對話路徑的 result_cache）
+
+        返回:
+            與 queries 對應的 [(文檔索引, 相似度), ...] 列表
+        """
+        if cache is None:
+            cache = self.result_cache
+        keys = [(self.normalize_query(q), top_k) for q in queries]
+        ranked: List[Optional[List[Tuple[int, float]]]] = [
+            cache.get(key) for key in keys]
+        missing = [i for i, r in enumerate(ranked) if r is None]
+        if missing:
+            query_embeddings = self._normalize(
+                self.encoder.encode([queries[i] for i in missing]))
+            # (查詢數, 維度) x (維度, 文檔數) -> (查詢數, 文檔數)
+            similarities = query_embeddings @ np.asarray(self.encoded_texts).T
+            candidates = max(top_k, self.reranker.candidates) if self.reranker else top_k
+            for row, i in zip(similarities, missing):
+                logger.debug(
+                    f"計算得到的相似度範圍: {row.min():.4f} - {row.max():.4f}")
+                hits = [(int(idx), float(row[idx]))
+                        for idx in self._top_indices(row, candidates)]
+                final = True
+                if self.reranker is not None:
+                    hits, final = self.reranker.rerank(
+                        self.kb_version, keys[i][0], hits,
+                        [self.docs[idx].snippet for idx, _ in hits], top_k)
+                ranked[i] = hits[:top_k]
+                # 因預算用盡而略過重排序的結果不快取，之後的請求仍可重新排序
+                if final:
+                    cache.put(keys[i], ranked[i])
+        return ranked
+
+    def _collect(self, hits: List[Tuple[int, float]]) -> List[Dict]:
+        """依文檔索引與相似度整理檢索結果"""
+        results = self.docs.hits(hits)
+        if logger.isEnabledFor(logging.DEBUG):
+            for r in results:
+                logger.debug(f"找到相關學群: {r['group_name']}, 相似度: {r['similarity_score']:.4f}")
+        return results
+
+    def group_names(self) -> List[str]:
+        """所有學群名稱"""
+        return self.docs.names()
+
+    def retrieve_group(self, group_name: str) -> List[Dict]:
+        """依學群名稱直接取得該學群資料（相似度記為 1.0）"""
+        doc = self.docs.find(group_name)
+        return [doc.hit(1.0)] if doc is not None else []
+
+    def retrieve_batch(self, queries: List[str], top_k: int = 3) -> List[List[Dict]]:
+        """
+        批次檢索：一次編碼所有查詢，並以單次矩陣乘法計算所有查詢對所有文檔的相似度
+
+        參數:
+            queries: 查詢文本列表
+            top_k: 每個查詢返回最相關的文檔數量
+
+        返回:
+            與 queries 對應的檢索結果列表
+        """
+        logger.info(f"開始批次處理 {len(queries)} 個查詢")
+        if not queries:
+            return []
+        try:
+            results = [self._collect(hits) for hits in self.rank(list(queries), top_k)]
+            logger.info(f"批次檢索完成，共 {len(results)} 個查詢")
+            return results
+        except Exception as e:
+            logger.error(f"批次檢索過程中發生錯誤: {str(e)}")
+            raise
+
     def retrieve(self, query: str, top_k: int = 3) -> List[Dict]:
         """
         檢索相關文檔
@@ -70,34 +236,90 @@ class RAGRetriever:
         """
         logger.info(f"開始處理查詢: {query}")
         try:
-            # 對查詢文本進行編碼
-            query_embedding = self.encoder.encode([query])
-
-            # 計算相似度
-            similarities = cosine_similarity(
-                query_embedding, self.encoded_texts)[0]
-            logger.debug(
-                f"計算得到的相似度範圍: {similarities.min():.4f} - {similarities.max():.4f}")
-
-            # 獲取最相關的文檔
-            top_indices = np.argsort(similarities)[-top_k:][::-1]
-            results = []
-
-            for idx in top_indices:
-                row = self.df.iloc[idx]
-                result = {
-                    "group_name": row["group_name"],
-                    "introduction": row["introduction"],
-                    "learning_content": row["learning_content"],
-                    "similarity_score": float(similarities[idx])
-                }
-                results.append(result)
-                logger.debug(
-                    f"找到相關學群: {row['group_name']}, 相似度: {similarities[idx]:.4f}")
-
+            # 對查詢文本進行編碼並計算相似度（文檔向量已正規化，內積即為餘弦相似度）
+            results = self._collect(self.rank([query], top_k)[0])
             logger.info(f"成功檢索到 {len(results)} 個相關文檔")
             return results
 
         except Exception as e:
             logger.error(f"檢索過程中發生錯誤: {str(e)}")
             raise
+
+    @staticmethod
+    def _query_terms(query: str) -> List[str]:
+        """擷取查詢中的關鍵片段：中文取相鄰雙字，英數取完整單字"""
+        terms = []
+        for token in re.findall(r'[\u4e00-\u9fff]+|[A-Za-z0-9]+', query):
+            if re.match(r'[\u4e00-\u9fff]', token):
+                terms.extend(token[i:i + 2] for i in range(max(1, len(token) - 1)))
+            elif len(token) > 1:
+                terms.append(token.lower())
+        return list(dict.fromkeys(terms))
+
+    @classmethod
+    def highlight(cls, query: str, text: str, max_passages: int = 2) -> List[Dict]:
+        """
+        找出文本中與查詢重疊最多的段落
+
+        參數:
+            query: 查詢文本
+            text: 欄位內容
+            max_passages: 最多返回的段落數
+
+        返回:
+            [{"passage": 段落, "terms": 命中的查詢片段}, ...]
+        """
+        terms = cls._query_terms(query)
+        if not terms or not isinstance(text, str):
+            return []
+        scored = []
+        for passage in re.split(r'[。！？!?\n]+', text):
+            passage = passage.strip()
+            if not passage:
+                continue
+            lowered = passage.lower()
+            matched = [t for t in terms if t in lowered]
+            if matched:
+                scored.append((len(matched), passage, matched))
+        scored.sort(key=lambda item: item[0], reverse=True)
+        return [{"passage": p, "terms": m} for _, p, m in scored[:max_passages]]
+
+    def search(self, queries: List[str], top_k: int = 3,
+               min_score: Optional[float] = None,
+               fields: Optional[List[str]] = None,
+               highlight: bool = True) -> List[List[Dict]]:
+        """
+        純檢索查詢（不呼叫語言模型），供 /api/retrieve 使用
+
+        參數:
+            queries: 查詢文本列表
+            top_k: 每個查詢返回的文檔數量
+            min_score: 相似度下限（低於者不返回）
+            fields: 要返回的欄位（預設 introduction）
+            highlight: 是否返回與查詢相關的段落
+
+        返回:
+            與 queries 對應的 [{"rank", "group_name", "score", 欄位..., "highlights"}, ...]
+        """
+        fields = [f for f in (fields or ["introduction"])
+                  if f in self.kb.columns and f != "group_name"]
+        results = []
+        for query, hits in zip(queries, self.rank(list(queries), top_k, self.search_cache)):
+            groups = []
+            for rank, (idx, score) in enumerate(hits, 1):
+                if min_score is not None and score < min_score:
+                    continue
+                doc = self.docs[idx]
+                group = {"rank": rank, "group_name": doc.group_name, "score": score}
+                for field in fields:
+                    value = getattr(doc, field) if field in Document.__slots__ \
+                        else self.kb.column(field)[idx]
+                    group[field] = value or None
+                if highlight:
+                    group["highlights"] = [
+                        {"field": field, **h}
+                        for field in fields
+                        for h in self.highlight(query, group[field] or "")]
+                groups.append(group)
+            results.append(groups)
+        return results
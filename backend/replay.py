@@ -0,0 +1,375 @@
+"""
+流量重播
+讀取查詢紀錄（舊版代理的 retrieval_log.jsonl、conversation_log.jsonl 與目前的 logs/query_log.jsonl），
+依原始的到達間隔（可縮放）對執行中的伺服器重新送出查詢（開放迴路：依排程送出，不等待前一個請求完成），
+回報各接口的延遲分佈、錯誤、回答來源與送出延誤，以及重播期間伺服器端各快取的命中率
+（由重播前後的 /api/metrics 差值計算，需以 --admin-token 或 EDURAIL_ADMIN_TOKEN 提供管理權杖），用於在實際重複性的查詢組成下評估快取與容量
+
+紀錄格式（每行一筆 JSON，依 timestamp 排序後重播）:
+    retrieval_log.jsonl     {"timestamp", "query", "results"}               → /api/retrieve
+    conversation_log.jsonl  {"timestamp", "user_message", "ai_response"}    → /api/chat
+    query_log.jsonl         {"timestamp", "endpoint", "message" | "messages" | "queries", ...}
+
+使用方式:
+    python replay.py logs/query_log.jsonl --url http://localhost:8000
+    python replay.py retrieval_log.jsonl conversation_log.jsonl --speed 10 --max-gap 5
+    python replay.py logs/query_log.jsonl --speed 0 --max-in-flight 16   # 不等待，盡快送出
+    python replay.py logs/query_log.jsonl --dry-run                      # 只分析查詢組成
+    python replay.py logs/query_log.jsonl* --since 2024-05-01T08:00     # 含輪替後的舊檔
+
+查詢紀錄預設關閉，需以 EDURAIL_QUERY_LOG_ENABLED=1 啟動伺服器；只記錄通過准入的請求，
+時間為取得處理名額的時間
+
+注意: 伺服器的用戶端限速會使重播的請求收到 429，評估容量時可將 EDURAIL_RATE_LIMIT_* 設為 0；
+多工作程序時 /api/metrics 只反映回應該請求的工作程序
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import secrets
+import time
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+import httpx
+import numpy as np
+
+# 確保日誌目錄存在
+log_dir = Path("logs")
+log_dir.mkdir(exist_ok=True)
+
+# 配置流量重播專用日誌
+logger = logging.getLogger(__name__)
+replay_handler = logging.FileHandler(
+    log_dir / "replay.log", encoding='utf-8')
+replay_handler.setFormatter(logging.Formatter(
+    '%(asctime)s - %(levelname)s - %(message)s'))
+logger.addHandler(replay_handler)
+
+ENDPOINT_PATHS = {"chat": "/api/chat", "chat/batch": "/api/chat/batch",
+                  "retrieve": "/api/retrieve"}
+# 快取命中率：(區段, 命中計數, 分母計數)
+CACHE_COUNTERS = [
+    ("retrieval_cache", "hits", ("hits", "misses")),
+    ("search_cache", "hits", ("hits", "misses")),
+    ("rerank", "cache_hits", ("queries",)),
+    ("precomputed_answers", "hits", ("hits", "misses")),
+]
+
+
+@dataclass
+class ReplayEvent:
+    """一筆待重播的請求"""
+    timestamp: datetime
+    endpoint: str
+    payload: Dict
+    source: str
+
+    @property
+    def texts(self) -> List[str]:
+        """請求中的查詢文字（用於分析查詢組成）"""
+        payload = self.payload
+        return payload.get("queries") or payload.get("messages") or \
+            [payload.get("message") or payload.get("query") or ""]
+
+
+def parse_record(record: Dict, source: str) -> Optional[ReplayEvent]:
+    """
+    將一筆紀錄轉為重播請求（無法辨識的紀錄返回 None）
+
+    參數:
+        record: 紀錄內容
+        source: 紀錄檔名
+    """
+    try:
+        timestamp = datetime.fromisoformat(record["timestamp"])
+    except (KeyError, TypeError, ValueError):
+        return None
+    endpoint = record.get("endpoint")
+    if endpoint == "chat" and record.get("message"):
+        payload = {"message": record["message"]}
+        for key in ("session_id", "user_sn"):
+            if record.get(key):
+                payload[key] = record[key]
+    elif endpoint == "chat/batch" and record.get("messages"):
+        payload = {"messages": record["messages"]}
+    elif endpoint == "retrieve" and record.get("queries"):
+        payload = {"queries": record["queries"], "top_k": record.get("top_k", 3)}
+    elif endpoint is None and record.get("user_message"):
+        # 舊版 OllamaAgent 的對話紀錄
+        endpoint, payload = "chat", {"message": record["user_message"]}
+    elif endpoint is None and record.get("query"):
+        # 舊版 BERTAgent 的檢索紀錄
+        endpoint, payload = "retrieve", {"query": record["query"]}
+    else:
+        return None
+    return ReplayEvent(timestamp, endpoint, payload, source)
+
+
+def load_events(paths: Sequence[str], endpoints: Optional[Sequence[str]] = None,
+                since: Optional[datetime] = None, limit: Optional[int] = None) -> List[ReplayEvent]:
+    """
+    讀取多個紀錄檔並依時間排序
+
+    參數:
+        paths: 紀錄檔路徑
+        endpoints: 只重播這些接口（None 表示全部）
+        since: 只重播此時間之後的紀錄
+        limit: 最多重播的筆數（取最早的）
+    """
+    events, skipped = [], 0
+    for path in paths:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    event = parse_record(json.loads(line), Path(path).name)
+                except ValueError:
+                    event = None
+                if event is None or (endpoints and event.endpoint not in endpoints) or \
+                        (since and event.timestamp < since):
+                    skipped += int(event is None)
+                    continue
+                events.append(event)
+    if skipped:
+        logger.warning(f"略過 {skipped} 筆無法辨識的紀錄")
+    events.sort(key=lambda e: e.timestamp)
+    return events[:limit] if limit else events
+
+
+def schedule(events: Sequence[ReplayEvent], speed: float = 1.0,
+             max_gap: Optional[float] = None) -> List[float]:
+    """
+    每筆請求相對於重播開始的送出時間（秒）
+
+    參數:
+        events: 依時間排序的請求
+        speed: 加速倍數（2 表示間隔縮為一半；0 表示不等待）
+        max_gap: 原始間隔上限秒數（壓縮夜間等長時間的空檔），於縮放前套用
+    """
+    offsets, elapsed = [], 0.0
+    previous = None
+    for event in events:
+        if previous is not None and speed > 0:
+            gap = (event.timestamp - previous).total_seconds()
+            if max_gap is not None:
+                gap = min(gap, max_gap)
+            elapsed += max(0.0, gap) / speed
+        offsets.append(elapsed)
+        previous = event.timestamp
+    return offsets
+
+
+def query_mix(events: Sequence[ReplayEvent], top: int = 10) -> Dict:
+    """查詢組成：重複比例與最常見的查詢"""
+    counts = Counter(text.strip() for event in events for text in event.texts)
+    total = sum(counts.values())
+    span = (events[-1].timestamp - events[0].timestamp).total_seconds() if events else 0.0
+    return {
+        "requests": len(events),
+        "queries": total,
+        "distinct_queries": len(counts),
+        # 與先前某次查詢完全相同的比例（伺服器端快取可能命中的上限）
+        "repeat_ratio": round(1 - len(counts) / total, 4) if total else 0.0,
+        "by_endpoint": dict(Counter(event.endpoint for event in events)),
+        "original_span_seconds": round(span, 3),
+        "top_queries": [{"query": q, "count": c} for q, c in counts.most_common(top)]
+    }
+
+
+def distribution(values: Sequence[float]) -> Dict:
+    """延遲分佈（毫秒）"""
+    if not len(values):
+        return {"count": 0}
+    data = np.asarray(values, dtype=np.float64) * 1000
+    p50, p90, p95, p99 = np.percentile(data, [50, 90, 95, 99])
+    return {"count": len(data), "mean_ms": round(float(data.mean()), 2),
+            "p50_ms": round(float(p50), 2), "p90_ms": round(float(p90), 2),
+            "p95_ms": round(float(p95), 2), "p99_ms": round(float(p99), 2),
+            "max_ms": round(float(data.max()), 2)}
+
+
+def cache_deltas(before: Dict, after: Dict) -> Dict:
+    """重播期間各快取的命中率（重播前後計數的差值）"""
+    results = {}
+    for section, hit_key, total_keys in CACHE_COUNTERS:
+        old, new = before.get(section) or {}, after.get(section) or {}
+        if not new:
+            continue
+        hits = new.get(hit_key, 0) - old.get(hit_key, 0)
+        lookups = sum(new.get(k, 0) - old.get(k, 0) for k in total_keys)
+        results[section] = {"hits": hits, "lookups": lookups,
+                            "hit_rate": round(hits / lookups, 4) if lookups else None}
+    degradation_old, degradation_new = before.get("degradation") or {}, after.get("degradation") or {}
+    if degradation_new:
+        results["degradation"] = {k: v - degradation_old.get(k, 0)
+                                  for k, v in degradation_new.items()}
+    rate_old = (before.get("admission") or {}).get("rate_limits", {})
+    rate_new = (after.get("admission") or {}).get("rate_limits", {})
+    if rate_new:
+        results["rate_limited"] = {name: stats.get("rejected", 0) -
+                                   rate_old.get(name, {}).get("rejected", 0)
+                                   for name, stats in rate_new.items()}
+    return results
+
+
+class TrafficReplayer:
+    """流量重播類別"""
+
+    def __init__(self, url: str, timeout: float = 120.0, max_in_flight: int = 256,
+                 admin_token: Optional[str] = None):
+        """
+        初始化重播器
+
+        參數:
+            url: 伺服器位址
+            timeout: 單一請求的逾時秒數
+            max_in_flight: 同時進行的請求上限（達上限時延後送出，並計入送出延誤）
+            admin_token: 管理權杖（讀取 /api/metrics 用），未提供時不回報伺服器端快取指標
+        """
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+        self.max_in_flight = max_in_flight
+        self.admin_token = admin_token
+        # 原始工作階段 ID 對應到本次重播專用的 ID，避免與先前的重播或實際使用者共用狀態
+        self.run_id = secrets.token_hex(4)
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.statuses: Dict[str, Counter] = defaultdict(Counter)
+        self.sources: Counter = Counter()
+        self.send_lag: List[float] = []
+        self.batch_item_errors = 0
+
+    def _payload(self, event: ReplayEvent) -> Dict:
+        payload = dict(event.payload)
+        if payload.get("session_id"):
+            payload["session_id"] = f"replay-{self.run_id}-{payload['session_id']}"
+        return payload
+
+    async def _send(self, client: httpx.AsyncClient, event: ReplayEvent):
+        began = time.perf_counter()
+        try:
+            response = await client.post(ENDPOINT_PATHS[event.endpoint], json=self._payload(event))
+            status = str(response.status_code)
+        except httpx.TimeoutException:
+            response, status = None, "timeout"
+        except httpx.HTTPError as e:
+            response, status = None, f"error:{type(e).__name__}"
+        elapsed = time.perf_counter() - began
+        self.statuses[event.endpoint][status] += 1
+        if response is None or response.status_code != 200:
+            return
+        self.latencies[event.endpoint].append(elapsed)
+        if event.endpoint == "chat":
+            self.sources[response.json().get("source")] += 1
+        elif event.endpoint == "chat/batch":
+            for line in response.text.splitlines():
+                if line.strip() and "error" in json.loads(line):
+                    self.batch_item_errors += 1
+
+    async def _metrics(self, client: httpx.AsyncClient) -> Dict:
+        if not self.admin_token:
+            return {}
+        try:
+            response = await client.get("/api/metrics",
+                                        headers={"X-Admin-Token": self.admin_token})
+            response.raise_for_status()
+            return response.json()
+        except httpx.HTTPError as e:
+            logger.warning(f"無法取得伺服器指標: {str(e)}")
+            return {}
+
+    async def run(self, events: Sequence[ReplayEvent], offsets: Sequence[float]) -> Dict:
+        """
+        依排程送出所有請求並彙整結果
+
+        參數:
+            events: 依時間排序的請求
+            offsets: 每筆請求的送出時間（相對於開始，秒）
+        """
+        limits = httpx.Limits(max_connections=self.max_in_flight,
+                              max_keepalive_connections=self.max_in_flight)
+        async with httpx.AsyncClient(base_url=self.url, timeout=self.timeout,
+                                     limits=limits) as client:
+            before = await self._metrics(client)
+            semaphore = asyncio.Semaphore(self.max_in_flight)
+            tasks = []
+            started = time.perf_counter()
+
+            async def fire(event: ReplayEvent):
+                try:
+                    await self._send(client, event)
+                finally:
+                    semaphore.release()
+
+            for event, offset in zip(events, offsets):
+                delay = started + offset - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                await semaphore.acquire()
+                # 實際送出時間與排程的差距（用戶端或並行上限造成的延誤）
+                self.send_lag.append(max(0.0, time.perf_counter() - started - offset))
+                tasks.append(asyncio.create_task(fire(event)))
+            await asyncio.gather(*tasks)
+            elapsed = time.perf_counter() - started
+            after = await self._metrics(client)
+
+        report = {
+            "run_id": self.run_id,
+            "url": self.url,
+            "elapsed_seconds": round(elapsed, 3),
+            "throughput_rps": round(len(events) / elapsed, 2) if elapsed else None,
+            "endpoints": {endpoint: {"status": dict(self.statuses[endpoint]),
+                                     "latency": distribution(self.latencies[endpoint])}
+                          for endpoint in self.statuses},
+            "chat_sources": dict(self.sources),
+            "send_lag": distribution(self.send_lag),
+            "server": cache_deltas(before, after)
+        }
+        if self.batch_item_errors:
+            report["batch_item_errors"] = self.batch_item_errors
+        logger.info(f"重播 {len(events)} 筆請求完成，耗時 {elapsed:.1f} 秒")
+        return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="依查詢紀錄重播流量")
+    parser.add_argument("logs", nargs="+", help="紀錄檔（JSON Lines）")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="加速倍數（0 表示不等待原始間隔）")
+    parser.add_argument("--max-gap", type=float, default=60.0,
+                        help="原始間隔上限秒數（負值表示不限）")
+    parser.add_argument("--endpoints", default=None,
+                        help="只重播這些接口（以逗號分隔，例如 chat,retrieve）")
+    parser.add_argument("--since", default=None, help="只重播此時間之後的紀錄（ISO 格式）")
+    parser.add_argument("--limit", type=int, default=None)
+    parser.add_argument("--max-in-flight", type=int, default=256)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--dry-run", action="store_true", help="只分析查詢組成，不送出請求")
+    parser.add_argument("--output", default=None, help="將報告寫入 JSON 檔")
+    parser.add_argument("--admin-token", default=os.getenv("EDURAIL_ADMIN_TOKEN"),
+                        help="讀取伺服器指標用的管理權杖（預設取自 EDURAIL_ADMIN_TOKEN）")
+    args = parser.parse_args()
+
+    events = load_events(args.logs, args.endpoints.split(",") if args.endpoints else None,
+                         datetime.fromisoformat(args.since) if args.since else None, args.limit)
+    if not events:
+        raise SystemExit("紀錄檔中沒有可重播的請求")
+    offsets = schedule(events, args.speed, args.max_gap if args.max_gap >= 0 else None)
+    report = {"mix": query_mix(events), "scheduled_seconds": round(offsets[-1], 3)}
+    if not args.dry_run:
+        replayer = TrafficReplayer(args.url, args.timeout, args.max_in_flight,
+                                   args.admin_token)
+        report.update(asyncio.run(replayer.run(events, offsets)))
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output)
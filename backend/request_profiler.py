@@ -0,0 +1,246 @@
+"""
+請求剖析
+對單一請求啟用 cProfile（管理者以標頭指定，或依設定比例抽樣），涵蓋事件迴圈中的處理與
+asyncio.to_thread 中的編碼、檢索；另記錄各階段（檢索、提示詞組裝、生成等待）的實際經過時間，
+補足 cProfile 無法呈現的 await 等待。結果保存為 pstats 檔（可用 snakeviz、flameprof 等工具開啟）
+與摘要 JSON
+
+未剖析時各埋點只多一次 contextvar 讀取：stage() 返回共用的空 context manager，
+threaded() 直接返回原函式
+
+注意: 事件迴圈執行緒上的剖析器會一併記錄同時段其他請求的協程；同一程序同時只剖析一個請求
+"""
+import cProfile
+import json
+import logging
+import os
+import pstats
+import random
+import re
+import secrets
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from datetime import datetime
+from functools import wraps
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+# 確保日誌目錄存在
+log_dir = Path("logs")
+log_dir.mkdir(exist_ok=True)
+
+# 配置請求剖析專用日誌
+logger = logging.getLogger(__name__)
+profiler_handler = logging.FileHandler(
+    log_dir / "request_profiler.log", encoding='utf-8')
+profiler_handler.setFormatter(logging.Formatter(
+    '%(asctime)s - %(levelname)s - %(message)s'))
+logger.addHandler(profiler_handler)
+
+_PROFILE_ID = re.compile(r"^[0-9]{8}-[0-9]{6}-[0-9a-f]{6}$")
+_NOOP = nullcontext()
+_active: ContextVar[Optional["RequestProfile"]] = ContextVar("edurail_profile", default=None)
+
+
+class RequestProfile:
+    """單一請求的剖析資料"""
+
+    def __init__(self, profile_id: str, label: str):
+        self.profile_id = profile_id
+        self.label = label
+        self.started = time.perf_counter()
+        self.profilers: List[cProfile.Profile] = []
+        self.stages: List[Dict] = []
+        self._lock = threading.Lock()
+
+    def add_profiler(self, profiler: cProfile.Profile):
+        with self._lock:
+            self.profilers.append(profiler)
+
+    def add_stage(self, name: str, began: float, ended: float):
+        with self._lock:
+            self.stages.append({"stage": name,
+                                "start_ms": round((began - self.started) * 1000, 3),
+                                "duration_ms": round((ended - began) * 1000, 3)})
+
+
+@contextmanager
+def _timed_stage(profile: RequestProfile, name: str):
+    began = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.add_stage(name, began, time.perf_counter())
+
+
+def stage(name: str):
+    """
+    記錄一個處理階段的經過時間（未剖析時為空操作）
+
+    參數:
+        name: 階段名稱
+    """
+    profile = _active.get()
+    if profile is None:
+        return _NOOP
+    return _timed_stage(profile, name)
+
+
+def threaded(fn: Callable) -> Callable:
+    """
+    包裝要交給 asyncio.to_thread 執行的函式，剖析時於該執行緒另啟剖析器
+    （未剖析時直接返回原函式）
+    """
+    profile = _active.get()
+    if profile is None:
+        return fn
+
+    @wraps(fn)
+    def run(*args, **kwargs):
+        profiler = cProfile.Profile()
+        profile.add_profiler(profiler)
+        profiler.enable()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            profiler.disable()
+    return run
+
+
+class RequestProfiler:
+    """請求剖析管理類別"""
+
+    def __init__(self, directory: str = "profiles", sample_rate: float = 0.0,
+                 keep: int = 50, top_functions: int = 30):
+        """
+        初始化剖析管理
+
+        參數:
+            directory: 剖析結果保存目錄
+            sample_rate: 未指定剖析的請求被抽樣剖析的比例（0 表示只剖析指定的請求）
+            keep: 保留的剖析結果數，超過時刪除最舊的
+            top_functions: 摘要中列出的函式數（依累計時間排序）
+        """
+        self.directory = Path(directory)
+        self.sample_rate = sample_rate
+        self.keep = keep
+        self.top_functions = top_functions
+        self.stats = {"profiled": 0, "requested": 0, "sampled": 0, "skipped_busy": 0}
+        self._busy = threading.Lock()
+
+    def maybe(self, label: str, requested: bool = False, meta: Optional[Dict] = None):
+        """需要剖析（指定或抽樣命中）時返回 capture()，否則返回共用的空 context manager"""
+        if not requested and not (self.sample_rate > 0 and random.random() < self.sample_rate):
+            return _NOOP
+        return self.capture(label, requested, meta)
+
+    @contextmanager
+    def capture(self, label: str, requested: bool = False, meta: Optional[Dict] = None):
+        """
+        於區塊內剖析目前的請求，產出 RequestProfile（未剖析時為 None）
+
+        參數:
+            label: 請求類別（例如 chat）
+            requested: 是否為指定剖析（否則為抽樣）
+            meta: 寫入摘要的附加資訊
+        """
+        if not self._busy.acquire(blocking=False):
+            # cProfile 同一執行緒只能有一個剖析器生效，另一個請求剖析中時略過
+            self.stats["skipped_busy"] += 1
+            yield None
+            return
+        profile = RequestProfile(
+            f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{secrets.token_hex(3)}", label)
+        profiler = cProfile.Profile()
+        profile.add_profiler(profiler)
+        token = _active.set(profile)
+        profiler.enable()
+        try:
+            yield profile
+        finally:
+            profiler.disable()
+            _active.reset(token)
+            self._busy.release()
+            self.stats["requested" if requested else "sampled"] += 1
+            try:
+                self._save(profile, requested, meta or {})
+            except Exception as e:
+                logger.error(f"保存剖析結果時發生錯誤: {str(e)}")
+
+    def _save(self, profile: RequestProfile, requested: bool, meta: Dict):
+        """合併各執行緒的剖析資料，寫出 pstats 檔與摘要"""
+        elapsed = time.perf_counter() - profile.started
+        self.directory.mkdir(parents=True, exist_ok=True)
+        stats = pstats.Stats(profile.profilers[0])
+        for extra in profile.profilers[1:]:
+            # 執行緒中的函式若未執行完畢（例如逾時）可能沒有資料
+            if extra.getstats():
+                stats.add(extra)
+        prof_path = self.directory / f"{profile.profile_id}.prof"
+        stats.dump_stats(str(prof_path))
+
+        entries = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)
+        summary = {
+            "profile_id": profile.profile_id,
+            "label": profile.label,
+            "trigger": "requested" if requested else "sampled",
+            "created_at": datetime.now().isoformat(),
+            "wall_ms": round(elapsed * 1000, 3),
+            "threads": len(profile.profilers),
+            "stages": sorted(profile.stages, key=lambda s: s["start_ms"]),
+            "top_functions": [{
+                "function": f"{Path(filename).name}:{line}({name})",
+                "calls": calls,
+                "tottime_ms": round(tottime * 1000, 3),
+                "cumtime_ms": round(cumtime * 1000, 3)
+            } for (filename, line, name), (_, calls, tottime, cumtime, _)
+                in entries[:self.top_functions]],
+            **meta
+        }
+        tmp_path = self.directory / f".{profile.profile_id}.{os.getpid()}.json"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.directory / f"{profile.profile_id}.json")
+        self.stats["profiled"] += 1
+        logger.info(f"已保存請求剖析 {profile.profile_id}（{profile.label}，"
+                    f"{summary['wall_ms']:.1f} ms）")
+        self._prune()
+
+    def _prune(self):
+        """只保留最新的 keep 份剖析結果"""
+        summaries = sorted(self.directory.glob("*.json"))
+        for path in summaries[:-self.keep] if self.keep > 0 else []:
+            path.unlink(missing_ok=True)
+            path.with_suffix(".prof").unlink(missing_ok=True)
+
+    def path_for(self, profile_id: str, suffix: str) -> Optional[Path]:
+        """剖析結果檔路徑（編號格式不符或檔案不存在時返回 None）"""
+        if not _PROFILE_ID.match(profile_id):
+            return None
+        path = self.directory / f"{profile_id}{suffix}"
+        return path if path.exists() else None
+
+    def summary(self, profile_id: str) -> Optional[Dict]:
+        path = self.path_for(profile_id, ".json")
+        if path is None:
+            return None
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def list(self) -> List[Dict]:
+        """已保存的剖析結果（新到舊）"""
+        results = []
+        for path in sorted(self.directory.glob("*.json"), reverse=True):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    summary = json.load(f)
+            except (OSError, ValueError):
+                continue
+            results.append({key: summary.get(key) for key in
+                            ("profile_id", "label", "trigger", "created_at", "wall_ms")})
+        return results
+
+    def snapshot(self) -> Dict:
+        return {"sample_rate": self.sample_rate, **self.stats}
@@ -0,0 +1,157 @@
+"""
+多輪對話工作階段
+以 session_id 保存每位使用者的對話狀態，將舊回合壓縮為摘要，只把摘要與最近幾輪送給模型，
+避免每一輪都重新預填 (prefill) 完整對話
+"""
+import logging
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from cache_utils import LRUCache
+from generation_profiles import estimate_tokens
+
+# 確保日誌目錄存在
+log_dir = Path("logs")
+log_dir.mkdir(exist_ok=True)
+
+# 配置工作階段專用日誌
+logger = logging.getLogger(__name__)
+session_handler = logging.FileHandler(
+    log_dir / "session_store.log", encoding='utf-8')
+session_handler.setFormatter(logging.Formatter(
+    '%(asctime)s - %(levelname)s - %(message)s'))
+logger.addHandler(session_handler)
+
+
+class ConversationSession:
+    """單一對話工作階段"""
+
+    __slots__ = ("session_id", "summary", "turns", "created_at", "updated_at",
+                 "total_turns", "history_tokens", "summarizing")
+
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+        self.summary = ""
+        self.turns: List[Dict[str, str]] = []
+        self.created_at = time.time()
+        self.updated_at = self.created_at
+        self.total_turns = 0
+        # 完整對話（未壓縮）的累計估計 token 數，用於計算節省的預填量
+        self.history_tokens = 0
+        self.summarizing = False
+
+    def messages(self) -> List[Dict[str, str]]:
+        """組成送給 Ollama 的歷史訊息：摘要（若有）加上最近幾輪"""
+        messages = []
+        if self.summary:
+            messages.append({"role": "system", "content": f"先前對話摘要：{self.summary}"})
+        for turn in self.turns:
+            messages.append({"role": "user", "content": turn["user"]})
+            messages.append({"role": "assistant", "content": turn["assistant"]})
+        return messages
+
+    def approx_bytes(self) -> int:
+        """估計工作階段佔用的記憶體"""
+        return sys.getsizeof(self.summary) + sum(
+            sys.getsizeof(t["user"]) + sys.getsizeof(t["assistant"]) + 64
+            for t in self.turns) + 256
+
+    def to_dict(self) -> Dict:
+        return {
+            "session_id": self.session_id,
+            "summary": self.summary,
+            "turns": list(self.turns),
+            "total_turns": self.total_turns,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at
+        }
+
+
+class SessionStore:
+    """對話工作階段儲存類別（LRU + TTL + 記憶體上限）"""
+
+    def __init__(self, max_sessions: int = 10000,
+                 max_bytes: int = 64 * 1024 * 1024,
+                 ttl: float = 3600.0,
+                 max_turns: int = 6,
+                 keep_turns: int = 3,
+                 max_summary_chars: int = 600):
+        """
+        初始化工作階段儲存
+
+        參數:
+            max_sessions: 最多保留的工作階段數
+            max_bytes: 工作階段估計佔用記憶體上限
+            ttl: 閒置多少秒後淘汰
+            max_turns: 保留原文的回合數超過此值時觸發壓縮
+            keep_turns: 壓縮後保留原文的最近回合數
+            max_summary_chars: 摘要的最大字數
+        """
+        self.max_turns = max_turns
+        self.keep_turns = keep_turns
+        self.max_summary_chars = max_summary_chars
+        self.sessions = LRUCache(
+            max_entries=max_sessions, max_bytes=max_bytes, ttl=ttl,
+            size_fn=lambda s: s.approx_bytes())
+        self.stats = {"turns": 0, "compactions": 0, "prefill_tokens_saved": 0}
+
+    def get(self, session_id: str, create: bool = True) -> Optional[ConversationSession]:
+        """取得工作階段，不存在時依 create 決定是否建立"""
+        session = self.sessions.get(session_id)
+        if session is None and create:
+            session = ConversationSession(session_id)
+            self.sessions.put(session_id, session)
+            logger.info(f"建立新的對話工作階段: {session_id}")
+        return session
+
+    def delete(self, session_id: str) -> bool:
+        """刪除工作階段"""
+        return self.sessions.pop(session_id) is not None
+
+    def needs_compaction(self, session: ConversationSession) -> bool:
+        return len(session.turns) > self.max_turns
+
+    def compact(self, session: ConversationSession) -> List[Dict[str, str]]:
+        """
+        將較舊的回合移出原文區並以擷取式摘要併入 summary
+
+        返回:
+            被移出的回合（供需要時以模型產生更精簡的摘要）
+        """
+        if not self.needs_compaction(session):
+            return []
+        old_turns = session.turns[:-self.keep_turns]
+        session.turns = session.turns[-self.keep_turns:]
+        lines = [session.summary] if session.summary else []
+        for turn in old_turns:
+            lines.append(f"使用者問：{turn['user'][:60]}；助理答：{turn['assistant'][:80]}")
+        summary = "\n".join(lines)
+        if len(summary) > self.max_summary_chars:
+            summary = summary[-self.max_summary_chars:]
+        session.summary = summary
+        self.stats["compactions"] += 1
+        self.sessions.touch(session.session_id)
+        return old_turns
+
+    def record_turn(self, session: ConversationSession, user_message: str,
+                    assistant_message: str) -> List[Dict[str, str]]:
+        """
+        記錄一個完成的回合，必要時壓縮舊回合
+
+        返回:
+            因壓縮而移出原文區的回合
+        """
+        session.turns.append({"user": user_message, "assistant": assistant_message})
+        session.total_turns += 1
+        session.history_tokens += estimate_tokens(user_message) + \
+            estimate_tokens(assistant_message)
+        session.updated_at = time.time()
+        self.stats["turns"] += 1
+        old_turns = self.compact(session)
+        self.sessions.touch(session.session_id)
+        return old_turns
+
+    def snapshot(self) -> Dict:
+        return {**self.sessions.snapshot(), **self.stats}
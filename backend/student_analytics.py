@@ -0,0 +1,387 @@
+"""
+學生學習成效分析
+將學習歷程資料表（data.csv）一次載入為 NumPy 矩陣，以向量化運算完成標準化、百分等級、
+k-means 分群與最近同儕（kNN）計算；分群結果依資料內容與參數版本化並保存於快取目錄，
+每位學生的分析結果另以 LRU 快取。前端只需取得單一學生的結果，不必下載整份資料
+
+使用方式:
+    python student_analytics.py --user 2697
+    python student_analytics.py --info
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from cache_utils import LRUCache
+
+# 確保日誌目錄存在
+log_dir = Path("logs")
+log_dir.mkdir(exist_ok=True)
+
+# 配置學習分析專用日誌
+logger = logging.getLogger(__name__)
+analytics_handler = logging.FileHandler(
+    log_dir / "student_analytics.log", encoding='utf-8')
+analytics_handler.setFormatter(logging.Formatter(
+    '%(asctime)s - %(levelname)s - %(message)s'))
+logger.addHandler(analytics_handler)
+
+MODEL_FORMAT_VERSION = 1
+ID_COLUMN = "user_sn"
+# 分群與同儕比較使用的學習行為指標（organization_id 為類別欄位，不納入距離計算）
+FEATURE_COLUMNS = [
+    "review_mean_time_spent", "review_mean_finish_rate",
+    "prac_mean_items_ans_time", "prac_mean_binary_res_Q",
+    "exam_mean_ans_time_num", "exam_mean_binary_res",
+    "user_exam_count", "user_prac_count", "user_review_count",
+    "total_score", "pr", "correct_rate", "mission_count", "question_count"
+]
+# 同儕列表中顯示的指標
+PEER_SUMMARY_COLUMNS = ["total_score", "pr", "correct_rate", "mission_count", "question_count"]
+
+
+def load_learning_table(csv_path) -> Tuple[List[str], np.ndarray, np.ndarray]:
+    """
+    讀取學習歷程資料表
+
+    參數:
+        csv_path: 資料表路徑
+
+    返回:
+        (學生編號列表, (n, len(FEATURE_COLUMNS)) 指標矩陣, 組織編號陣列)
+    """
+    df = pd.read_csv(csv_path, dtype={ID_COLUMN: str})
+    missing = [c for c in FEATURE_COLUMNS + [ID_COLUMN] if c not in df.columns]
+    if missing:
+        raise ValueError(f"資料表缺少欄位: {missing}")
+    raw = df[FEATURE_COLUMNS].apply(pd.to_numeric, errors='coerce') \
+        .fillna(0.0).to_numpy(dtype=np.float64)
+    user_ids = df[ID_COLUMN].astype(str).str.strip().tolist()
+    organizations = np.full(len(df), -1, dtype=np.int64)
+    if "organization_id" in df.columns:
+        organizations = pd.to_numeric(df["organization_id"], errors='coerce') \
+            .fillna(-1).to_numpy(dtype=np.int64)
+    return user_ids, raw, organizations
+
+
+def _squared_distances(x: np.ndarray, centers: np.ndarray) -> np.ndarray:
+    """(n, d) 與 (k, d) 兩兩之間的平方歐氏距離，以矩陣乘法計算"""
+    d = (x * x).sum(axis=1)[:, None] - 2 * x @ centers.T + (centers * centers).sum(axis=1)[None, :]
+    return np.maximum(d, 0.0)
+
+
+def kmeans(x: np.ndarray, k: int, seed: int = 0, n_init: int = 4,
+           max_iter: int = 100, tol: float = 1e-6) -> Tuple[np.ndarray, np.ndarray, float]:
+    """
+    向量化 k-means（k-means++ 初始化，取 n_init 次中慣性最小者）
+
+    參數:
+        x: (n, d) 特徵矩陣
+        k: 群數（大於資料筆數時以筆數為準）
+        seed: 亂數種子（固定種子讓結果可重現）
+        n_init: 重新初始化次數
+        max_iter: 每次最多迭代數
+        tol: 中心移動量小於此值時停止
+
+    返回:
+        (每筆的群編號, (k, d) 群中心, 慣性)
+    """
+    n = len(x)
+    k = max(1, min(k, n))
+    rng = np.random.default_rng(seed)
+    best: Optional[Tuple[np.ndarray, np.ndarray, float]] = None
+    for _ in range(n_init):
+        centers = x[[rng.integers(n)]]
+        for _ in range(1, k):
+            d = _squared_distances(x, centers).min(axis=1)
+            total = d.sum()
+            pick = rng.choice(n, p=d / total) if total > 0 else rng.integers(n)
+            centers = np.vstack([centers, x[pick]])
+
+        for _ in range(max_iter):
+            labels = _squared_distances(x, centers).argmin(axis=1)
+            counts = np.bincount(labels, minlength=k)
+            sums = np.zeros_like(centers)
+            np.add.at(sums, labels, x)
+            # 空群保留原中心
+            new_centers = np.where(counts[:, None] > 0,
+                                   sums / np.maximum(counts, 1)[:, None], centers)
+            shift = np.abs(new_centers - centers).max()
+            centers = new_centers
+            if shift < tol:
+                break
+
+        distances = _squared_distances(x, centers)
+        labels = distances.argmin(axis=1)
+        inertia = float(distances[np.arange(n), labels].sum())
+        if best is None or inertia < best[2]:
+            best = (labels, centers, inertia)
+    return best
+
+
+class AnalyticsModel:
+    """單一資料版本的分析結果（唯讀）"""
+
+    def __init__(self, version: str, user_ids: List[str], raw: np.ndarray,
+                 organizations: np.ndarray):
+        self.version = version
+        self.user_ids = user_ids
+        self.index = {sn: i for i, sn in enumerate(user_ids)}
+        self.raw = raw
+        self.organizations = organizations
+        self.mean = raw.mean(axis=0)
+        std = raw.std(axis=0)
+        self.std = np.where(std > 0, std, 1.0)
+        self.z = (raw - self.mean) / self.std
+        # 各欄位的百分等級（不高於該值的比例）
+        ordered = np.sort(raw, axis=0)
+        self.percentiles = np.column_stack([
+            np.searchsorted(ordered[:, j], raw[:, j], side='right')
+            for j in range(raw.shape[1])]) * (100.0 / len(raw))
+
+    def set_clusters(self, labels: np.ndarray, centers: np.ndarray, inertia: float):
+        """設定分群結果（於標準化空間）"""
+        self.labels = labels
+        self.centers = centers
+        self.inertia = inertia
+        self.cluster_sizes = np.bincount(labels, minlength=len(centers))
+
+    def centroid(self, cluster: int) -> Dict[str, float]:
+        """群中心（還原為原始單位）"""
+        values = self.centers[cluster] * self.std + self.mean
+        return {col: round(float(v), 4) for col, v in zip(FEATURE_COLUMNS, values)}
+
+    def nearest(self, row: int, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """標準化空間中距離最近的 k 位同儕（不含本人），返回 (列號, 距離)"""
+        d = ((self.z - self.z[row]) ** 2).sum(axis=1)
+        d[row] = np.inf
+        k = min(k, len(d) - 1)
+        if k <= 0:
+            return np.empty(0, dtype=int), np.empty(0)
+        peers = np.argpartition(d, k - 1)[:k]
+        peers = peers[np.argsort(d[peers], kind="stable")]
+        return peers, np.sqrt(d[peers])
+
+
+class StudentAnalytics:
+    """學生學習成效分析服務類別"""
+
+    def __init__(self, csv_path: str, cache_dir: str = "analytics",
+                 clusters: int = 4, seed: int = 0,
+                 refresh_interval: float = 30.0, cache_size: int = 4096):
+        """
+        初始化分析服務
+
+        參數:
+            csv_path: 學習歷程資料表路徑
+            cache_dir: 分群結果快取目錄
+            clusters: k-means 群數
+            seed: 分群亂數種子
+            refresh_interval: 檢查資料檔是否更新的間隔秒數（0 表示不檢查）
+            cache_size: 每位學生分析結果的快取筆數
+        """
+        self.csv_path = Path(csv_path)
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.clusters = clusters
+        self.seed = seed
+        self.refresh_interval = refresh_interval
+        self.results = LRUCache(max_entries=cache_size)
+        self.model: Optional[AnalyticsModel] = None
+        self.stats = {"loads": 0, "model_cache_hits": 0, "fit_ms": None, "last_error": None}
+        self._mtime: Optional[float] = None
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+        self.load()
+
+    def _version(self, content: bytes) -> str:
+        """資料內容與分析參數的雜湊值"""
+        digest = hashlib.sha256(content)
+        digest.update(json.dumps({"format": MODEL_FORMAT_VERSION, "features": FEATURE_COLUMNS,
+                                  "clusters": self.clusters, "seed": self.seed}).encode('utf-8'))
+        return digest.hexdigest()[:16]
+
+    def load(self) -> bool:
+        """
+        載入資料表並建立分析模型；同一版本的分群結果由快取目錄讀取
+
+        返回:
+            是否成功載入
+        """
+        with self._lock:
+            self._last_check = time.monotonic()
+            try:
+                mtime = self.csv_path.stat().st_mtime
+                content = self.csv_path.read_bytes()
+                version = self._version(content)
+                if self.model is not None and self.model.version == version:
+                    self._mtime = mtime
+                    return True
+
+                model = AnalyticsModel(version, *load_learning_table(self.csv_path))
+
+                model_path = self.cache_dir / f"model_{version}.npz"
+                if model_path.exists():
+                    cached = np.load(model_path)
+                    model.set_clusters(cached["labels"], cached["centers"],
+                                       float(cached["inertia"]))
+                    self.stats["model_cache_hits"] += 1
+                else:
+                    began = time.perf_counter()
+                    model.set_clusters(*kmeans(model.z, self.clusters, self.seed))
+                    self.stats["fit_ms"] = round((time.perf_counter() - began) * 1000, 2)
+                    tmp_path = self.cache_dir / f".model_{version}.{os.getpid()}.npz"
+                    np.savez(tmp_path, labels=model.labels, centers=model.centers,
+                             inertia=model.inertia)
+                    os.replace(tmp_path, model_path)
+
+                self.model = model
+                self._mtime = mtime
+                self.stats["loads"] += 1
+                self.stats["last_error"] = None
+                logger.info(f"載入學習分析資料版本 {version}，共 {len(model.user_ids)} 位學生、"
+                            f"{len(model.centers)} 群")
+                return True
+            except Exception as e:
+                self.stats["last_error"] = str(e)
+                logger.error(f"載入學習分析資料時發生錯誤: {str(e)}")
+                return False
+
+    def _maybe_refresh(self):
+        """定期檢查資料檔是否更新"""
+        now = time.monotonic()
+        if self.refresh_interval <= 0 or now - self._last_check < self.refresh_interval:
+            return
+        self._last_check = now
+        try:
+            if self.csv_path.stat().st_mtime != self._mtime:
+                self.load()
+        except FileNotFoundError:
+            pass
+
+    def current(self) -> Optional[AnalyticsModel]:
+        """目前的分析模型（尚未成功載入時為 None）"""
+        self._maybe_refresh()
+        return self.model
+
+    def users(self) -> List[str]:
+        model = self.current()
+        return list(model.user_ids) if model else []
+
+    def user_report(self, user_sn: str, peers: int = 5) -> Optional[Dict]:
+        """
+        單一學生的分析結果
+
+        參數:
+            user_sn: 學生編號
+            peers: 最近同儕數
+
+        返回:
+            指標、百分等級、所屬群與最近同儕摘要；找不到學生時返回 None
+        """
+        model = self.current()
+        if model is None:
+            return None
+        key = (model.version, user_sn, peers)
+        cached = self.results.get(key)
+        if cached is not None:
+            return cached
+        row = model.index.get(user_sn)
+        if row is None:
+            return None
+
+        cluster = int(model.labels[row])
+        peer_rows, distances = model.nearest(row, peers)
+        summary_idx = [FEATURE_COLUMNS.index(c) for c in PEER_SUMMARY_COLUMNS]
+        report = {
+            "version": model.version,
+            "user_sn": user_sn,
+            "organization_id": int(model.organizations[row]),
+            "features": {c: float(v) for c, v in zip(FEATURE_COLUMNS, model.raw[row])},
+            "percentiles": {c: round(float(v), 2)
+                            for c, v in zip(FEATURE_COLUMNS, model.percentiles[row])},
+            "cluster": {
+                "id": cluster,
+                "size": int(model.cluster_sizes[cluster]),
+                "centroid": model.centroid(cluster),
+                "distance": round(float(np.sqrt(((model.z[row] - model.centers[cluster]) ** 2)
+                                                .sum())), 4)
+            },
+            # 同儕僅提供指標摘要，不包含其他學生的編號
+            "peers": [{"distance": round(float(d), 4),
+                       "same_cluster": bool(model.labels[p] == cluster),
+                       **{c: float(model.raw[p, j]) for c, j in zip(PEER_SUMMARY_COLUMNS, summary_idx)}}
+                      for p, d in zip(peer_rows, distances)],
+            "peer_mean": {c: round(float(v), 4) for c, v in zip(
+                FEATURE_COLUMNS, model.raw[peer_rows].mean(axis=0))} if len(peer_rows) else {}
+        }
+        self.results.put(key, report)
+        return report
+
+    def cohort(self, x: str, y: str) -> Optional[Dict]:
+        """
+        全體學生在兩個指標上的分佈（不含學生編號），供散佈圖使用
+
+        參數:
+            x: 橫軸指標
+            y: 縱軸指標
+        """
+        model = self.current()
+        if model is None:
+            return None
+        if x not in FEATURE_COLUMNS or y not in FEATURE_COLUMNS:
+            raise ValueError(f"指標必須為: {FEATURE_COLUMNS}")
+        key = (model.version, "cohort", x, y)
+        cached = self.results.get(key)
+        if cached is not None:
+            return cached
+        xi, yi = FEATURE_COLUMNS.index(x), FEATURE_COLUMNS.index(y)
+        result = {
+            "version": model.version,
+            "x": x,
+            "y": y,
+            "points": [[float(a), float(b), int(c)] for a, b, c in
+                       zip(model.raw[:, xi], model.raw[:, yi], model.labels)],
+            "clusters": [{"id": i, "size": int(model.cluster_sizes[i]),
+                          "centroid": model.centroid(i)} for i in range(len(model.centers))]
+        }
+        self.results.put(key, result)
+        return result
+
+    def snapshot(self) -> Dict:
+        model = self.model
+        return {
+            "version": model.version if model else None,
+            "students": len(model.user_ids) if model else 0,
+            "clusters": len(model.centers) if model else 0,
+            "inertia": model.inertia if model else None,
+            **self.stats,
+            "result_cache": self.results.snapshot()
+        }
+
+
+if __name__ == "__main__":
+    import config
+
+    parser = argparse.ArgumentParser(description="學生學習成效分析")
+    parser.add_argument("--csv", default=config.ANALYTICS_CSV_PATH)
+    parser.add_argument("--user", help="顯示指定學生的分析結果")
+    parser.add_argument("--info", action="store_true")
+    args = parser.parse_args()
+
+    analytics = StudentAnalytics(args.csv, config.ANALYTICS_CACHE_DIR,
+                                 clusters=config.ANALYTICS_CLUSTERS)
+    if args.info:
+        print(json.dumps(analytics.snapshot(), ensure_ascii=False, indent=2))
+    if args.user:
+        print(json.dumps(analytics.user_report(args.user, config.ANALYTICS_PEERS),
+                         ensure_ascii=False, indent=2))